@@ -0,0 +1,265 @@
+"""
+Admission control for the Gemini endpoints.
+Each learner (source IP + lesson) gets a token bucket (burst + steady refill),
+and a global gate caps concurrent Gemini work with a short, bounded wait queue.
+Anything over either limit is shed immediately with 429 + Retry-After instead
+of queueing until every request times out together.
+
+Buckets live in process; on Lambda every container only sees its own traffic,
+so RATE_LIMIT_TABLE optionally adds a per-minute counter in DynamoDB that is
+shared by all containers.
+
+Learners are keyed on the source address the gateway reports plus the lesson
+id the frontend puts in the query string, so a class behind one school NAT
+does not share a single bucket. The Gemini API is unauthenticated and a lesson
+id can be changed per request, so every source address also has its own,
+larger bucket (sized for a shared egress: a class of ~30 working at once)
+that a caller cannot reset.
+
+Config (environment):
+    RATE_LIMIT_PER_MINUTE    steady requests per learner (IP + lesson) per minute
+    RATE_LIMIT_BURST         extra requests a learner may make back-to-back
+    CLIENT_RATE_PER_MINUTE   steady requests per source IP per minute (all its learners)
+    CLIENT_RATE_BURST        extra requests a source IP may make back-to-back
+    MAX_CONCURRENT_REQUESTS  Gemini requests served at once per container
+    MAX_QUEUED_REQUESTS      requests allowed to wait for a slot
+    QUEUE_TIMEOUT_SECONDS    longest a queued request waits before a 429
+    RATE_LIMIT_TABLE         DynamoDB table for the shared counter ("" = off)
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+from collections import OrderedDict
+import lesson_store
+from instrumentation import add_metric
+
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "20"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "5"))
+CLIENT_RATE_PER_MINUTE = int(os.environ.get("CLIENT_RATE_PER_MINUTE", "300"))
+CLIENT_RATE_BURST = int(os.environ.get("CLIENT_RATE_BURST", "60"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "16"))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", "32"))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("QUEUE_TIMEOUT_SECONDS", "10"))
+RATE_LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE", "")
+
+# Routes that call Gemini; everything else (/, preflights) is never limited
+ADMISSION_PATHS = {"/chat-stream", "/generate-quiz", "/generate-quiz-stream", "/grade-quiz",
+                   "/generate-test", "/generate-test-stream", "/grade-image"}
+
+# Counters since container start (also added to the per-request metrics)
+stats = {"accepted": 0, "queued": 0, "rejected": 0}
+
+
+class Rejected(Exception):
+    """Request shed by admission control."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket; `take` returns 0 when allowed, else seconds until the next token."""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Per-key buckets (bounded LRU), plus the optional shared DynamoDB counter."""
+
+    def __init__(self, per_minute: int = None, burst: int = None, table=None, max_keys: int = 10000):
+        self.per_minute = per_minute or RATE_LIMIT_PER_MINUTE
+        self.burst = RATE_LIMIT_BURST if burst is None else burst
+        self.table = table
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    async def check(self, identity: str) -> float:
+        """Consume one request for `identity`; returns 0 if allowed, else Retry-After seconds."""
+        bucket = self.buckets.get(identity)
+        if bucket is None:
+            bucket = self.buckets[identity] = TokenBucket(self.per_minute + self.burst, self.per_minute / 60)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(identity)
+
+        wait = bucket.take()
+        if wait or self.table is None:
+            return wait
+        return await self._check_shared(identity)
+
+    async def _check_shared(self, identity: str) -> float:
+        """Fixed one-minute window counted across containers; fails open if DynamoDB is unavailable."""
+        now = time.time()
+        window = int(now // 60)
+        try:
+            # On the DynamoDB executor: a slow round trip must not stall every stream on the loop
+            await lesson_store.run(
+                self.table.update_item,
+                Key={'bucketKey': f"{identity}#{window}"},
+                UpdateExpression="ADD hits :one SET expiresAt = :exp",
+                ConditionExpression="attribute_not_exists(hits) OR hits < :limit",
+                ExpressionAttributeValues={
+                    ':one': 1,
+                    ':exp': (window + 2) * 60,
+                    ':limit': self.per_minute + self.burst,
+                }
+            )
+            return 0.0
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return (window + 1) * 60 - now
+        except Exception as e:
+            print(f"Warning: Shared rate limit check failed, allowing request. {e}")
+            return 0.0
+
+
+class ConcurrencyGate:
+    """Global cap on in-flight requests with a bounded FIFO wait queue."""
+
+    def __init__(self, max_active: int = None, max_queued: int = None, timeout: float = None):
+        self.max_active = max_active or MAX_CONCURRENT_REQUESTS
+        self.max_queued = MAX_QUEUED_REQUESTS if max_queued is None else max_queued
+        self.timeout = timeout or QUEUE_TIMEOUT_SECONDS
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(self.max_active)
+
+    async def acquire(self) -> bool:
+        """Take a slot; returns True if the request had to queue. Raises Rejected when full."""
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            self.active += 1
+            return False
+        if self.waiting >= self.max_queued:
+            raise Rejected("queue_full", self.timeout)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise Rejected("queue_timeout", self.timeout)
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+
+def client_identity(scope) -> str:
+    """
+    Source IP of the request. Mangum fills `client` from the gateway's request
+    context; without it, the last X-Forwarded-For hop (the one the proxy added;
+    earlier hops are whatever the caller sent).
+    """
+    client = scope.get("client")
+    if client and client[0]:
+        return f"ip#{client[0]}"
+    headers = dict(scope.get("headers") or [])
+    forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")[-1].strip()
+    return f"ip#{forwarded or 'unknown'}"
+
+
+def request_identity(scope) -> str:
+    """Source IP + the lesson in the query string (the body is not read here)."""
+    lesson = ""
+    for pair in (scope.get("query_string") or b"").decode("latin-1").split("&"):
+        name, _, value = pair.partition("=")
+        if name == "lesson_id" and value:
+            lesson = value[:128]
+            break
+    return f"{client_identity(scope)}#lesson#{lesson}"
+
+
+def _count(name: str):
+    stats[name] += 1
+    add_metric(f"admission_{name}", 1)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: rate-limit, then hold a concurrency slot until the last
+    body chunk is sent (so a streaming response keeps its slot while it streams).
+    """
+
+    def __init__(self, app, limiter: RateLimiter = None, gate: ConcurrencyGate = None, paths=None,
+                 client_limiter: RateLimiter = None):
+        self.app = app
+        self.limiter = limiter or RateLimiter()
+        self.client_limiter = client_limiter or RateLimiter(CLIENT_RATE_PER_MINUTE, CLIENT_RATE_BURST)
+        self.gate = gate or ConcurrencyGate()
+        self.paths = paths or ADMISSION_PATHS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        try:
+            retry_after = await self.limiter.check(request_identity(scope))
+            if not retry_after:
+                retry_after = await self.client_limiter.check(client_identity(scope))
+            if retry_after:
+                raise Rejected("rate_limited", retry_after)
+            if await self.gate.acquire():
+                _count("queued")
+        except Rejected as e:
+            _count("rejected")
+            return await self._reject(send, e)
+        _count("accepted")
+
+        state = {"released": False}
+
+        def release():
+            if not state["released"]:
+                state["released"] = True
+                self.gate.release()
+
+        async def send_wrapper(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                release()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release()
+
+    @staticmethod
+    async def _reject(send, rejected: Rejected):
+        retry_after = max(1, math.ceil(rejected.retry_after))
+        body = json.dumps({
+            "error": "Too many requests, please try again shortly.",
+            "reason": rejected.reason,
+            "retryAfter": retry_after,
+        }).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
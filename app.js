@@ -61,9 +61,12 @@ window.handleProfilePictureChange = async function (event) {
         if (!email) return;
 
         try {
-            await fetch(`${API_BASE}/profile/picture`, {
+            // Raw binary body (avatar-sized): no base64-in-JSON inflation on the wire
+            const avatar = await resizeImage(file, 512);
+            await fetch(`${API_BASE}/profile/picture?email=${encodeURIComponent(email)}`, {
                 method: 'POST',
-                body: JSON.stringify({ email, profilePicture: base64 })
+                headers: { 'Content-Type': avatar.type || file.type },
+                body: avatar
             });
             currentProfile.profilePicture = base64;
         } catch (err) {
@@ -953,22 +956,20 @@ window.sendChatMessage = async function (lessonId) {
 
     // 2. Fetch with Streaming Support (Multimodal)
     const imgInput = document.getElementById('chat-img-input');
-    let imageData = null;
+    const form = new FormData();
+    form.append('message', msg);
+    form.append('lesson_id', lessonId);
 
     if (imgInput && imgInput.files.length > 0) {
-        imageData = await toBase64(imgInput.files[0]);
+        // Send image as a binary part (browser sets the multipart boundary)
+        form.append('image', await resizeImage(imgInput.files[0]), 'image.jpg');
     }
 
     try {
-        const response = await fetch(`${GEMINI_API_URL}/chat-stream`, {
+        const response = await geminiFetch('/chat-stream', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                message: msg,
-                lesson_id: lessonId,
-                image: imageData // Send image as base64
-            })
-        });
+            body: form
+        }, lessonId);
 
         if (!response.ok) throw new Error("Stream connection failed");
 
@@ -978,13 +979,36 @@ window.sendChatMessage = async function (lessonId) {
             document.getElementById('img-preview').style.display = 'none';
         }
 
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        let reader = response.body.getReader();
+        let decoder = new TextDecoder();
         let aiContent = "";
+        let turn = null; // { id, position } assigned by the server for idempotent history writes
+        let lastEventId = null; // "<turnId>:<seq>" of the last frame, to resume a dropped stream
+        let resumes = 0;
+        let pending = ""; // Partial line carried over to the next chunk
         aiBubble.innerText = ""; // Clear placeholder
 
         while (true) {
-            const { done, value } = await reader.read();
+            let result;
+            try {
+                result = await reader.read();
+            } catch (readErr) {
+                // Connection dropped mid-answer: replay the rest of this turn instead of asking again
+                if (!lastEventId || resumes >= MAX_STREAM_RESUMES) throw readErr;
+                resumes++;
+                console.warn(`Stream dropped, resuming after ${lastEventId} (attempt ${resumes})`);
+                const retry = await geminiFetch('/chat-stream', {
+                    method: 'POST',
+                    headers: { 'Last-Event-ID': lastEventId },
+                    body: form
+                }, lessonId);
+                if (!retry.ok) throw readErr;
+                reader = retry.body.getReader();
+                decoder = new TextDecoder();
+                pending = "";
+                continue;
+            }
+            const { done, value } = result;
             if (done) {
                 console.log("Stream complete");
                 break;
@@ -992,22 +1016,35 @@ window.sendChatMessage = async function (lessonId) {
 
             console.log("Received chunk size:", value.length);
 
-            const chunk = decoder.decode(value, { stream: true });
+            const chunk = pending + decoder.decode(value, { stream: true });
             console.log("Chunk content:", chunk.substring(0, 500));
 
             const lines = chunk.split("\n");
+            pending = lines.pop();
 
             for (const line of lines) {
-                if (line.startsWith("data: ")) {
+                if (line.startsWith("id: ")) {
+                    lastEventId = line.slice(4).trim();
+                } else if (line.startsWith("data: ")) {
                     const dataStr = line.replace("data: ", "");
                     if (dataStr === "[DONE]") break;
                     try {
                         const data = JSON.parse(dataStr);
                         if (data.error) throw new Error(data.error);
+                        if (data.turn) {
+                            // A different turn means the server no longer had ours and started over
+                            if (turn && turn.id !== data.turn.id) aiContent = "";
+                            turn = data.turn;
+                            continue;
+                        }
+                        if (data.interrupted) data.text = " [Interrupted]"; // Server stopped after we were gone too long
+                        if (typeof data.text !== "string") continue;
                         aiContent += data.text;
                         aiBubble.innerText = aiContent; // Update UI in real-time
                         box.scrollTop = box.scrollHeight;
                     } catch (e) { /* partial JSON ignore */ }
+                } else if (line.startsWith(":")) {
+                    // SSE comment: keep-alive heartbeat
                 } else if (line.trim().length > 0) {
                     // Fallback: Display raw error/text if not SSE format
                     aiContent += line + "\n";
@@ -1017,10 +1054,10 @@ window.sendChatMessage = async function (lessonId) {
             }
         }
 
-        // 4. Update session history in main DB (Fire and forget or async)
+        // 4. Backup write of the turn (the Gemini API already stores it; the turn id makes this a no-op then)
         fetch(`${API_BASE}/lessons/chat`, {
             method: 'POST',
-            body: JSON.stringify({ lessonId, message: msg, aiResponse: aiContent })
+            body: JSON.stringify({ lessonId, message: msg, aiResponse: aiContent, turnId: turn?.id, position: turn?.position })
         }).catch(err => console.warn("History sync failed", err));
 
     } catch (err) {
@@ -1039,10 +1076,10 @@ window.takeQuiz = async function (lessonId) {
     box.scrollTop = box.scrollHeight;
 
     try {
-        const res = await fetch(`${GEMINI_API_URL}/generate-quiz`, {
+        const res = await geminiFetch('/generate-quiz', {
             method: 'POST',
             body: JSON.stringify({ lesson_id: lessonId })
-        });
+        }, lessonId);
         const data = await res.json();
 
         if (data.quiz) {
@@ -1090,10 +1127,10 @@ window.submitQuiz = async function (lessonId) {
     quizDiv.innerHTML = "<h4>Grading your attempt... 🎓</h4>";
 
     try {
-        const res = await fetch(`${GEMINI_API_URL}/grade-quiz`, {
+        const res = await geminiFetch('/grade-quiz', {
             method: 'POST',
             body: JSON.stringify({ lesson_id: lessonId, quiz, answers })
-        });
+        }, lessonId);
         const result = await res.json();
 
         quizDiv.innerHTML = `
@@ -1171,55 +1208,40 @@ window.openAssessment = async function (lessonId) {
         // Store lessonId for later use
         currentProfile.activeAssessmentLessonId = lessonId;
 
-        // Generate test from AI
-        const testRes = await fetch(`${GEMINI_API_URL}/generate-test`, {
+        // Generate test from AI; questions are shown one by one as the model writes them
+        const testRes = await geminiFetch('/generate-test-stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ lesson_id: lessonId })
-        });
+        }, lessonId);
 
         if (!testRes.ok) {
             const errData = await testRes.json().catch(() => ({ error: testRes.statusText }));
             throw new Error((errData.error || 'Unknown server error') + (errData.trace ? '\n' + errData.trace : ''));
         }
 
-        const testData = await testRes.json();
-        const test = testData.test;
-
-        // Hide loading, show test
-        document.getElementById('test-loading').style.display = 'none';
-        document.getElementById('test-questions').style.display = 'block';
+        const questionsList = document.getElementById('questions-list');
+        questionsList.innerHTML = '';
+        let test = null;
+        await readServerEvents(testRes, (event) => {
+            if (event.error) throw new Error(event.error);
+            if (event.question) {
+                // Hide loading, show test from the first question on
+                document.getElementById('test-loading').style.display = 'none';
+                document.getElementById('test-questions').style.display = 'block';
+                appendTestQuestion(questionsList, event.question, event.index);
+            }
+            if (event.test) test = event.test;
+        });
+        if (!test) throw new Error('The test stream ended early. Please try again.');
 
         // Populate test content
         document.getElementById('assessment-subject').innerText = test.subject + ' Assessment';
         document.getElementById('instructions-text').innerText = test.instructions;
 
-        // Render questions with math formatting
-        const questionsHtml = test.questions.map((q, i) => `
-            <div class="question-item" style="margin-bottom: 25px; padding: 20px; border: 1px solid var(--border-subtle);">
-                <p style="font-weight: bold; margin-bottom: 10px;">Question ${i + 1} (${q.marks} marks)</p>
-                <div class="question-text" style="font-size: 1rem; line-height: 1.6;">
-                    ${formatMessageContent(q.question)}
-                </div>
-            </div>
-        `).join('');
-
-        document.getElementById('questions-list').innerHTML = questionsHtml;
-
-        // Render math in questions
-        if (typeof renderMathInElement !== 'undefined') {
-            renderMathInElement(document.getElementById('questions-list'), {
-                delimiters: [
-                    { left: '$$', right: '$$', display: true },
-                    { left: '$', right: '$', display: false }
-                ],
-                throwOnError: false
-            });
-        }
-
         // Setup file upload
         document.getElementById('upload-zone').onclick = () => document.getElementById('file-input').click();
-        document.getElementById('file-input').onchange = (e) => previewAssessmentImage(e.target.files[0]);
+        document.getElementById('file-input').onchange = (e) => previewAssessmentImage(e.target.files);
         document.getElementById('submit-btn').onclick = () => submitAssessment(lessonId);
         document.getElementById('finish-assessment-btn').onclick = () => interactWithTopic(currentProfile.activeTopicId);
 
@@ -1235,17 +1257,61 @@ window.openAssessment = async function (lessonId) {
     }
 };
 
-// Preview uploaded image before submission
-function previewAssessmentImage(file) {
-    if (!file) return;
+// Render one test question with math formatting
+function appendTestQuestion(list, q, i) {
+    const item = document.createElement('div');
+    item.className = 'question-item';
+    item.style.cssText = 'margin-bottom: 25px; padding: 20px; border: 1px solid var(--border-subtle);';
+    item.innerHTML = `
+        <p style="font-weight: bold; margin-bottom: 10px;">Question ${i + 1} (${q.marks} marks)</p>
+        <div class="question-text" style="font-size: 1rem; line-height: 1.6;">
+            ${formatMessageContent(q.question)}
+        </div>
+    `;
+    list.appendChild(item);
+
+    if (typeof renderMathInElement !== 'undefined') {
+        renderMathInElement(item, {
+            delimiters: [
+                { left: '$$', right: '$$', display: true },
+                { left: '$', right: '$', display: false }
+            ],
+            throwOnError: false
+        });
+    }
+}
+
+// Read an SSE response of JSON `data:` events, calling onEvent for each until [DONE]
+async function readServerEvents(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let pending = "";
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) return;
+        const lines = (pending + decoder.decode(value, { stream: true })).split("\n");
+        pending = lines.pop();
+        for (const line of lines) {
+            if (!line.startsWith("data: ")) continue;
+            const dataStr = line.slice(6);
+            if (dataStr === "[DONE]") return;
+            onEvent(JSON.parse(dataStr));
+        }
+    }
+}
+
+// Preview uploaded page(s) before submission
+function previewAssessmentImage(files) {
+    if (!files || files.length === 0) return;
 
     const reader = new FileReader();
     reader.onload = (e) => {
         document.getElementById('preview-img').src = e.target.result;
+        document.getElementById('preview-count').innerText = files.length > 1 ? `${files.length} pages selected` : '';
         document.getElementById('image-preview').style.display = 'block';
         document.getElementById('upload-zone').style.display = 'none';
     };
-    reader.readAsDataURL(file);
+    reader.readAsDataURL(files[0]);
 }
 
 window.submitAssessment = async function (lessonId) {
@@ -1261,45 +1327,17 @@ window.submitAssessment = async function (lessonId) {
     submitBtn.disabled = true;
 
     try {
-        // Convert image to base64
-        // Convert image to base64 with resizing (Max 1024px)
-        const file = fileInput.files[0];
-        const base64 = await new Promise((resolve) => {
-            const reader = new FileReader();
-            reader.onload = (e) => {
-                const img = new Image();
-                img.onload = () => {
-                    const canvas = document.createElement('canvas');
-                    const MAX_WIDTH = 1024;
-                    let width = img.width;
-                    let height = img.height;
-
-                    if (width > MAX_WIDTH) {
-                        height *= MAX_WIDTH / width;
-                        width = MAX_WIDTH;
-                    }
-
-                    canvas.width = width;
-                    canvas.height = height;
-                    const ctx = canvas.getContext('2d');
-                    ctx.drawImage(img, 0, 0, width, height);
-                    // Use JPEG 0.8 for good balance of size/quality
-                    resolve(canvas.toDataURL('image/jpeg', 0.8));
-                };
-                img.src = e.target.result;
-            };
-            reader.readAsDataURL(file);
-        });
-
-        // Call grading API
-        const res = await fetch(`${GEMINI_API_URL}/grade-image`, {
+        // Resize every page (server re-normalises as well) and upload as binary parts
+        const pages = await Promise.all(Array.from(fileInput.files).map(f => resizeImage(f)));
+        const form = new FormData();
+        form.append('lesson_id', lessonId);
+        pages.forEach((page, i) => form.append('pages', page, `page-${i + 1}.jpg`));
+
+        // Call grading API once for all pages
+        const res = await geminiFetch('/grade-image', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                lesson_id: lessonId,
-                image: base64
-            })
-        });
+            body: form
+        }, lessonId);
 
         if (!res.ok) throw new Error('Grading failed');
 
@@ -1319,7 +1357,7 @@ window.submitAssessment = async function (lessonId) {
         if (result.questionResults && result.questionResults.length > 0) {
             const qResultsHtml = result.questionResults.map(qr => `
                 <div style="padding: 15px; border-bottom: 1px solid var(--border-subtle);">
-                    <p><strong>Question ${qr.questionId}</strong>: ${qr.marksAwarded}/${qr.marksAvailable} marks</p>
+                    <p><strong>Question ${qr.questionId}</strong>: ${qr.marksAwarded}/${qr.marksAvailable} marks${qr.pages && qr.pages.length ? ` <span class="text-dim">(page ${qr.pages.join(', ')})</span>` : ''}</p>
                     <p class="text-dim" style="font-size: 0.85rem;">${qr.feedback}</p>
                 </div>
             `).join('');
@@ -1426,9 +1464,43 @@ window.clearImage = function () {
     if (preview) preview.style.display = 'none';
 };
 
-const toBase64 = file => new Promise((resolve, reject) => {
-    const reader = new FileReader();
-    reader.readAsDataURL(file);
-    reader.onload = () => resolve(reader.result);
-    reader.onerror = error => reject(error);
+// Downscale a photo before upload so phones don't post multi-MB base64 bodies
+const IMAGE_MAX_DIM = 1600;
+const IMAGE_QUALITY = 0.8;
+
+const resizeImage = (file, maxDim = IMAGE_MAX_DIM, quality = IMAGE_QUALITY) => new Promise((resolve) => {
+    const url = URL.createObjectURL(file);
+    const img = new Image();
+    img.onload = () => {
+        URL.revokeObjectURL(url);
+        const scale = Math.min(1, maxDim / Math.max(img.width, img.height));
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.round(img.width * scale);
+        canvas.height = Math.round(img.height * scale);
+        const ctx = canvas.getContext('2d');
+        ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
+        // Use JPEG for good balance of size/quality
+        canvas.toBlob(blob => resolve(blob || file), 'image/jpeg', quality);
+    };
+    // Fall back to the untouched file if the browser can't decode it (e.g. HEIC)
+    img.onerror = () => {
+        URL.revokeObjectURL(url);
+        resolve(file);
+    };
+    img.src = url;
 });
+
+// Reconnects per chat answer after a dropped connection (replayed from the last SSE event id)
+const MAX_STREAM_RESUMES = 3;
+
+// Calls to the Gemini API are rate limited per learner (source IP + the lesson in the query string);
+// a 429 becomes a readable error instead of a silent failure
+const geminiFetch = async (path, options = {}, lessonId = null) => {
+    const query = lessonId ? `?lesson_id=${encodeURIComponent(lessonId)}` : '';
+    const res = await fetch(`${GEMINI_API_URL}${path}${query}`, options);
+    if (res.status === 429) {
+        const wait = res.headers.get('Retry-After') || '30';
+        throw new Error(`The tutor is busy right now. Please try again in ${wait} seconds.`);
+    }
+    return res;
+};
@@ -0,0 +1,171 @@
+"""
+Per-message retrieval of ATP snippets for /chat-stream.
+
+The system instruction only carries the lesson's own topic. For each learner
+message we pick the subtopics and formulas of the lesson's curriculum (the
+whole subject/grade ATP, all terms and weeks) that best match the message and
+send them alongside it, capped at ATP_SNIPPETS snippets and ATP_CONTEXT_TOKENS
+estimated tokens.
+
+Ranking reuses curriculum_search's BM25 index (loaded once per container):
+weeks are scored with BM25 (the lesson's own week slightly boosted), then the
+subtopics/formulas of the best weeks are ranked by the idf of the query
+tokens they contain. Identical texts repeated across weeks are sent once.
+Results are cached per (curriculum, topic, query tokens); retrieval runs in
+worker threads, so the cache is guarded by a lock.
+
+Config (environment):
+    ATP_SNIPPETS          most snippets per message (0 = off)
+    ATP_CONTEXT_TOKENS    token budget for all snippets of one message
+    ATP_CANDIDATE_WEEKS   best-scoring weeks whose subtopics are considered
+    ATP_CACHE_SIZE        cached retrievals per container
+"""
+
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+import curriculum_search
+from instrumentation import add_metric
+
+ATP_SNIPPETS = int(os.environ.get("ATP_SNIPPETS", "4"))
+ATP_CONTEXT_TOKENS = int(os.environ.get("ATP_CONTEXT_TOKENS", "300"))
+ATP_CANDIDATE_WEEKS = int(os.environ.get("ATP_CANDIDATE_WEEKS", "6"))
+ATP_CACHE_SIZE = int(os.environ.get("ATP_CACHE_SIZE", "512"))
+
+# Rough Gemini tokenisation for English prose
+CHARS_PER_TOKEN = 4
+# The lesson's own week wins ties against other weeks that mention the same words
+LESSON_TOPIC_BOOST = 1.25
+
+_cache = OrderedDict()
+_topic_pos = {}
+_lock = threading.Lock()  # _cache and _topic_pos are shared by the asyncio.to_thread workers
+
+stats = {"retrievals": 0, "cache_hits": 0, "snippets": 0}
+
+
+def curriculum_of(topic_id: str) -> str:
+    """'CAPS#Grade 11#Physical Science#T1#W5' -> 'CAPS#Grade 11#Physical Science'."""
+    parts = (topic_id or "").split("#")
+    return "#".join(parts[:3]) if len(parts) >= 3 else ""
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def _topic_position(index: dict, topic_id: str):
+    if not _topic_pos:
+        with _lock:
+            if not _topic_pos:
+                _topic_pos.update((doc[0], d) for d, doc in enumerate(index["docs"]))
+    return _topic_pos.get(topic_id)
+
+
+def _rank(index: dict, tokens: list, curriculum_id: str, topic_id: str):
+    """Candidate snippets, best first: (score, term, week, mainTopic, kind, text)."""
+    allowed = curriculum_search.curriculum_filter(index, curriculum_id=curriculum_id)
+    if not allowed:
+        return []
+    scores = curriculum_search.score(index, tokens, allowed)
+    own = _topic_position(index, topic_id)
+    if own in scores:
+        scores[own] *= LESSON_TOPIC_BOOST
+    weeks = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:ATP_CANDIDATE_WEEKS]
+    if not weeks:
+        return []
+
+    n = len(index["docs"])
+    idf = {}
+    for tok in set(tokens):
+        df = len(curriculum_search.postings(index, tok))
+        idf[tok] = math.log(1 + (n - df + 0.5) / (df + 0.5)) if df else 0.0
+
+    best = weeks[0][1]
+    seen = set()
+    candidates = []
+    for d, week_score in weeks:
+        doc = index["docs"][d]
+        texts = [("subtopic", index["texts"][i]) for i in doc[5]] + [("formula", f) for f in doc[6]]
+        for kind, text in texts:
+            if text in seen:
+                continue
+            seen.add(text)
+            overlap = sum(idf.get(tok, 0.0) for tok in set(curriculum_search.tokenize(text)))
+            if overlap:
+                # Matches inside the strongest weeks rank first
+                candidates.append((overlap * (1 + week_score / best), doc[2], doc[3], doc[4], kind, text))
+    candidates.sort(key=lambda c: -c[0])
+    return candidates
+
+
+def retrieve(message: str, curriculum_id: str, topic_id: str = None, k: int = None, budget: int = None) -> list:
+    """
+    Top snippets for one learner message, within `k` snippets and `budget` tokens.
+
+    Returns:
+        list of dicts with term, week, mainTopic, kind ('subtopic'|'formula'), text, tokens
+    """
+    k = ATP_SNIPPETS if k is None else k
+    budget = ATP_CONTEXT_TOKENS if budget is None else budget
+    if k <= 0 or budget <= 0 or not curriculum_id:
+        return []
+    tokens = curriculum_search.tokenize(message)
+    if not tokens:
+        return []
+
+    key = (curriculum_id, topic_id, tuple(sorted(set(tokens))), k, budget)
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            stats["cache_hits"] += 1
+            return cached
+
+    index = curriculum_search.load()
+    if index is None:
+        return []
+    stats["retrievals"] += 1
+    snippets, used = [], 0
+    for _, term, week, main_topic, kind, text in _rank(index, tokens, curriculum_id, topic_id):
+        cost = estimate_tokens(text)
+        if used + cost > budget:
+            continue
+        snippets.append({"term": term, "week": week, "mainTopic": main_topic, "kind": kind,
+                         "text": text, "tokens": cost})
+        used += cost
+        if len(snippets) >= k:
+            break
+
+    with _lock:
+        _cache[key] = snippets
+        if len(_cache) > ATP_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return snippets
+
+
+def render(snippets: list) -> str:
+    """Message part for the model ('' when nothing was retrieved)."""
+    if not snippets:
+        return ""
+    lines = ["Reference from this subject's CAPS Annual Teaching Plan (use only if relevant to the question):"]
+    for s in snippets:
+        label = f"Term {s['term']} Week {s['week']}"
+        if s["mainTopic"]:
+            label += f" ({s['mainTopic'].strip()})"
+        prefix = "Formula: " if s["kind"] == "formula" else ""
+        lines.append(f"- {label}: {prefix}{s['text']}")
+    return "\n".join(lines)
+
+
+def context_for(message: str, curriculum_id: str, topic_id: str = None) -> str:
+    """Retrieve and render snippets for a message, recording timing and counts on the request."""
+    t0 = time.perf_counter()
+    snippets = retrieve(message, curriculum_id, topic_id)
+    add_metric("atp_retrieval_ms", (time.perf_counter() - t0) * 1000)
+    add_metric("atp_snippets", len(snippets))
+    add_metric("atp_context_tokens", sum(s["tokens"] for s in snippets))
+    stats["snippets"] += len(snippets)
+    return render(snippets)
@@ -0,0 +1,90 @@
+"""
+Shared boto3 clients for all Lambdas.
+Clients are created once per container (module-level cache) with a tuned
+config: a connection pool large enough for concurrent requests, adaptive
+retries, TCP keep-alive and tight timeouts. An endpoint can be overridden
+per service to point at local stand-ins (DynamoDB Local, moto server).
+
+boto3 is imported on first use so the Gemini Lambda's INIT stays lean.
+
+Config (environment):
+    AWS_MAX_POOL_CONNECTIONS  HTTP connections kept per client
+    AWS_RETRY_MODE            botocore retry mode ("adaptive", "standard", "legacy")
+    AWS_MAX_ATTEMPTS          total attempts per call, retries included
+    AWS_CONNECT_TIMEOUT       seconds
+    AWS_READ_TIMEOUT          seconds
+    AWS_TCP_KEEPALIVE         "true" to enable TCP keep-alive probes
+    <SERVICE>_ENDPOINT_URL    e.g. DYNAMODB_ENDPOINT_URL=http://localhost:8000
+"""
+
+import os
+import threading
+
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "50"))
+AWS_RETRY_MODE = os.environ.get("AWS_RETRY_MODE", "adaptive")
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "3"))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", "2"))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", "5"))
+AWS_TCP_KEEPALIVE = os.environ.get("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_resources = {}
+
+
+def client_config():
+    """botocore Config shared by every client."""
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        retries={'mode': AWS_RETRY_MODE, 'total_max_attempts': AWS_MAX_ATTEMPTS},
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=AWS_READ_TIMEOUT,
+        tcp_keepalive=AWS_TCP_KEEPALIVE,
+    )
+
+
+def endpoint_url(service: str):
+    """Local stand-in endpoint for a service, if configured."""
+    return os.environ.get(f"{service.upper()}_ENDPOINT_URL") or None
+
+
+def _get_session():
+    # boto3's default session isn't safe to build clients from concurrently; use our own, once
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+def client(service: str):
+    """Cached low-level client, e.g. client('ssm')."""
+    if service not in _clients:
+        with _lock:
+            if service not in _clients:
+                _clients[service] = _get_session().client(
+                    service, config=client_config(), endpoint_url=endpoint_url(service)
+                )
+    return _clients[service]
+
+
+def resource(service: str):
+    """Cached resource, e.g. resource('dynamodb')."""
+    if service not in _resources:
+        with _lock:
+            if service not in _resources:
+                _resources[service] = _get_session().resource(
+                    service, config=client_config(), endpoint_url=endpoint_url(service)
+                )
+    return _resources[service]
+
+
+def reset():
+    """Forget cached clients (tests/benchmarks that swap endpoints or credentials)."""
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+        _resources.clear()
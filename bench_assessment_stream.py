@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Time to first question for quiz/test generation: the blocking routes
+(/generate-quiz, /generate-test) vs their SSE variants, which send each
+question as soon as the model has finished writing it.
+
+Requests go through gemini_handler's ASGI app against FakeGemini (which
+streams the canned quiz/test JSON at --token-rate) and moto DynamoDB. Also
+checks that the streamed questions equal the stored result.
+
+Usage: python bench_assessment_stream.py [--runs 5] [--token-rate 60]
+"""
+
+import io
+import os
+import sys
+import json
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_harness
+from bench_harness import FakeGemini, install_fake_gemini, local_dynamodb, call_asgi, percentile
+
+ROUTES = [
+    ("quiz", "/generate-quiz", "/generate-quiz-stream", "generatedQuiz"),
+    ("test", "/generate-test", "/generate-test-stream", "generatedTest"),
+]
+
+
+def sse_events(body: bytes) -> list:
+    return [json.loads(line[6:]) for line in body.decode().split("\n")
+            if line.startswith("data: ") and line != "data: [DONE]"]
+
+
+async def run(gemini_handler, args):
+    app = gemini_handler.app
+    headers = {"content-type": "application/json"}
+    rows = []
+    for kind, blocking, streaming, attr in ROUTES:
+        block, first, total, count = [], [], [], 0
+        for i in range(args.runs):
+            body = json.dumps({"lesson_id": f"L_bench{i:04d}"}).encode()
+            r = await call_asgi(app, "POST", blocking, body, headers)
+            assert r["status"] == 200, r["body"][:200]
+            block.append(r["total"])
+
+            # Another lesson: this one's result is stored now and would be returned without generating
+            lesson_id = f"L_bench{args.runs + i:04d}"
+            body = json.dumps({"lesson_id": lesson_id}).encode()
+            r = await call_asgi(app, "POST", streaming, body, headers)
+            events = sse_events(r["body"])
+            assert r["status"] == 200 and kind in events[-1], events[-1]
+            questions = [e["question"] for e in events if "question" in e]
+            final = events[-1][kind]
+            assert questions == (final["questions"] if kind == "test" else final)
+            stored = gemini_handler.lesson_table.get_item(Key={"lessonId": lesson_id})["Item"][attr]
+            assert json.loads(json.dumps(stored, default=float)) == final
+            first.append(r["chunk_times"][0])
+            total.append(r["total"])
+            count = len(questions)
+        rows.append((kind, count, block, first, total))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Requests per route")
+    parser.add_argument("--token-rate", type=float, default=60.0, help="Fake Gemini tokens per second")
+    parser.add_argument("--latency", type=float, default=0.4, help="Fake Gemini time to first token (s)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+    with local_dynamodb(lessons=args.runs * 2, history_turns=4):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import gemini_handler
+        install_fake_gemini(gemini_handler, FakeGemini(latency=args.latency, token_rate=args.token_rate, chunk_tokens=4))
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = asyncio.run(run(gemini_handler, args))
+
+    print(f"Fake Gemini: {args.latency * 1000:.0f} ms to first token, {args.token_rate:.0f} tokens/s; "
+          f"{args.runs} runs per route (p50 s)\n")
+    print(f"{'kind':<6}{'questions':>10}{'blocking':>10}{'stream 1st':>12}{'stream all':>12}{'1st / blocking':>16}")
+    for kind, count, block, first, total in rows:
+        b, f = percentile(sorted(block), 0.5), percentile(sorted(first), 0.5)
+        print(f"{kind:<6}{count:>10}{b:>10.2f}{f:>12.2f}{percentile(sorted(total), 0.5):>12.2f}{f / b:>16.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark DynamoDB call latency under concurrent load for three client setups:
+    default  boto3.client('dynamodb') with stock config (pool of 10, legacy retries)
+    tuned    aws_clients.client('dynamodb') (shared pool, adaptive retries, keep-alive)
+    fresh    a new client per call (what ensure_config did for SSM on each cold load)
+
+By default calls go to a local HTTP stand-in that answers GetItem after
+--latency seconds and charges --connect-delay for every new TCP connection
+(a stand-in for the TLS handshake), so pool reuse shows up in the numbers.
+Pass --endpoint-url (DynamoDB Local, or real AWS with --table/--key) to measure
+against a real service instead.
+
+Usage: python bench_aws_clients.py [--concurrency 1 8 32] [--requests 400]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+MODES = ["default", "tuned", "fresh"]
+
+ITEM = {"lessonId": {"S": "L_bench0000"}, "status": {"S": "teaching"},
+        "history": {"L": [{"M": {"role": {"S": "user"}, "content": {"S": "Hello"}}}]}}
+
+
+class StandIn(ThreadingHTTPServer):
+    """Minimal DynamoDB endpoint: every GetItem returns ITEM after `latency`."""
+    daemon_threads = True
+
+    def __init__(self, latency: float, connect_delay: float):
+        self.latency = latency
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        body = json.dumps({"Item": ITEM}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_caller(mode: str, endpoint: str, table: str, key: dict):
+    """Return a zero-arg function performing one GetItem with the given client setup."""
+    import boto3
+    import aws_clients
+
+    if mode == "default":
+        client = boto3.session.Session().client("dynamodb", endpoint_url=endpoint)
+        return lambda: client.get_item(TableName=table, Key=key)
+    if mode == "tuned":
+        os.environ["DYNAMODB_ENDPOINT_URL"] = endpoint or ""
+        aws_clients.reset()
+        client = aws_clients.client("dynamodb")
+        return lambda: client.get_item(TableName=table, Key=key)
+    return lambda: boto3.session.Session().client("dynamodb", endpoint_url=endpoint).get_item(TableName=table, Key=key)
+
+
+def run(call, concurrency: int, requests: int):
+    """Fire `requests` calls across `concurrency` threads; returns per-call seconds and wall time."""
+    def timed(_):
+        t0 = time.perf_counter()
+        call()
+        return time.perf_counter() - t0
+
+    # Warm the client once, as a warm Lambda container would be
+    call()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, range(requests)))
+    return sorted(latencies), time.perf_counter() - start
+
+
+def pct(values, p):
+    return values[min(len(values) - 1, int(round((len(values) - 1) * p)))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400, help="Calls per mode per concurrency level")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--latency", type=float, default=0.005, help="Stand-in service time per call (s)")
+    parser.add_argument("--connect-delay", type=float, default=0.03, help="Stand-in cost of a new connection (s)")
+    parser.add_argument("--endpoint-url", help="Real DynamoDB endpoint instead of the stand-in")
+    parser.add_argument("--table", default="Lessons")
+    parser.add_argument("--key", default='{"lessonId": {"S": "L_bench0000"}}', help="GetItem key (JSON)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault("AWS_DEFAULT_REGION", "af-south-1")
+
+    server = None
+    endpoint = args.endpoint_url
+    if endpoint is None:
+        for var in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            os.environ.setdefault(var, "bench")
+        server = StandIn(args.latency, args.connect_delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+        print(f"Stand-in DynamoDB at {endpoint}: {args.latency * 1000:.1f} ms per call, "
+              f"{args.connect_delay * 1000:.1f} ms per new connection\n")
+
+    key = json.loads(args.key)
+    print(f"{'mode':<9}{'conc':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'req/s':>9}{'new conns':>11}")
+    for concurrency in args.concurrency:
+        for mode in args.modes:
+            requests = args.requests if mode != "fresh" else max(concurrency, args.requests // 4)
+            before = server.connections if server else 0
+            latencies, wall = run(make_caller(mode, endpoint, args.table, key), concurrency, requests)
+            conns = (server.connections - before) if server else "-"
+            print(f"{mode:<9}{concurrency:>6}{pct(latencies, 0.50):>9.1f}{pct(latencies, 0.95):>9.1f}"
+                  f"{pct(latencies, 0.99):>9.1f}{statistics.mean(latencies) * 1000:>9.1f}"
+                  f"{requests / wall:>9.0f}{conns:>11}")
+        print()
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measure Lambda cold-start import cost with `python -X importtime`.
+Reports the cumulative import time of the handler module (INIT phase) and of
+the SDKs deferred to the first request, plus the slowest top-level imports.
+
+Usage: python bench_coldstart.py [--path gemini_build] [--runs 5] [--module gemini_handler]
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+# Imported lazily by the handler; paid on the first request that needs them
+DEFERRED = ["google.generativeai", "boto3", "mangum"]
+
+
+def measure(path: str, module: str):
+    """
+    Run one fresh interpreter: import the handler under -X importtime, then force
+    the deferred SDKs to load and time that separately.
+
+    Returns:
+        ({module: (cumulative_us, depth)}, deferred_ms)
+    """
+    code = (
+        "import time, importlib\n"
+        f"import {module}\n"
+        "t = time.perf_counter()\n"
+        f"for name in {DEFERRED!r}:\n"
+        "    getattr(importlib.import_module(name), '__file__')\n"
+        "print((time.perf_counter() - t) * 1000)\n"
+    )
+    env = dict(os.environ, PYTHONPATH=path, AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "af-south-1"))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env, cwd=path,
+    )
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            # Nesting is shown as two spaces per level after the leading separator space
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            times.setdefault(name.strip(), (int(cumulative), depth))
+            if depth == 0 and name.strip() == module:
+                break  # Children are printed before their parent; the rest is the deferred phase
+    deferred = proc.stdout.strip().splitlines()
+    return times, float(deferred[-1]) if deferred else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Directory to import from (repo root or an unpacked gemini_build)")
+    parser.add_argument("--module", default="gemini_handler")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    init_ms, deferred_ms, samples = [], [], []
+    for _ in range(args.runs):
+        times, deferred = measure(args.path, args.module)
+        if args.module not in times:
+            sys.exit(f"ERROR: {args.module} did not import from {args.path}")
+        init_ms.append(times[args.module][0] / 1000)
+        deferred_ms.append(deferred)
+        samples.append(times)
+
+    print(f"Cold-start imports for {args.module} from {args.path} ({args.runs} runs)\n")
+    print(f"  INIT (module import):        median {statistics.median(init_ms):8.1f} ms   min {min(init_ms):8.1f} ms")
+    print(f"  Deferred to first request:   median {statistics.median(deferred_ms):8.1f} ms   ({', '.join(DEFERRED)})")
+
+    # Direct imports of the handler, i.e. what INIT actually pays for
+    top = sorted(
+        ((name, t) for name, (t, depth) in samples[-1].items() if depth == 1),
+        key=lambda x: x[1], reverse=True,
+    )[:args.top]
+    print(f"\n  Slowest imports during INIT:")
+    for name, t in top:
+        print(f"    {t / 1000:8.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Context caching for returning learners: prompt tokens billed and time to
+first token with every request sending the full system instruction +
+transcript (CONTEXT_CACHE_ENABLED=0, the behaviour before caching) vs Gemini
+cached content per lesson.
+
+Per lesson (seeded with a --history-turns transcript): the learner returns
+to a cold container and chats --messages times, the next message lands on
+another container (which finds the cache through Lessons.contextCache), and
+a test is generated from the lesson. Requests go through gemini_handler's
+ASGI app against FakeGemini, where uncached prompt tokens cost
+1 / --prefill-rate seconds each before the first token, and moto DynamoDB.
+A small CONTEXT_CACHE_REFRESH_TOKENS makes the sessions roll onto longer
+caches while they run.
+
+Billed input counts cached tokens at model_routing.CACHED_INPUT_RATE.
+
+Usage: python bench_context_cache.py [--lessons 4] [--messages 4] [--history-turns 30]
+"""
+
+import io
+import os
+import sys
+import json
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_harness import FakeGemini, install_fake_gemini, local_dynamodb, call_asgi, percentile
+
+MESSAGE = ("Can you explain again why the normal force on the block is smaller on the incline "
+           "than on the flat table, and how I should draw the free body diagram?")
+PHASES = ["return", "same container", "other container", "generate-test"]
+
+
+def usage_totals(model_routing):
+    prompt = sum(model_routing.stats[tier]["prompt_tokens"] for tier in model_routing.MODEL_TIERS)
+    cached = sum(model_routing.stats[tier]["cached_tokens"] for tier in model_routing.MODEL_TIERS)
+    return prompt, cached
+
+
+def cold_container(gemini_handler):
+    gemini_handler.sessions.clear()
+    gemini_handler.session_specs.clear()
+    gemini_handler.positions.clear()
+    gemini_handler.context_cache.entries.clear()
+
+
+async def run_mode(gemini_handler, model_routing, first_lesson, args):
+    app = gemini_handler.app
+    headers = {"content-type": "application/json"}
+    ttft = {phase: [] for phase in PHASES}
+    billed = {phase: 0.0 for phase in PHASES}
+    raw = {phase: 0 for phase in PHASES}
+
+    async def request(phase, path, body):
+        before = usage_totals(model_routing)
+        r = await call_asgi(app, "POST", path, json.dumps(body).encode(), headers)
+        assert r["status"] == 200, (phase, r["body"][:200])
+        assert b"Error" not in r["body"], r["body"][:300]
+        prompt, cached = (a - b for a, b in zip(usage_totals(model_routing), before))
+        raw[phase] += prompt
+        billed[phase] += prompt - cached + cached * model_routing.CACHED_INPUT_RATE
+        # Chat: first text chunk (after the turn and "Reflecting..." frames); test: whole call
+        ttft[phase].append(r["chunk_times"][2] if path == "/chat-stream" else r["total"])
+        # Turns land (and background cache refreshes finish) before the next request
+        await gemini_handler.turn_writer.flush()
+        await asyncio.gather(*gemini_handler.context_cache.tasks)
+
+    for i in range(args.lessons):
+        lesson_id = f"L_bench{first_lesson + i:04d}"
+        chat = {"message": MESSAGE, "lesson_id": lesson_id}
+        cold_container(gemini_handler)
+        await request("return", "/chat-stream", chat)
+        for _ in range(args.messages - 1):
+            await request("same container", "/chat-stream", chat)
+        cold_container(gemini_handler)
+        await request("other container", "/chat-stream", chat)
+        await request("generate-test", "/generate-test", {"lesson_id": lesson_id})
+    return ttft, billed, raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=int, default=4, help="Returning learners per mode")
+    parser.add_argument("--messages", type=int, default=4, help="Chat messages on the first container")
+    parser.add_argument("--history-turns", type=int, default=30, help="Seeded question/answer pairs per lesson")
+    parser.add_argument("--prefill-rate", type=float, default=4000.0, help="Fake uncached prompt tokens per second")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+    os.environ.setdefault("CONTEXT_CACHE_REFRESH_TOKENS", "512")
+    os.environ["GEMINI_ROUTES"] = json.dumps({"chat-stream": "full", "generate-test": "full"})
+    modes = [("full prompts", False), ("context cache", True)]
+    results = []
+    with local_dynamodb(lessons=args.lessons * len(modes), history_turns=args.history_turns):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import gemini_handler
+            import model_routing
+            import context_cache
+        for m, (name, enabled) in enumerate(modes):
+            context_cache.ENABLED = enabled
+            for key in context_cache.stats:
+                context_cache.stats[key] = 0
+            fake = install_fake_gemini(gemini_handler, FakeGemini(latency=0.3, prefill_rate=args.prefill_rate))
+            gemini_handler.models.clear()
+            gemini_handler.replay.streams.clear()  # Streams of the previous mode belong to its event loop
+            with contextlib.redirect_stdout(io.StringIO()):
+                ttft, billed, raw = asyncio.run(run_mode(gemini_handler, model_routing, m * args.lessons, args))
+            results.append((name, ttft, billed, raw, dict(context_cache.stats), fake.caches_created))
+
+    print(f"{args.lessons} lessons x {args.history_turns} seeded turns; fake prefill {args.prefill_rate:.0f} tok/s\n")
+    print(f"{'phase':<18}" + "".join(f"{name + ' TTFT':>22}{'billed in':>12}" for name, *_ in results))
+    for phase in PHASES:
+        row = f"{phase:<18}"
+        for _, ttft, billed, _, _, _ in results:
+            row += f"{percentile(sorted(ttft[phase]), 0.5):>22.2f}{billed[phase] / len(ttft[phase]):>12.0f}"
+        print(row)
+    print("\n(p50 seconds: chat to first text chunk, generate-test whole call; billed input tokens per request)\n")
+    base = sum(results[0][2].values())
+    for name, _, billed, raw, stats, caches in results:
+        total = sum(billed.values())
+        print(f"{name:<14} prompt tokens {sum(raw.values()):>8}, billed {total:>9.0f} ({total / base:.0%}), "
+              f"caches created {caches}, {stats}")
+
+
+if __name__ == "__main__":
+    main()
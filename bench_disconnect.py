@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+What a client disconnect costs on /chat-stream: Gemini tokens generated and
+producer seconds spent after the learner has gone, with generation kept
+running to the end (the behaviour before aborting) vs aborted once nobody has
+followed the stream for --grace seconds.
+
+--streams clients each read --disconnect-after SSE chunks and hang up. One
+completed answer per mode comes first, so the handler knows the average
+answer length it estimates saved tokens from. Afterwards each mode reports
+the partial turns stored in Lessons.history.
+
+A last run with a slow first token checks that keep-alive comments are sent
+while a follower waits.
+
+Usage: python bench_disconnect.py [--streams 8] [--disconnect-after 6] [--grace 0.5]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_harness
+from bench_harness import FakeGemini, install_fake_gemini, local_dynamodb, call_asgi
+
+MODES = ["keep", "abort"]
+
+
+async def run_mode(gemini_handler, fake, args, grace):
+    import stream_replay
+    stream_replay.STREAM_ABORT_GRACE_SECONDS = grace
+    gemini_handler.replay.streams.clear()  # Streams of the previous mode belong to its event loop
+    app = gemini_handler.app
+    headers = {"content-type": "application/json"}
+
+    def body(lesson_id):
+        return json.dumps({"message": "Explain acceleration", "lesson_id": lesson_id}).encode()
+
+    # One full answer, so the average answer length is known
+    await call_asgi(app, "POST", "/chat-stream", body("L_bench0000"), headers)
+    tokens0, cancelled0 = fake.tokens_streamed, fake.cancelled
+    saved0 = gemini_handler.chat_stats["tokens_saved_est"]
+
+    lesson_ids = [f"L_bench{s + 1:04d}" for s in range(args.streams)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(call_asgi(app, "POST", "/chat-stream", body(lid), headers,
+                                     disconnect_after=args.disconnect_after) for lid in lesson_ids))
+    gone = time.perf_counter() - t0
+    producers = [s.task for s in gemini_handler.replay.streams.values() if s.lesson_id in lesson_ids]
+    await asyncio.gather(*producers, return_exceptions=True)
+    busy = time.perf_counter() - t0
+    await gemini_handler.turn_writer.flush()
+
+    partial = 0
+    for lid in lesson_ids:
+        item = gemini_handler.lesson_table.get_item(Key={"lessonId": lid}).get("Item", {})
+        partial += sum(1 for h in item.get("history", []) if h.get("partial"))
+    return {
+        "tokens": fake.tokens_streamed - tokens0,
+        "cancelled": fake.cancelled - cancelled0,
+        "gone": gone, "busy": busy, "partial": partial,
+        "saved_est": gemini_handler.chat_stats["tokens_saved_est"] - saved0,
+    }
+
+
+async def heartbeat_check(gemini_handler, fake, interval):
+    import stream_replay
+    stream_replay.STREAM_HEARTBEAT_SECONDS = interval
+    fake.latency = 10 * interval
+    body = json.dumps({"message": "Think hard", "lesson_id": "L_bench0000"}).encode()
+    result = await call_asgi(gemini_handler.app, "POST", "/chat-stream", body, {"content-type": "application/json"})
+    return result["body"].decode().count(stream_replay.HEARTBEAT), fake.latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=8, help="Clients that disconnect mid-answer")
+    parser.add_argument("--disconnect-after", type=int, default=6, help="SSE chunks read before hanging up")
+    parser.add_argument("--grace", type=float, default=0.5, help="Abort grace period for the 'abort' mode (s)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Fake Gemini tokens per second")
+    parser.add_argument("--output-tokens", type=int, default=400, help="Tokens in a full answer")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+    os.environ.setdefault("MAX_ACTIVE_REQUESTS", "1000")
+
+    with local_dynamodb(lessons=args.streams + 1, history_turns=2):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import gemini_handler
+        fake = install_fake_gemini(gemini_handler, FakeGemini(latency=0.05, token_rate=args.token_rate,
+                                                              chunk_tokens=4, output_tokens=args.output_tokens))
+        full = 0.05 + args.output_tokens / args.token_rate
+        print(f"{args.streams} clients hang up after {args.disconnect_after} chunks; a full answer is "
+              f"{args.output_tokens} tokens ({full:.1f} s)\n")
+        print(f"{'mode':<8}{'tokens':>9}{'cancelled':>11}{'clients s':>11}{'producers s':>13}{'partial turns':>15}{'saved est':>11}")
+        for mode in MODES:
+            grace = -1 if mode == "keep" else args.grace
+            with contextlib.redirect_stdout(io.StringIO()):
+                r = asyncio.run(run_mode(gemini_handler, fake, args, grace))
+            print(f"{mode:<8}{r['tokens']:>9}{r['cancelled']:>11}{r['gone']:>11.2f}{r['busy']:>13.2f}"
+                  f"{r['partial']:>15}{r['saved_est']:>11}")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            beats, wait = asyncio.run(heartbeat_check(gemini_handler, fake, 0.1))
+        print(f"\nKeep-alive comments while waiting {wait:.1f} s for the first token (every 0.1 s): {beats}")
+
+
+if __name__ == "__main__":
+    main()
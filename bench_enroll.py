@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for POST /enroll against moto DynamoDB: N threads enroll
+the same learner in the same subject at once (a double-clicked button, a
+retried request). Compares the previous read-then-write flow (GetItem, then
+UpdateItem on UserProfiles and Subjects) with profile_handler's single
+TransactWriteItems.
+
+For each run, reports how many requests succeeded, how many times the subject
+ended up in `subjects`, how far studentCount moved (both should be 1) and the
+DynamoDB round trips per request. Each mode enrolls its own learner: the legacy
+flow leaves `subjects` a list, which the transaction would first migrate.
+test_enroll.py asserts the transactional outcome.
+
+Usage: python bench_enroll.py [--threads 16] [--rounds 20]
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+EMAIL = "bench-{mode}@example.com"
+CURRICULUM = "CAPS"
+
+
+def legacy_enroll(user_table, subject_table, email, subj, curr):
+    """The pre-transaction handler body, kept here as the baseline."""
+    user = user_table.get_item(Key={'email': email}).get('Item', {})
+    if subj in user.get('subjects', []):
+        return 400
+    user_table.update_item(
+        Key={'email': email},
+        UpdateExpression="SET subjects = list_append(if_not_exists(subjects, :empty_list), :s)",
+        ExpressionAttributeValues={':s': [subj], ':empty_list': []}
+    )
+    subject_table.update_item(
+        Key={'curriculum': curr, 'subjectName': subj},
+        UpdateExpression="ADD studentCount :inc",
+        ExpressionAttributeValues={':inc': 1}
+    )
+    return 200
+
+
+def serialise_moto_writes():
+    """
+    DynamoDB applies each request (a transaction included) atomically; moto
+    doesn't lock, so a condition check can interleave with another thread's
+    write. Make every item operation atomic so the numbers reflect DynamoDB.
+    """
+    from moto.dynamodb.models import DynamoDBBackend
+    lock = threading.RLock()
+
+    def atomic(fn):
+        def wrapper(*args, **kwargs):
+            with lock:
+                return fn(*args, **kwargs)
+        return wrapper
+
+    for name in ("get_item", "put_item", "update_item", "transact_write_items"):
+        setattr(DynamoDBBackend, name, atomic(getattr(DynamoDBBackend, name)))
+
+
+def run_round(mode, subject, threads, calls, profile_handler):
+    """Enroll the mode's learner in `subject` from `threads` threads released together; returns (status, DynamoDB calls) per request."""
+    email = EMAIL.format(mode=mode)
+    barrier = threading.Barrier(threads)
+    event = {"httpMethod": "POST", "path": "/enroll", "headers": {},
+             "body": json.dumps({"email": email, "subjectName": subject, "curriculum": CURRICULUM})}
+
+    def one(_):
+        calls.count = 0
+        barrier.wait()
+        if mode == "legacy":
+            status = legacy_enroll(profile_handler.user_table, profile_handler.subject_table,
+                                   email, subject, CURRICULUM)
+        else:
+            status = profile_handler.lambda_handler(dict(event), None)["statusCode"]
+        return status, calls.count
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(one, range(threads)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16, help="Concurrent enrollments per round")
+    parser.add_argument("--rounds", type=int, default=20, help="Subjects enrolled per mode")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "af-south-1")
+    os.environ.setdefault("METRICS_SAMPLE_RATE", "0")
+    from bench_harness import local_dynamodb
+
+    serialise_moto_writes()
+    with local_dynamodb(lessons=0):
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            import profile_handler
+
+        # Count DynamoDB requests per thread (each thread serves one enrollment at a time)
+        calls = threading.local()
+        def count(**kwargs):
+            calls.count = getattr(calls, "count", 0) + 1
+        profile_handler.dynamodb.meta.client.meta.events.register("before-call.dynamodb.*", count)
+
+        print(f"{args.threads} concurrent enrollments per subject, {args.rounds} subjects per mode\n")
+        print(f"{'mode':<14}{'200s/round':>12}{'copies':>9}{'count +':>9}{'bad rounds':>12}{'calls/req':>11}")
+        for mode in ("legacy", "transaction"):
+            ok, copies, increments, bad, round_trips = [], [], [], 0, []
+            for r in range(args.rounds):
+                subject = f"Bench {mode} {r}"
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    results = run_round(mode, subject, args.threads, calls, profile_handler)
+                user = profile_handler.user_table.get_item(Key={'email': EMAIL.format(mode=mode)})['Item']
+                count_item = profile_handler.subject_table.get_item(
+                    Key={'curriculum': CURRICULUM, 'subjectName': subject}).get('Item', {})
+                n_ok = sum(1 for status, _ in results if status == 200)
+                n_copies = sum(1 for s in user.get('subjects', []) if s == subject)
+                n_inc = int(count_item.get('studentCount', 0))
+                ok.append(n_ok)
+                copies.append(n_copies)
+                increments.append(n_inc)
+                bad += not (n_ok == n_copies == n_inc == 1)
+                round_trips.extend(n for status, n in results if status == 200)
+            print(f"{mode:<14}{sum(ok) / len(ok):>12.1f}{max(copies):>9}{max(increments):>9}"
+                  f"{bad:>12}{sum(round_trips) / max(1, len(round_trips)):>11.1f}")
+
+        if bad:
+            sys.exit("ERROR: transactional enrollment produced duplicates or a wrong studentCount")
+
+
+if __name__ == "__main__":
+    main()
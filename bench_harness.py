@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark and load-test harness for both Lambdas.
+
+Runs gemini_handler's FastAPI `app` over in-process ASGI and
+profile_handler.lambda_handler directly, against:
+  - a deterministic fake Gemini backend (configurable latency and token rate)
+  - a local DynamoDB stand-in (moto, optionally with added round-trip latency),
+    seeded from extracted_atp_data.json
+
+Reports p50/p95/p99 latency, throughput, time-to-first-byte (SSE) and peak
+traced memory per endpoint at several concurrency levels. Results can be
+saved and compared against a baseline to catch hot-path regressions.
+
+Usage:
+    python bench_harness.py [--concurrency 1 4 8] [--requests 24] [--only chat-stream ...]
+    python bench_harness.py --save baseline.json
+    python bench_harness.py --compare baseline.json --tolerance 0.25
+
+Requires `pip install moto` in addition to requirements.txt.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import types
+import asyncio
+import argparse
+import itertools
+import tracemalloc
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline defaults; set before any handler (or boto3) import
+os.environ.setdefault("AWS_DEFAULT_REGION", "af-south-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("METRICS_SAMPLE_RATE", "0")
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_CURRICULA = ["CAPS#Grade 11#Physical Science", "CAPS#Grade 12#Mathematics", "CAPS#Grade 11#History"]
+
+LOREM = ("Newton's second law states that the net force on an object equals its mass times its "
+         "acceleration, so $F_{net} = ma$. Think of pushing a taxi versus a bicycle along the "
+         "same road: the same push gives the lighter bicycle a much larger acceleration. ").split()
+
+
+# --- Fake Gemini -----------------------------------------------------------
+
+class FakeGemini:
+    """
+    Stand-in for the google.generativeai module.
+    Blocks like the real SDK: `latency` seconds before the first token, then
+    `token_rate` tokens per second, delivered `chunk_tokens` at a time.
+    A fraction `error_rate` of calls fail with a transient 503 after `latency`.
+    `model_speeds` maps model names to their own (latency, token_rate).
+    With `prefill_rate`, uncached prompt tokens (system instruction, chat
+    history, message) add tokens / prefill_rate seconds before the first token.
+    `caching.CachedContent` stands in for explicit context caching: usage
+    reports the cached part as cached_content_token_count and it skips prefill.
+    """
+
+    def __init__(self, latency=0.3, token_rate=200.0, chunk_tokens=8, output_tokens=120, error_rate=0.0,
+                 model_speeds=None, prefill_rate=0.0):
+        self.latency = latency
+        self.model_speeds = model_speeds or {}
+        self.prefill_rate = prefill_rate
+        self.caches = {}
+        self.caches_created = 0
+        self.error_rate = error_rate
+        self.token_rate = token_rate
+        self.chunk_tokens = chunk_tokens
+        self.output_tokens = output_tokens
+        self.calls = 0
+        self.tokens_streamed = 0
+        self.cancelled = 0
+        fake = self
+
+        class GenerativeModel:
+            def __init__(self, model_name="gemini-2.5-flash", system_instruction=None, **kwargs):
+                self.model_name = model_name
+                self.system_instruction = system_instruction
+                self.cached_content = None
+
+            @classmethod
+            def from_cached_content(cls, cached_content, **kwargs):
+                model = cls(cached_content.model)
+                model.cached_content = cached_content
+                return model
+
+            def _context(self, history=()):
+                """(uncached, cached) prompt tokens sent along with the new contents."""
+                cached = self.cached_content.token_count if self.cached_content else 0
+                return count_tokens(self.system_instruction) + count_tokens(list(history)), cached
+
+            def generate_content(self, contents, stream=False, **kwargs):
+                uncached, cached = self._context()
+                return fake.respond(contents, stream=stream, model=self.model_name,
+                                    context_tokens=uncached, cached_tokens=cached)
+
+            def start_chat(self, history=None):
+                model = self
+                history = list(history or [])
+
+                class ChatSession:
+                    def __init__(self):
+                        self.model = model
+                        self.history = history
+
+                    def send_message(self, content, stream=False, **kwargs):
+                        uncached, cached = model._context(self.history)
+                        response = fake.respond(content, stream=stream, chat=True, model=model.model_name,
+                                                context_tokens=uncached, cached_tokens=cached)
+                        parts = content if isinstance(content, list) else [content]
+                        self.history.append(_content("user", parts))
+                        # As the SDK records it: the streamed chunks joined
+                        reply = fake.canned_text("", chat=True) + (" " if stream else "")
+                        self.history.append(_content("model", [reply]))
+                        return response
+
+                return ChatSession()
+
+        class CachedContent:
+            """Explicit cache: what it holds is only counted, never re-sent."""
+            def __init__(self, name, model, token_count):
+                self.name = name
+                self.model = model
+                self.token_count = token_count
+                self.ttl = None
+
+            @classmethod
+            def create(cls, model, system_instruction=None, contents=None, ttl=None, **kwargs):
+                fake.calls += 1
+                fake.caches_created += 1
+                time.sleep(fake.latency)
+                cached = cls(f"cachedContents/{fake.caches_created}", model,
+                             count_tokens(system_instruction) + count_tokens(list(contents or [])))
+                cached.ttl = ttl
+                fake.caches[cached.name] = cached
+                return cached
+
+            @classmethod
+            def get(cls, name):
+                if name not in fake.caches:
+                    raise NotFound(f"404 CachedContent not found (or permission denied): {name}")
+                return fake.caches[name]
+
+            def update(self, ttl=None, **kwargs):
+                self.ttl = ttl
+
+            def delete(self):
+                fake.caches.pop(self.name, None)
+
+        self.GenerativeModel = GenerativeModel
+        self.caching = types.SimpleNamespace(CachedContent=CachedContent)
+
+    def configure(self, **kwargs):
+        pass
+
+    def list_models(self):
+        return []
+
+    def canned_text(self, prompt: str, chat: bool) -> str:
+        """Deterministic reply shaped like what each endpoint parses."""
+        if chat:
+            words = (LOREM * (self.output_tokens // len(LOREM) + 1))[:self.output_tokens]
+            return " ".join(words)
+        if "multiple choice quiz" in prompt:
+            return json.dumps([{"id": f"q{i}", "question": f"Question {i}?", "options": ["a", "b", "c", "d"],
+                                "correctAnswer": 0} for i in range(1, 6)])
+        if "structured test" in prompt:
+            return json.dumps({"subject": "Physical Science", "questions": [
+                {"id": f"q{i}", "question": f"Explain concept {i} with $F=ma$.", "type": "open_ended",
+                 "marks": 10, "expectedAnswer": "Model answer."} for i in range(1, 4)],
+                "totalMarks": 30, "instructions": "Answer all questions."})
+        return json.dumps({"score": 80, "marksAwarded": 24, "totalMarks": 30, "feedback": "Good work.",
+                           "detailedAnalysis": "Solid.", "questionResults": [], "modelSolution": "$F=ma$"})
+
+    def respond(self, contents, stream=False, chat=False, model=None, context_tokens=0, cached_tokens=0):
+        self.calls += 1
+        latency, token_rate = self.model_speeds.get(model, (self.latency, self.token_rate))
+        if self.error_rate and random.random() < self.error_rate:
+            time.sleep(latency)
+            raise ServiceUnavailable("503 The model is overloaded. Please try again later.")
+        parts = contents if isinstance(contents, list) else [contents]
+        prompt = " ".join(p for p in parts if isinstance(p, str))
+        text = self.canned_text(prompt, chat)
+        words = text.split(" ")
+        uncached = context_tokens + len(prompt.split())
+        if self.prefill_rate:
+            latency += uncached / self.prefill_rate
+        usage = types.SimpleNamespace(prompt_token_count=uncached + cached_tokens, candidates_token_count=len(words),
+                                      cached_content_token_count=cached_tokens)
+        if stream:
+            return FakeStream(self, words, usage, latency, token_rate)
+        time.sleep(latency + len(words) / token_rate)
+        return types.SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class ServiceUnavailable(Exception):
+    """Named like google.api_core.exceptions.ServiceUnavailable, which the call policy retries."""
+    code = 503
+
+
+class NotFound(Exception):
+    """Named like google.api_core.exceptions.NotFound (e.g. an expired cache)."""
+    code = 404
+
+
+def _content(role, parts):
+    """SDK-shaped chat content: .role and .parts with .text for text parts."""
+    return types.SimpleNamespace(role=role, parts=[types.SimpleNamespace(text=p) if isinstance(p, str) else p
+                                                   for p in parts])
+
+
+def count_tokens(value) -> int:
+    """Fake tokenizer (words) over strings, parts lists and chat contents (dicts or SDK-shaped)."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.split())
+    if isinstance(value, (list, tuple)):
+        return sum(count_tokens(v) for v in value)
+    if isinstance(value, dict):
+        return count_tokens(value.get('parts', []))
+    if hasattr(value, 'parts'):
+        return count_tokens(list(value.parts))
+    text = getattr(value, 'text', None)
+    return count_tokens(text) if isinstance(text, str) else 258
+
+
+class FakeStream:
+    """Blocking chunk iterator, like the SDK's streaming GenerateContentResponse."""
+
+    def __init__(self, fake, words, usage, latency=None, token_rate=None):
+        self.fake = fake
+        self.latency = fake.latency if latency is None else latency
+        self.token_rate = token_rate or fake.token_rate
+        self.words = words
+        self.usage_metadata = usage
+        self.text = ""
+        self.cancelled = False
+
+    def __iter__(self):
+        time.sleep(self.latency)
+        n = self.fake.chunk_tokens
+        for i in range(0, len(self.words), n):
+            if self.cancelled:
+                return
+            time.sleep(n / self.token_rate)
+            text = " ".join(self.words[i:i + n]) + " "
+            self.text += text
+            self.fake.tokens_streamed += len(self.words[i:i + n])
+            yield types.SimpleNamespace(text=text)
+
+    def cancel(self):
+        """Like cancelling the SDK's gRPC stream: no further chunks are generated."""
+        if not self.cancelled:
+            self.cancelled = True
+            self.fake.cancelled += 1
+
+
+def install_fake_gemini(handler_module, fake=None):
+    """Point gemini_handler at the fake backend and skip SSM configuration."""
+    fake = fake or FakeGemini()
+    handler_module.genai = fake
+    handler_module.GEMINI_CONFIGURED = True
+    return fake
+
+
+# --- Local DynamoDB --------------------------------------------------------
+
+# Mirrors dynamo.tf
+TABLES = {
+    "UserProfiles": {"hash": ("email", "S")},
+    "Subjects": {"hash": ("curriculum", "S"), "range": ("subjectName", "S")},
+    "Lessons": {"hash": ("lessonId", "S"), "gsi": ("UserTopicIndex", ("email", "S"), ("topicId", "S"))},
+    "Curriculum": {"hash": ("curriculumId", "S"), "gsi": ("SubjectGradeIndex", ("grade", "S"), ("subjectName", "S"))},
+    "Topics": {"hash": ("topicId", "S"), "gsi": ("CurriculumTermIndex", ("curriculumId", "S"), ("term", "N"))},
+    "Subtopics": {"hash": ("subtopicId", "S"), "gsi": ("TopicOrderIndex", ("topicId", "S"), ("orderIndex", "N"))},
+    "RateLimits": {"hash": ("bucketKey", "S")},
+    "StreamReplay": {"hash": ("streamKey", "S")},
+    "LessonOpeners": {"hash": ("openerKey", "S")},
+    "SessionState": {"hash": ("sessionKey", "S")},
+}
+
+
+def create_tables(client):
+    for name, spec in TABLES.items():
+        attrs = {spec["hash"]}
+        keys = [{"AttributeName": spec["hash"][0], "KeyType": "HASH"}]
+        if "range" in spec:
+            attrs.add(spec["range"])
+            keys.append({"AttributeName": spec["range"][0], "KeyType": "RANGE"})
+        kwargs = {}
+        if "gsi" in spec:
+            index, h, r = spec["gsi"]
+            attrs.update([h, r])
+            kwargs["GlobalSecondaryIndexes"] = [{
+                "IndexName": index,
+                "KeySchema": [{"AttributeName": h[0], "KeyType": "HASH"}, {"AttributeName": r[0], "KeyType": "RANGE"}],
+                "Projection": {"ProjectionType": "ALL"},
+            }]
+        client.create_table(
+            TableName=name, KeySchema=keys, BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[{"AttributeName": a, "AttributeType": t} for a, t in sorted(attrs)],
+            **kwargs,
+        )
+
+
+def seed(dynamodb, curricula=BENCH_CURRICULA, lessons=20, history_turns=10):
+    """Seed ATP data for a few subjects plus a learner with lesson transcripts."""
+    from seed_curriculum import transform_extracted_data
+
+    data_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extracted_atp_data.json")
+    with open(data_file, "r", encoding="utf-8") as f:
+        extracted = json.load(f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = transform_extracted_data(extracted)
+
+    wanted = set(curricula) if curricula else None
+    keep = lambda cid: wanted is None or cid in wanted
+    topics = [t for t in data["topics"] if keep(t["curriculumId"])]
+    topic_ids = {t["topicId"] for t in topics}
+    rows = {
+        "Curriculum": [c for c in data["curriculum"] if keep(c["curriculumId"])],
+        "Topics": topics,
+        "Subtopics": [s for s in data["subtopics"] if s["topicId"] in topic_ids],
+        "UserProfiles": [{"email": BENCH_EMAIL, "name": "Bench", "surname": "Learner", "grade": "Grade 11",
+                          "curriculum": "CAPS", "subjects": []}],
+        "Subjects": [{"curriculum": "CAPS", "subjectName": "Physical Science", "studentCount": 0}],
+        "Lessons": [],
+    }
+    turn = [{"role": "user", "content": "Can you explain Newton's second law?"},
+            {"role": "ai", "content": " ".join(LOREM)}]
+    for i in range(lessons):
+        topic = topics[i % len(topics)] if topics else {"topicId": "T"}
+        rows["Lessons"].append({
+            "lessonId": f"L_bench{i:04d}", "email": BENCH_EMAIL, "topicId": topic["topicId"],
+            "subjectName": "Physical Science", "grade": "Grade 11", "topicName": topic.get("mainTopic", ""),
+            "topicContext": topic.get("mainTopic", ""), "status": "teaching",
+            "history": turn * history_turns, "quizScore": 70 + i % 30,
+        })
+
+    for name, items in rows.items():
+        with dynamodb.Table(name).batch_writer() as writer:
+            for item in items:
+                writer.put_item(Item=item)
+    return {name: len(items) for name, items in rows.items()}
+
+
+@contextlib.contextmanager
+def local_dynamodb(**seed_kwargs):
+    """moto-backed DynamoDB with the app's tables created and seeded."""
+    try:
+        from moto import mock_aws
+    except ImportError:
+        sys.exit("ERROR: the benchmark harness needs moto (pip install moto)")
+    with mock_aws():
+        import boto3
+        create_tables(boto3.client("dynamodb"))
+        counts = seed(boto3.resource("dynamodb"), **seed_kwargs)
+        yield counts
+
+
+class SlowTable:
+    """
+    Local stand-in for network latency: every item call on the wrapped boto3
+    Table blocks for `latency` seconds first (as a real round trip blocks the
+    calling thread), then runs against moto for the semantics.
+    """
+
+    CALLS = {"get_item", "put_item", "update_item", "delete_item", "query"}
+
+    def __init__(self, table, latency=0.015):
+        self.table = table
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self.table, name)
+        if name not in self.CALLS:
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return call
+
+
+def install_dynamodb_latency(handler_module, latency):
+    """Put SlowTable under gemini_handler's Lessons table."""
+    table = handler_module.lesson_table
+    table.meta  # Bind the lazy table (instrumented resource) first
+    if not isinstance(table._table, SlowTable):
+        table._table = SlowTable(table._table, latency)
+    table._table.latency = latency
+    return table._table
+
+
+# --- Drivers ---------------------------------------------------------------
+
+async def call_asgi(app, method, path, body=b"", headers=None, query_string=b"", disconnect_after=None):
+    """
+    One request straight into an ASGI app. With `disconnect_after`, the client
+    goes away (http.disconnect) once that many body chunks have arrived.
+
+    Returns:
+        dict with 'status', 'ttfb' and 'total' (seconds), 'chunk_times' (arrival of
+        each body chunk, seconds from the start) and 'body' (bytes)
+    """
+    headers = [(k.encode(), v.encode()) for k, v in (headers or {}).items()]
+    headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "https", "path": path, "raw_path": path.encode(),
+        "query_string": query_string, "headers": headers, "client": ("127.0.0.1", 0),
+        "server": ("bench", 443),
+    }
+    pending = [body]
+    result = {"status": None, "ttfb": None, "body": bytearray(), "chunk_times": []}
+    t0 = time.perf_counter()
+    done = asyncio.Event()
+
+    async def receive():
+        if pending:
+            return {"type": "http.request", "body": pending.pop(), "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                result["chunk_times"].append(time.perf_counter() - t0)
+                if result["ttfb"] is None:
+                    result["ttfb"] = result["chunk_times"][0]
+            result["body"] += message.get("body", b"")
+            if not message.get("more_body", False):
+                done.set()
+            elif disconnect_after and len(result["chunk_times"]) >= disconnect_after:
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    result["total"] = time.perf_counter() - t0
+    result["body"] = bytes(result["body"])
+    return result
+
+
+def call_lambda(handler, method, path, query=None, body=None, headers=None):
+    """One API Gateway proxy event through a Lambda handler."""
+    event = {"httpMethod": method, "path": path, "queryStringParameters": query,
+             "headers": headers or {}, "body": json.dumps(body) if body is not None else None}
+    t0 = time.perf_counter()
+    response = handler(event, None)
+    total = time.perf_counter() - t0
+    return {"status": response["statusCode"], "ttfb": total, "total": total, "body": response.get("body")}
+
+
+# --- Scenarios -------------------------------------------------------------
+
+def _test_image():
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (1200, 1600), (255, 255, 255)).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def gemini_scenarios(first_fresh_lesson=20):
+    """
+    name -> fn(i) returning kwargs for call_asgi. Quiz/test generation takes a new
+    seeded lesson (from L_bench<first_fresh_lesson> on) per request: a result just
+    stored for a lesson would be returned without generating.
+    """
+    fresh = itertools.count(first_fresh_lesson)
+    def chat(i):
+        body = json.dumps({"message": "What is acceleration?", "lesson_id": f"L_bench{i % 20:04d}"})
+        return dict(method="POST", path="/chat-stream", body=body.encode(), headers={"content-type": "application/json"})
+
+    def lesson_post(path):
+        def build(i):
+            body = json.dumps({"lesson_id": f"L_bench{next(fresh):04d}"})
+            return dict(method="POST", path=path, body=body.encode(), headers={"content-type": "application/json"})
+        return build
+
+    def grade_quiz(i):
+        body = json.dumps({"lesson_id": f"L_bench{i % 20:04d}", "answers": [0, 1, 0, 2, 0],
+                           "quiz": [{"id": "q1", "question": "?", "options": ["a", "b"], "correctAnswer": 0}]})
+        return dict(method="POST", path="/grade-quiz", body=body.encode(), headers={"content-type": "application/json"})
+
+    image = _test_image()
+
+    def grade_image(i):
+        return dict(method="POST", path="/grade-image", body=image, headers={"content-type": "image/jpeg"},
+                    query_string=f"lesson_id=L_bench{i % 20:04d}".encode())
+
+    return {
+        "chat-stream": chat,
+        "generate-quiz": lesson_post("/generate-quiz"),
+        "generate-test": lesson_post("/generate-test"),
+        "grade-quiz": grade_quiz,
+        "grade-image": grade_image,
+    }
+
+
+def profile_scenarios():
+    """name -> fn(i) returning kwargs for call_lambda."""
+    curriculum_id = BENCH_CURRICULA[0]
+    return {
+        "GET /profile": lambda i: dict(method="GET", path="/profile", query={"email": BENCH_EMAIL}),
+        "GET /curriculum/topics": lambda i: dict(method="GET", path="/curriculum/topics",
+                                                 query={"curriculumId": curriculum_id}),
+        "GET /lessons": lambda i: dict(method="GET", path="/lessons", query={"email": BENCH_EMAIL}),
+        "GET /stats": lambda i: dict(method="GET", path="/stats", query={"email": BENCH_EMAIL}),
+        "POST /lessons/start": lambda i: dict(method="POST", path="/lessons/start", body={
+            "email": BENCH_EMAIL, "topicId": f"{curriculum_id}#T1#W1", "subjectName": "Physical Science",
+            "grade": "Grade 11"}),
+        "POST /lessons/chat": lambda i: dict(method="POST", path="/lessons/chat", body={
+            "lessonId": f"L_bench{i % 20:04d}", "message": "Thanks!", "aiResponse": "You're welcome."}),
+    }
+
+
+# --- Measurement -----------------------------------------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarise(results, wall):
+    totals = sorted(r["total"] for r in results)
+    ttfbs = sorted(r["ttfb"] for r in results if r["ttfb"] is not None)
+    errors = sum(1 for r in results if not r["status"] or r["status"] >= 400)
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "p50_ms": percentile(totals, 0.50) * 1000,
+        "p95_ms": percentile(totals, 0.95) * 1000,
+        "p99_ms": percentile(totals, 0.99) * 1000,
+        "ttfb_p50_ms": percentile(ttfbs, 0.50) * 1000,
+        "throughput_rps": len(results) / wall if wall else 0.0,
+    }
+
+
+def run_asgi(app, build, concurrency, requests):
+    """Issue `requests` calls with at most `concurrency` in flight on one event loop (one container)."""
+    async def main():
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with sem:
+                return await call_asgi(app, **build(i))
+
+        return await asyncio.gather(*(one(i) for i in range(requests)))
+
+    t0 = time.perf_counter()
+    results = asyncio.run(main())
+    return results, time.perf_counter() - t0
+
+
+def run_lambda(handler, build, concurrency, requests):
+    """Issue `requests` calls from `concurrency` threads (like warm containers in parallel)."""
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: call_lambda(handler, **build(i)), range(requests)))
+    return results, time.perf_counter() - t0
+
+
+def measure(runner, target, build, concurrency, requests):
+    """Latency pass, then a short traced pass for peak memory (tracemalloc skews timings)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner(target, build, concurrency, min(concurrency, requests))  # Warm-up
+        results, wall = runner(target, build, concurrency, requests)
+        tracemalloc.start()
+        runner(target, build, concurrency, concurrency)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    stats = summarise(results, wall)
+    stats["peak_mb"] = peak / (1024 * 1024)
+    return stats
+
+
+def print_table(rows):
+    print(f"{'endpoint':<24} {'conc':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'TTFB ms':>8} "
+          f"{'req/s':>7} {'peak MB':>8} {'err':>4}")
+    for r in rows:
+        print(f"{r['endpoint']:<24} {r['concurrency']:>4} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['p99_ms']:>8.1f} {r['ttfb_p50_ms']:>8.1f} {r['throughput_rps']:>7.1f} {r['peak_mb']:>8.2f} "
+              f"{r['errors']:>4}")
+
+
+def compare(rows, baseline_file, tolerance):
+    """Return the rows whose p95 regressed beyond tolerance versus a saved run."""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = {(b["endpoint"], b["concurrency"]): b for b in json.load(f)}
+    regressions = []
+    for r in rows:
+        b = baseline.get((r["endpoint"], r["concurrency"]))
+        if b and b["p95_ms"] > 0 and r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            regressions.append((r, b))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=24, help="Requests per endpoint per level")
+    parser.add_argument("--only", nargs="+", help="Endpoint names to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake Gemini time to first token (s)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Fake Gemini tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake Gemini calls failing with 503")
+    parser.add_argument("--dynamodb-latency", type=float, default=0.0, help="Added round trip per Lessons call (s)")
+    parser.add_argument("--save", help="Write results as JSON")
+    parser.add_argument("--compare", help="Baseline JSON to compare p95 against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 regression (fraction)")
+    args = parser.parse_args()
+
+    # One simulated client sends every request; keep admission control out of the way
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+    os.environ.setdefault("MAX_QUEUED_REQUESTS", "1000000")
+
+    # 20 lessons shared by the other endpoints, plus a fresh one per quiz/test request (warm-up and traced pass too)
+    per_endpoint = sum(min(level, args.requests) + args.requests + level for level in args.concurrency)
+    rows = []
+    with local_dynamodb(lessons=20 + 2 * per_endpoint) as counts:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            import gemini_handler
+            import profile_handler
+        install_fake_gemini(gemini_handler, FakeGemini(latency=args.latency, token_rate=args.token_rate,
+                                                       error_rate=args.error_rate))
+        if args.dynamodb_latency:
+            install_dynamodb_latency(gemini_handler, args.dynamodb_latency)
+
+        print(f"Seeded: {counts}")
+        print(f"Fake Gemini: {args.latency * 1000:.0f} ms to first token, {args.token_rate:.0f} tokens/s, "
+              f"{args.error_rate:.0%} transient errors\n")
+
+        suites = [(run_asgi, gemini_handler.app, gemini_scenarios()),
+                  (run_lambda, profile_handler.lambda_handler, profile_scenarios())]
+        for runner, target, scenarios in suites:
+            for name, build in scenarios.items():
+                if args.only and name not in args.only:
+                    continue
+                for level in args.concurrency:
+                    stats = measure(runner, target, build, level, args.requests)
+                    rows.append({"endpoint": name, "concurrency": level, **stats})
+
+    print_table(rows)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        regressions = compare(rows, args.compare, args.tolerance)
+        for r, b in regressions:
+            print(f"REGRESSION: {r['endpoint']} @ {r['concurrency']}: p95 {b['p95_ms']:.1f} -> {r['p95_ms']:.1f} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"\nNo p95 regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark response serialisation on DynamoDB-shaped payloads built from
+extracted_atp_data.json: the old DecimalEncoder subclass vs json_codec
+(stdlib fallback, and orjson when installed).
+
+Payloads:
+    topics-one   /curriculum/topics for the largest curriculum (topics + subtopics)
+    topics-all   every topic with its subtopics (whole seed)
+    lessons      GET /lessons for a learner: 20 lessons with transcripts and scores
+
+Usage: python bench_json.py [--runs 20]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import contextlib
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import json_codec
+
+
+class DecimalEncoder(json.JSONEncoder):
+    """profile_handler's previous encoder, kept here as the baseline."""
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super(DecimalEncoder, self).default(obj)
+
+
+def as_dynamodb(value):
+    """Numbers come back from the boto3 resource layer as Decimal."""
+    return json.loads(json.dumps(value, default=str), parse_float=Decimal, parse_int=Decimal)
+
+
+def build_payloads():
+    from seed_curriculum import transform_extracted_data
+
+    data_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extracted_atp_data.json")
+    with open(data_file, "r", encoding="utf-8") as f:
+        extracted = json.load(f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = transform_extracted_data(extracted)
+
+    subtopics = {}
+    for st in data["subtopics"]:
+        subtopics.setdefault(st["topicId"], []).append(st)
+    topics = [dict(t, subtopics=subtopics.get(t["topicId"], [])) for t in data["topics"]]
+
+    by_curriculum = {}
+    for t in topics:
+        by_curriculum.setdefault(t["curriculumId"], []).append(t)
+    largest = max(by_curriculum.values(), key=lambda ts: len(json.dumps(ts, default=str)))
+
+    turn = "Newton's second law says $F_{net} = ma$; a taxi needs a bigger push than a bicycle. " * 6
+    lessons = [{
+        "lessonId": f"L_{i:04d}", "email": "bench@example.com", "topicId": topics[i]["topicId"],
+        "status": "completed", "quizScore": 80, "assessmentScore": 72.5, "promptVersion": 1,
+        "quizResult": {"score": 80, "answers": {f"q{q}": q % 4 for q in range(1, 6)}},
+        "history": [{"role": "user" if m % 2 == 0 else "ai", "content": turn} for m in range(24)],
+    } for i in range(20)]
+
+    return {
+        "topics-one": as_dynamodb(largest),
+        "topics-all": as_dynamodb(topics),
+        "lessons": as_dynamodb(lessons),
+    }
+
+
+def time_it(fn, runs):
+    fn()
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    encoders = {
+        "DecimalEncoder": lambda body: json.dumps(body, cls=DecimalEncoder),
+        "json_codec (stdlib)": lambda body: json.dumps(body, default=json_codec._default),
+    }
+    if json_codec.orjson is not None:
+        encoders["json_codec (orjson)"] = json_codec.dumps
+    else:
+        print("orjson not installed; json_codec uses the stdlib path\n")
+
+    print(f"{'payload':<12}{'size KB':>9}  " + "".join(f"{name:>22}" for name in encoders) + f"{'speedup':>10}")
+    for name, body in build_payloads().items():
+        baseline = encoders["DecimalEncoder"](body)
+        for encoder in encoders.values():
+            # Same document (ints vs floats compare equal after parsing)
+            assert json.loads(encoder(body)) == json.loads(baseline)
+        timings = {label: time_it(lambda: encoder(body), args.runs) for label, encoder in encoders.items()}
+        best = min(timings.values())
+        print(f"{name:<12}{len(baseline) / 1024:>9.0f}  "
+              + "".join(f"{ms:>19.2f} ms" for ms in timings.values())
+              + f"{timings['DecimalEncoder'] / best:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
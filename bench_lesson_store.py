@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Stream smoothness under mixed DynamoDB load, with Lessons calls made inline
+on the event loop (the previous behaviour) vs through lesson_store's executor.
+
+One event loop (one container) serves --streams concurrent /chat-stream
+requests, each rebuilding its session from DynamoDB, while --workers loop on
+/generate-quiz (read, plus lease writes until the quiz is stored) and
+/grade-quiz (write). Lessons calls go to moto behind bench_harness.SlowTable,
+which blocks for --dynamodb-latency per call like a real round trip.
+
+Reports, per mode:
+    gap p50/p99/max   time between SSE chunks once tokens flow (ideal: chunk interval)
+    lag p99/max       event-loop lag: how late a 5 ms timer fires
+    mixed req/s       completed quiz requests per second
+
+Usage: python bench_lesson_store.py [--streams 8] [--workers 4] [--duration 5]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_harness
+from bench_harness import FakeGemini, install_fake_gemini, install_dynamodb_latency, local_dynamodb, call_asgi, percentile
+
+MODES = ["inline", "executor"]
+TICK = 0.005
+
+
+async def inline_run(fn, *args, **kwargs):
+    """The old behaviour: the boto3 call blocks the loop for its whole round trip."""
+    return fn(*args, **kwargs)
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - t0 - TICK)
+
+
+async def stream_loop(app, gemini_handler, lesson_id: str, stop: asyncio.Event, gaps: list):
+    body = json.dumps({"message": "What is acceleration?", "lesson_id": lesson_id}).encode()
+    while not stop.is_set():
+        # A fresh session each time, so every stream starts with a Lessons read
+        gemini_handler.sessions.pop(lesson_id, None)
+        result = await call_asgi(app, "POST", "/chat-stream", body, {"content-type": "application/json"})
+        times = result["chunk_times"]
+        # Skip the turn/probe events and first token; measure the steady token flow
+        gaps.extend(b - a for a, b in zip(times[3:-1], times[4:-1]))
+
+
+async def mixed_loop(app, worker: int, stop: asyncio.Event, done: list):
+    i = 0
+    while not stop.is_set():
+        lesson_id = f"L_bench{10 + (worker * 7 + i) % 10:04d}"
+        if i % 2:
+            path, body = "/grade-quiz", {"lesson_id": lesson_id, "answers": [0, 1, 0, 2, 0],
+                                         "quiz": [{"id": "q1", "question": "?", "options": ["a", "b"], "correctAnswer": 0}]}
+        else:
+            path, body = "/generate-quiz", {"lesson_id": lesson_id}
+        result = await call_asgi(app, "POST", path, json.dumps(body).encode(), {"content-type": "application/json"})
+        if result["status"] == 200:
+            done.append(path)
+        i += 1
+
+
+async def run_mode(app, gemini_handler, args):
+    stop = asyncio.Event()
+    gaps, lags, done = [], [], []
+    tasks = [asyncio.ensure_future(measure_lag(stop, lags))]
+    tasks += [asyncio.ensure_future(stream_loop(app, gemini_handler, f"L_bench{s:04d}", stop, gaps))
+              for s in range(args.streams)]
+    tasks += [asyncio.ensure_future(mixed_loop(app, w, stop, done)) for w in range(args.workers)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await gemini_handler.turn_writer.flush()
+    return sorted(gaps), sorted(lags), len(done) / args.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=8, help="Concurrent chat streams")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent quiz request loops")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per mode")
+    parser.add_argument("--dynamodb-latency", type=float, default=0.015, help="Round trip per Lessons call (s)")
+    parser.add_argument("--token-rate", type=float, default=400.0, help="Fake Gemini tokens per second")
+    parser.add_argument("--chunk-tokens", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+    os.environ.setdefault("MAX_QUEUED_REQUESTS", "1000000")
+    os.environ.setdefault("MAX_ACTIVE_REQUESTS", "1000")
+
+    with local_dynamodb(lessons=20, history_turns=4):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import gemini_handler
+            import lesson_store
+        install_fake_gemini(gemini_handler, FakeGemini(latency=0.05, token_rate=args.token_rate,
+                                                       chunk_tokens=args.chunk_tokens, output_tokens=160))
+        install_dynamodb_latency(gemini_handler, args.dynamodb_latency)
+        executor_run = lesson_store.run
+
+        interval = args.chunk_tokens / args.token_rate * 1000
+        print(f"{args.streams} streams + {args.workers} quiz workers for {args.duration:.0f} s per mode; "
+              f"DynamoDB {args.dynamodb_latency * 1000:.0f} ms per call; chunk every {interval:.0f} ms\n")
+        print(f"{'mode':<10}{'gap p50':>9}{'gap p99':>9}{'gap max':>9}{'lag p99':>9}{'lag max':>9}{'mixed req/s':>13}")
+        for mode in args.modes:
+            lesson_store.run = inline_run if mode == "inline" else executor_run
+            with contextlib.redirect_stdout(io.StringIO()):
+                gaps, lags, rate = asyncio.run(run_mode(gemini_handler.app, gemini_handler, args))
+            ms = lambda values, p: percentile(values, p) * 1000
+            print(f"{mode:<10}{ms(gaps, 0.5):>9.1f}{ms(gaps, 0.99):>9.1f}{ms(gaps, 1.0):>9.1f}"
+                  f"{ms(lags, 0.99):>9.1f}{ms(lags, 1.0):>9.1f}{rate:>13.1f}")
+        lesson_store.run = executor_run
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Model routing: latency and estimated cost per endpoint with every request on
+the full tier (GEMINI_ROUTES forcing gemini-2.5-flash, the behaviour before
+routing) vs the model_routing policy, and the policy again while the full
+tier is slow (its latency EWMA over the SLO, so eligible chat goes fast).
+
+Requests go through gemini_handler's ASGI app against FakeGemini, where each
+model has its own speed (--fast / --full: first-token seconds and tokens/s),
+and moto DynamoDB. Chat sends a one-line clarification and a longer question
+per run; the longer one moves the session up to full (or, with full over its
+SLO, keeps it on fast). Cost is estimated from token counts at
+model_routing.TIER_PRICES.
+
+Usage: python bench_routing.py [--runs 6]
+"""
+
+import io
+import os
+import sys
+import json
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_harness
+from bench_harness import FakeGemini, install_fake_gemini, local_dynamodb, call_asgi, percentile
+
+SHORT_QUESTION = "What does N stand for?"
+LONG_QUESTION = ("Can you explain again why the normal force on the block is smaller on the incline "
+                 "than on the flat table, and how I should draw the free body diagram?")
+
+
+def requests_for(lesson_id: str, image: bytes) -> list:
+    """(endpoint label, call_asgi kwargs) for one learner's session."""
+    json_headers = {"content-type": "application/json"}
+
+    def post(path, **data):
+        return dict(method="POST", path=path, body=json.dumps({"lesson_id": lesson_id, **data}).encode(),
+                    headers=json_headers)
+
+    quiz = [{"id": "q1", "question": "?", "options": ["a", "b"], "correctAnswer": 0}]
+    return [
+        ("chat short", post("/chat-stream", message=SHORT_QUESTION)),
+        ("chat long", post("/chat-stream", message=LONG_QUESTION)),
+        ("generate-quiz", post("/generate-quiz")),
+        ("grade-quiz", post("/grade-quiz", answers=[0, 1, 0, 2, 0], quiz=quiz)),
+        ("generate-test", post("/generate-test")),
+        ("grade-image", dict(method="POST", path="/grade-image", body=image, headers={"content-type": "image/jpeg"},
+                             query_string=f"lesson_id={lesson_id}".encode())),
+    ]
+
+
+def reset_routing(model_routing, overrides):
+    model_routing.ROUTE_OVERRIDES.clear()
+    model_routing.ROUTE_OVERRIDES.update(overrides)
+    model_routing._latency.clear()
+    model_routing._over_slo.clear()
+    for tier in model_routing.MODEL_TIERS:
+        model_routing.stats[tier] = dict.fromkeys(model_routing.stats[tier], 0)
+    model_routing.stats["reasons"] = {}
+
+
+async def run_mode(gemini_handler, first_lesson, args, image):
+    app = gemini_handler.app
+    latencies = {}
+    for i in range(args.runs):
+        lesson_id = f"L_bench{first_lesson + i:04d}"
+        for label, kwargs in requests_for(lesson_id, image):
+            r = await call_asgi(app, **kwargs)
+            assert r["status"] == 200, (label, r["body"][:200])
+            # Chat: first text chunk (after the turn and "Reflecting..." frames); others: whole call
+            latencies.setdefault(label, []).append(r["chunk_times"][2] if label.startswith("chat") else r["total"])
+    await gemini_handler.turn_writer.flush()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=6, help="Learner sessions per mode")
+    parser.add_argument("--fast", type=float, nargs=2, default=[0.25, 400.0], help="Flash-Lite latency, tokens/s")
+    parser.add_argument("--full", type=float, nargs=2, default=[0.6, 200.0], help="Flash latency, tokens/s")
+    parser.add_argument("--slow-full", type=float, default=2.0, help="Flash latency in the slow-tier mode")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+    modes = [("all full", True, args.full[0]), ("routed", False, args.full[0]), ("routed, full slow", False, args.slow_full)]
+    results = []
+    with local_dynamodb(lessons=args.runs * len(modes), history_turns=4):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import gemini_handler
+            import model_routing
+        tiers = model_routing.MODEL_TIERS
+        image = bench_harness._test_image()
+        for m, (name, all_full, full_latency) in enumerate(modes):
+            fake = FakeGemini(chunk_tokens=4, model_speeds={
+                tiers["fast"]: tuple(args.fast), tiers["full"]: (full_latency, args.full[1]),
+            })
+            install_fake_gemini(gemini_handler, fake)
+            gemini_handler.sessions.clear()
+            gemini_handler.models.clear()
+            gemini_handler.replay.streams.clear()  # Streams of the previous mode belong to its event loop
+            reset_routing(model_routing, {endpoint: "full" for endpoint in model_routing.DEFAULT_TIERS} if all_full else {})
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies = asyncio.run(run_mode(gemini_handler, m * args.runs, args, image))
+            stats = json.loads(json.dumps(model_routing.stats))
+            results.append((name, latencies, stats))
+
+    print(f"Fake Gemini: Flash-Lite {args.fast[0] * 1000:.0f} ms + {args.fast[1]:.0f} tok/s, "
+          f"Flash {args.full[0] * 1000:.0f} ms + {args.full[1]:.0f} tok/s "
+          f"(slow mode: {args.slow_full * 1000:.0f} ms); {args.runs} sessions per mode")
+    print("p50 seconds (chat: first text chunk)\n")
+    labels = list(results[0][1])
+    print(f"{'endpoint':<16}" + "".join(f"{name:>20}" for name, _, _ in results))
+    for label in labels:
+        print(f"{label:<16}" + "".join(f"{percentile(sorted(lat[label]), 0.5):>20.2f}" for _, lat, _ in results))
+
+    print(f"\n{'mode':<20}{'fast calls':>12}{'full calls':>12}{'cost USD':>12}{'vs all full':>13}  reasons")
+    baseline = None
+    for name, _, stats in results:
+        cost = sum(stats[tier]["cost_usd"] for tier in tiers)
+        baseline = baseline or cost
+        print(f"{name:<20}{stats['fast']['calls']:>12}{stats['full']['calls']:>12}{cost:>12.5f}"
+              f"{cost / baseline:>13.0%}  {stats['reasons']}")
+
+
+if __name__ == "__main__":
+    main()
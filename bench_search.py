@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark GET /curriculum/search: index size, one-off load per container,
+and per-query latency (cold token decode, then warm) through
+profile_handler.lambda_handler, plus the top hit for each query.
+
+Usage: python bench_search.py [--runs 50] [--rebuild]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("AWS_DEFAULT_REGION", "af-south-1")
+os.environ.setdefault("METRICS_SAMPLE_RATE", "0")
+
+QUERIES = [
+    "which week covers Newton's second law?",
+    "photosynthesis",
+    "Wall Street crash",
+    "quadratic equations",
+    "Fnet = ma",
+    "trigonometry identities",
+    "electric circuits Ohm's law",
+    "poetry essay",
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round((len(values) - 1) * p)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50, help="Warm repetitions per query")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild curriculum_index.json first")
+    args = parser.parse_args()
+
+    import curriculum_search
+    if args.rebuild or not os.path.exists(curriculum_search.CURRICULUM_INDEX_FILE):
+        from seed_curriculum import transform_extracted_data
+        data_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extracted_atp_data.json")
+        with open(data_file, "r", encoding="utf-8") as f, contextlib.redirect_stdout(io.StringIO()):
+            data = transform_extracted_data(json.load(f))
+        t0 = time.perf_counter()
+        built = curriculum_search.write_index(data, version=curriculum_search.data_version(data_file))
+        print(f"Built index in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    size = os.path.getsize(curriculum_search.CURRICULUM_INDEX_FILE)
+    t0 = time.perf_counter()
+    index = curriculum_search.load()
+    load_ms = (time.perf_counter() - t0) * 1000
+    print(f"Index: {len(index['docs'])} topics, {len(index['postings'])} tokens, {size / 1024:.0f} KB; "
+          f"load {load_ms:.1f} ms (once per container)\n")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import profile_handler
+
+    def call(q):
+        event = {"httpMethod": "GET", "path": "/curriculum/search", "headers": {},
+                 "queryStringParameters": {"q": q, "limit": "10"}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            response = profile_handler.lambda_handler(event, None)
+            elapsed = (time.perf_counter() - t0) * 1000
+        assert response["statusCode"] == 200, response
+        return elapsed, json.loads(response["body"])["results"]
+
+    print(f"{'query':<42}{'cold ms':>9}{'p50 ms':>8}{'p99 ms':>8}  top hit")
+    warm_all = []
+    for q in QUERIES:
+        cold, results = call(q)
+        warm = [call(q)[0] for _ in range(args.runs)]
+        warm_all.extend(warm)
+        top = results[0] if results else {}
+        hit = f"{top.get('grade', '')} {top.get('subjectName', '')} T{top.get('term', '')}W{top.get('week', '')}: {top.get('mainTopic', '')}"
+        print(f"{q[:41]:<42}{cold:>9.2f}{percentile(warm, 0.5):>8.2f}{percentile(warm, 0.99):>8.2f}  {hit[:60]}")
+    print(f"\nAll queries through the handler: p50 {percentile(warm_all, 0.5):.2f} ms, "
+          f"p99 {percentile(warm_all, 0.99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Chat-session rebuild on a container that has not seen the lesson: reading
+Lessons (history + instruction fields, as before shared session state) vs
+one SessionState item (session_state.py), for transcripts of several lengths.
+
+Transcripts are made of distinct turns (random draws from the fake tutor's
+vocabulary). Per lesson a chat turn is sent first, so both the Lessons item
+and the session state hold the same transcript; the lesson also carries a generated
+quiz and test, as finished lessons do. Each rebuild is then timed --repeats
+times, up to SDK-ready chat contents, against moto DynamoDB with --latency
+seconds added per call. Bytes are the GetItem response bodies; read units
+are what an eventually consistent GetItem of the whole item bills (DynamoDB
+charges for the full item, whatever the projection).
+
+Usage: python bench_session_state.py [--turns 10 30 100] [--lessons 3] [--repeats 20]
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_harness
+from bench_harness import FakeGemini, install_fake_gemini, local_dynamodb, call_asgi, percentile, SlowTable
+
+
+def item_size(item: dict) -> int:
+    """Approximate DynamoDB item size (attribute names + values), for read units."""
+    def size(value):
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        if hasattr(value, "value"):
+            return len(value.value)
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        if isinstance(value, dict):
+            return 3 + sum(len(k) + size(v) + 1 for k, v in value.items())
+        if isinstance(value, (list, set, tuple)):
+            return 3 + sum(size(v) + 1 for v in value)
+        return 21 if not isinstance(value, bool) else 1
+    return sum(len(k) + size(v) for k, v in item.items())
+
+
+def read_units(item: dict) -> float:
+    return math.ceil(max(item_size(item), 1) / 4096) * 0.5
+
+
+async def run(gemini_handler, args):
+    import session_state
+    app = gemini_handler.app
+    headers = {"content-type": "application/json"}
+    responses = []
+    gemini_handler.lesson_table.meta.client.meta.events.register(
+        "after-call.dynamodb.GetItem", lambda http_response, **kw: responses.append(len(http_response.content))
+    )
+    quiz = json.loads(FakeGemini().canned_text("multiple choice quiz", chat=False))
+    test = json.loads(FakeGemini().canned_text("structured test", chat=False))
+    base = gemini_handler.lesson_table.get_item(Key={"lessonId": "L_bench0000"})["Item"]
+    # Distinct turns (the seeded transcript repeats one turn, which compresses unrealistically well)
+    rng = random.Random(7)
+    words = bench_harness.LOREM
+    history = []
+    for _ in range(max(args.turns)):
+        history.append({"role": "user", "content": " ".join(rng.sample(words, 8)) + "?"})
+        history.append({"role": "ai", "content": " ".join(rng.choice(words) for _ in range(90))})
+
+    rows = []
+    n = 0
+    for turns in args.turns:
+        lesson_ids = []
+        for _ in range(args.lessons):
+            lesson_id = f"L_state{n:04d}"
+            n += 1
+            gemini_handler.lesson_table.put_item(Item={
+                **base, "lessonId": lesson_id, "history": history[:2 * turns],
+                "generatedQuiz": quiz, "generatedTest": test, "quizResult": {"score": 80, "feedback": "Good."},
+            })
+            body = json.dumps({"message": "What is acceleration?", "lesson_id": lesson_id}).encode()
+            r = await call_asgi(app, "POST", "/chat-stream", body, headers)
+            assert r["status"] == 200 and b"[DONE]" in r["body"], r["body"][-200:]
+            await gemini_handler.turn_writer.flush()
+            await gemini_handler.session_store.flush()
+            lesson_ids.append(lesson_id)
+
+        timings = {"lessons": [], "state": []}
+        wire = {"lessons": [], "state": []}
+        for _ in range(args.repeats):
+            for lesson_id in lesson_ids:
+                del responses[:]
+                t0 = time.perf_counter()
+                item = await gemini_handler.lessons.get(lesson_id, gemini_handler.SESSION_FIELDS)
+                lessons_contents = gemini_handler.chat_history(item["history"])
+                timings["lessons"].append(time.perf_counter() - t0)
+                wire["lessons"].append(sum(responses))
+
+                del responses[:]
+                t0 = time.perf_counter()
+                state = await gemini_handler.session_store.load(lesson_id)
+                state_contents = gemini_handler.chat_history(state.history)
+                timings["state"].append(time.perf_counter() - t0)
+                wire["state"].append(sum(responses))
+                assert state_contents == lessons_contents
+
+        full_item = gemini_handler.lesson_table.get_item(Key={"lessonId": lesson_ids[0]})["Item"]
+        state_item = gemini_handler.session_store.table.get_item(Key={"sessionKey": lesson_ids[0]})["Item"]
+        blob = bytes(state_item["state"].value)
+        raw = len(json.dumps(session_state.decode(blob)._asdict(), ensure_ascii=False).encode())
+        rows.append((turns, timings, wire, read_units(full_item), read_units(state_item), len(blob), raw))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 30, 100], help="Question/answer pairs per transcript")
+    parser.add_argument("--lessons", type=int, default=3, help="Lessons per transcript length")
+    parser.add_argument("--repeats", type=int, default=20, help="Rebuilds timed per lesson and path")
+    parser.add_argument("--latency", type=float, default=0.005, help="Added DynamoDB round trip (s)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+    os.environ["SESSION_STATE_TABLE"] = "SessionState"
+    with local_dynamodb(lessons=1, history_turns=max(args.turns)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import gemini_handler
+        install_fake_gemini(gemini_handler, FakeGemini(latency=0.01, token_rate=5000))
+        bench_harness.install_dynamodb_latency(gemini_handler, args.latency)
+        state_table = gemini_handler.session_store.table
+        state_table.meta  # Bind the lazy table, then add the same round trip
+        state_table._table = SlowTable(state_table._table, args.latency)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = asyncio.run(run(gemini_handler, args))
+
+    print(f"Rebuild up to SDK chat contents; {args.lessons} lessons x {args.repeats} rebuilds per length, "
+          f"{args.latency * 1000:.0f} ms added per DynamoDB call (p50)\n")
+    print(f"{'turns':>6}{'Lessons ms':>12}{'state ms':>10}{'Lessons B':>11}{'state B':>9}"
+          f"{'RCU Lessons':>13}{'RCU state':>11}{'blob B':>8}{'JSON B':>8}")
+    for turns, timings, wire, rcu_lessons, rcu_state, blob, raw in rows:
+        p50 = {k: percentile(sorted(v), 0.5) * 1000 for k, v in timings.items()}
+        print(f"{turns:>6}{p50['lessons']:>12.1f}{p50['state']:>10.1f}{percentile(sorted(wire['lessons']), 0.5):>11.0f}"
+              f"{percentile(sorted(wire['state']), 0.5):>9.0f}{rcu_lessons:>13.1f}{rcu_state:>11.1f}{blob:>8}{raw:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark /grade-image upload transports: base64-in-JSON vs multipart vs raw body.
+Drives the FastAPI app in-process over ASGI with Gemini, DynamoDB and image
+preprocessing stubbed out, so only request parsing/copying is measured.
+Each mode runs in a fresh subprocess so peak RSS is not shared between modes.
+
+Usage: python bench_upload.py [--size-mb 4] [--requests 20]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import resource
+import subprocess
+import tracemalloc
+
+MODES = ["json", "multipart", "raw"]
+CHUNK_SIZE = 64 * 1024  # Body delivered to the app in chunks, as an ASGI server would
+BOUNDARY = "----benchboundary"
+
+
+def build_request(mode: str, image: bytes):
+    """Return (headers, query_string, body) for one /grade-image request."""
+    if mode == "json":
+        data_url = "data:image/jpeg;base64," + base64.b64encode(image).decode("ascii")
+        body = json.dumps({"lesson_id": "L_bench", "images": [data_url]}).encode()
+        return [(b"content-type", b"application/json")], b"", body
+    if mode == "multipart":
+        body = (
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"lesson_id\"\r\n\r\nL_bench\r\n"
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"pages\"; filename=\"p1.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n"
+        ).encode() + image + f"\r\n--{BOUNDARY}--\r\n".encode()
+        return [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())], b"", body
+    return [(b"content-type", b"image/jpeg")], b"lesson_id=L_bench", image
+
+
+async def call(app, headers, query_string, body):
+    """Issue one request straight into the ASGI app and return the status code."""
+    headers = headers + [(b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "https", "path": "/grade-image", "raw_path": b"/grade-image",
+        "query_string": query_string, "headers": headers, "client": ("127.0.0.1", 0),
+        "server": ("bench", 443),
+    }
+    view = memoryview(body)
+    offsets = list(range(0, len(body), CHUNK_SIZE)) or [0]
+    status = {}
+
+    async def receive():
+        if offsets:
+            i = offsets.pop(0)
+            return {"type": "http.request", "body": bytes(view[i:i + CHUNK_SIZE]), "more_body": bool(offsets)}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status.get("code")
+
+
+def run_mode(mode: str, size_mb: float, requests: int):
+    """Child process: time `requests` uploads and report latency and memory as JSON."""
+    os.environ.setdefault("AWS_DEFAULT_REGION", "af-south-1")
+    import gemini_handler as g
+
+    class FakeResponse:
+        text = '{"score": 80, "questionResults": []}'
+
+    class FakeModel:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def generate_content(self, contents, **kwargs):
+            return FakeResponse()
+
+    class FakeTable:
+        def get_item(self, **kwargs):
+            return {"Item": {"subjectName": "Mathematics", "generatedTest": {"questions": []}}}
+
+        def update_item(self, **kwargs):
+            return {}
+
+    async def passthrough(raw_pages, **kwargs):
+        return [{"mime_type": "image/jpeg", "data": bytes(raw)} for raw in raw_pages]
+
+    g.GEMINI_CONFIGURED = True
+    g.genai.GenerativeModel = FakeModel
+    g.lessons.table = FakeTable()
+    g.prepare_images = passthrough
+
+    image = b"\xff\xd8\xff\xe0" + os.urandom(int(size_mb * 1024 * 1024))
+    headers, query_string, body = build_request(mode, image)
+    del image
+
+    # Warm-up outside the measured window: the first request pays for the lazy SDK import
+    code = asyncio.run(call(g.app, headers, query_string, body))
+    assert code == 200, f"{mode}: HTTP {code}"
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies, peaks = [], []
+    for _ in range(requests):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        code = asyncio.run(call(g.app, headers, query_string, body))
+        latencies.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert code == 200, f"{mode}: HTTP {code}"
+
+    latencies.sort()
+    print(json.dumps({
+        "mode": mode,
+        "wire_bytes": len(body),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "peak_alloc_mb": max(peaks) / (1024 * 1024),
+        "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=4.0, help="Synthetic image size")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per mode")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.size_mb, args.requests)
+        return
+
+    print(f"Upload transport benchmark: {args.size_mb} MB image, {args.requests} requests/mode\n")
+    print(f"{'mode':<10} {'wire MB':>8} {'p50 ms':>8} {'max ms':>8} {'peak alloc MB':>14} {'RSS growth MB':>14}")
+    for mode in MODES:
+        out = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--size-mb", str(args.size_mb), "--requests", str(args.requests)],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['mode']:<10} {r['wire_bytes'] / 1048576:>8.2f} {r['p50_ms']:>8.1f} {r['max_ms']:>8.1f} "
+              f"{r['peak_alloc_mb']:>14.2f} {r['rss_growth_mb']:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Idempotent, ordered appends of chat turns to Lessons.history.
+
+Shared by gemini_handler (write-behind once the stream has finished) and
+profile_handler (/lessons/chat, which the frontend still sends as a backup and
+which leaves a turn whose predecessor has not landed to the write-behind).
+Each turn carries:
+    turnId    unique per turn; kept in the lesson's `turnIds` string set, so a
+              second append of the same turn (from either path) is a no-op
+    position  len(history) when the turn was sent; the append only lands at
+              that position, which keeps turns strictly ordered per lesson
+
+Config (environment):
+    TURN_WRITE_ATTEMPTS      tries per turn before giving up on ordering/writing
+    TURN_RETRY_BASE_SECONDS  first retry delay (doubles per attempt)
+    TURN_BUFFER_LIMIT        pending turns per container before submit() waits
+"""
+
+import os
+import asyncio
+from collections import deque
+
+TURN_WRITE_ATTEMPTS = int(os.environ.get("TURN_WRITE_ATTEMPTS", "5"))
+TURN_RETRY_BASE_SECONDS = float(os.environ.get("TURN_RETRY_BASE_SECONDS", "0.2"))
+TURN_BUFFER_LIMIT = int(os.environ.get("TURN_BUFFER_LIMIT", "500"))
+
+# append_turn outcomes
+APPENDED = "appended"
+DUPLICATE = "duplicate"
+PENDING = "pending"  # an earlier turn for the lesson has not landed yet
+
+
+def new_turn_id() -> str:
+    return os.urandom(8).hex()
+
+
+def turn_messages(user_msg: str, ai_response: str = None) -> list:
+    messages = [{'role': 'user', 'content': user_msg}]
+    if ai_response:
+        messages.append({'role': 'ai', 'content': ai_response})
+    return messages
+
+
+def append_turn(table, lesson_id: str, turn_id: str, messages: list, position: int = None) -> str:
+    """
+    Append one turn unless it is already stored.
+
+    With `position`, the append only succeeds while the history still has exactly
+    that many messages; if it is shorter an earlier turn is missing (PENDING), if
+    it is longer another writer got there first and the turn goes on the end.
+    """
+    condition = "NOT contains(turnIds, :tid)"
+    values = {':tid': turn_id, ':tids': {turn_id}, ':m': messages, ':empty': []}
+    if position is not None:
+        slot = "size(history) = :pos"
+        if position == 0:
+            slot += " OR attribute_not_exists(history)"
+        condition += f" AND ({slot})"
+        values[':pos'] = position
+
+    try:
+        table.update_item(
+            Key={'lessonId': lesson_id},
+            UpdateExpression="SET history = list_append(if_not_exists(history, :empty), :m) ADD turnIds :tids",
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values
+        )
+        return APPENDED
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+    item = table.get_item(
+        Key={'lessonId': lesson_id},
+        ProjectionExpression="turnIds, history",
+        ConsistentRead=True
+    ).get('Item', {})
+    if turn_id in item.get('turnIds', set()):
+        return DUPLICATE
+    if position is not None and len(item.get('history', [])) < position:
+        return PENDING
+    # History moved past our slot (e.g. a turn from another container); keep the turn, at the end
+    return append_turn(table, lesson_id, turn_id, messages)
+
+
+class WriteBehind:
+    """
+    Commits turns in the background so the stream can finish first.
+    One FIFO worker per lesson keeps its turns in order; failed writes stay
+    buffered and are retried with exponential backoff.
+    """
+
+    def __init__(self, store, attempts: int = None, base_delay: float = None, limit: int = None):
+        self.store = store  # lesson_store.LessonStore
+        self.attempts = attempts or TURN_WRITE_ATTEMPTS
+        self.base_delay = base_delay or TURN_RETRY_BASE_SECONDS
+        self.limit = limit or TURN_BUFFER_LIMIT
+        self.queues = {}
+        self.workers = {}
+        self.stats = {"committed": 0, "duplicates": 0, "retries": 0, "failed": 0}
+
+    def pending(self, lesson_id: str = None) -> int:
+        if lesson_id is not None:
+            return len(self.queues.get(lesson_id, ()))
+        return sum(len(q) for q in self.queues.values())
+
+    async def submit(self, lesson_id: str, turn_id: str, messages: list, position: int = None):
+        """Queue a turn; only waits when the buffer is full."""
+        if self.pending() >= self.limit:
+            print(f"Warning: Turn buffer full ({self.limit}), waiting for writes to drain")
+            await self.flush()
+        self.queues.setdefault(lesson_id, deque()).append((turn_id, messages, position))
+        if lesson_id not in self.workers:
+            self.workers[lesson_id] = asyncio.ensure_future(self._drain(lesson_id))
+
+    async def flush(self, lesson_id: str = None, timeout: float = None):
+        """Wait for queued turns (one lesson or all) to be written."""
+        workers = [self.workers[lesson_id]] if lesson_id in self.workers else (
+            [] if lesson_id is not None else list(self.workers.values()))
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    async def _drain(self, lesson_id: str):
+        queue = self.queues[lesson_id]
+        try:
+            while queue:
+                turn_id, messages, position = queue[0]
+                await self._commit(lesson_id, turn_id, messages, position)
+                queue.popleft()
+        finally:
+            del self.workers[lesson_id]
+            if not queue:
+                self.queues.pop(lesson_id, None)
+
+    async def _commit(self, lesson_id: str, turn_id: str, messages: list, position: int):
+        for attempt in range(self.attempts):
+            # Last try: stop waiting for a missing predecessor and append at the end
+            slot = position if attempt < self.attempts - 1 else None
+            try:
+                result = await self.store.call(append_turn, lesson_id, turn_id, messages, slot)
+                if result == APPENDED:
+                    self.stats["committed"] += 1
+                    return
+                if result == DUPLICATE:
+                    self.stats["duplicates"] += 1
+                    return
+            except Exception as e:
+                print(f"Warning: Turn write for {lesson_id} failed (attempt {attempt + 1}): {e}")
+            self.stats["retries"] += 1
+            await asyncio.sleep(self.base_delay * 2 ** attempt)
+        self.stats["failed"] += 1
+        print(f"ERROR: Dropping turn {turn_id} for {lesson_id} after {self.attempts} attempts")
@@ -0,0 +1,222 @@
+"""
+Gemini context caching (explicit cached content) for lesson transcripts.
+
+A chat session rebuilt for a returning learner starts from the tutor system
+instruction plus the whole lesson transcript, and every message re-sends all
+of it. Once that prefix is past CONTEXT_CACHE_MIN_TOKENS it is stored once as
+Gemini cached content (per lesson and model) and requests only send what came
+after it. Cached tokens are billed at a quarter of the input price and are not
+processed again, so the first token also arrives sooner.
+
+    attach()   prefix to start a chat session on: this container's entry, else
+               the one recorded on the lesson (Lessons.contextCache, so other
+               containers reuse it), else a new cache. With force=True (refresh,
+               once a session's uncached tail reaches CONTEXT_CACHE_REFRESH_TOKENS)
+               a longer cache replaces the lesson's entry.
+    cover()    an existing prefix for a one-shot call over the same transcript
+               (quiz/test generation); never creates one.
+
+A prefix only applies while its digest matches the first `turns` contents of
+the history it is used with, so an edited transcript just misses. Caches are
+not deleted when superseded (another container may still be on them); they
+expire after CONTEXT_CACHE_TTL_SECONDS, extended whenever one with less than
+half of it left is used. Any failure (quota, model without caching, a cache
+gone early) falls back to sending the full prompt, and a failed creation is
+not retried for that lesson and model for CONTEXT_CACHE_RETRY_SECONDS.
+
+Config (environment):
+    CONTEXT_CACHE_ENABLED          "0" sends full prompts only
+    CONTEXT_CACHE_TTL_SECONDS      cache lifetime, renewed on use
+    CONTEXT_CACHE_MIN_TOKENS       smallest prefix worth caching (Gemini 2.5 minimum: 1024)
+    CONTEXT_CACHE_REFRESH_TOKENS   uncached tail (estimated tokens) that triggers a longer cache
+    CONTEXT_CACHE_RETRY_SECONDS    wait after a failed creation
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+from instrumentation import add_metric
+from model_routing import estimate_tokens, estimate_history_tokens
+
+ENABLED = os.environ.get("CONTEXT_CACHE_ENABLED", "1") != "0"
+TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "1800"))
+MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+REFRESH_TOKENS = int(os.environ.get("CONTEXT_CACHE_REFRESH_TOKENS", "2048"))
+RETRY_SECONDS = int(os.environ.get("CONTEXT_CACHE_RETRY_SECONDS", "300"))
+
+# A prefix this close to expiry is treated as gone (a request may still be in flight)
+EXPIRY_MARGIN_SECONDS = 60
+
+# Counters since container start (also added to the per-request metrics)
+stats = {"hits": 0, "shared_hits": 0, "created": 0, "refreshed": 0, "extended": 0, "fallbacks": 0}
+
+
+def contents_digest(contents) -> str:
+    """Fingerprint of chat contents: DynamoDB-shaped dicts or SDK Content objects."""
+    digest = hashlib.sha256()
+    for turn in contents:
+        role = turn['role'] if isinstance(turn, dict) else getattr(turn, 'role', '')
+        parts = turn['parts'] if isinstance(turn, dict) else getattr(turn, 'parts', [])
+        digest.update(role.encode("utf-8"))
+        for part in parts:
+            text = getattr(part, 'text', part)
+            digest.update(b"\0" + (text if isinstance(text, str) else "<image>").encode("utf-8"))
+        digest.update(b"\1")
+    return digest.hexdigest()[:16]
+
+
+class CachedPrefix:
+    """A cached system instruction + the first `turns` chat contents of a lesson."""
+
+    def __init__(self, name, model, turns, digest, contents, expires, cached=None):
+        self.name = name
+        self.model = model
+        self.turns = turns
+        self.digest = digest
+        self.contents = contents  # What the cache holds, to move a session to another model
+        self.expires = expires    # Epoch seconds
+        self.cached = cached      # SDK CachedContent
+
+    def usable(self, contents) -> bool:
+        return (self.expires - time.time() > EXPIRY_MARGIN_SECONDS and self.turns <= len(contents)
+                and contents_digest(contents[:self.turns]) == self.digest)
+
+    def meta(self) -> dict:
+        return {'name': self.name, 'turns': self.turns, 'digest': self.digest, 'expiresAt': int(self.expires)}
+
+
+def _count(name: str):
+    stats[name] += 1
+    add_metric(f"context_cache_{name}", 1)
+
+
+class ContextCache:
+    """
+    Per-container registry of lesson context caches.
+
+    Args:
+        client: () -> the google.generativeai module (resolved per call, so a swapped backend is used)
+        store: LessonStore the cache names are recorded on (Lessons.contextCache, a map per model)
+    """
+
+    def __init__(self, client, store=None):
+        self.client = client
+        self.store = store
+        self.entries = {}  # (lesson_id, model) -> CachedPrefix
+        self._failed = {}  # (lesson_id, model) -> monotonic time creation may be retried
+        self.tasks = set()
+
+    async def attach(self, lesson_id: str, model: str, system_instruction, contents: list,
+                     stored: dict = None, force: bool = False):
+        """CachedPrefix to start a chat on `contents` with, or None to send them in full."""
+        if not ENABLED:
+            return None
+        key = (lesson_id, model)
+        if not force:
+            prefix = await self._reuse(key, contents, stored)
+            if prefix:
+                return prefix
+        tokens = estimate_tokens(system_instruction or "") + estimate_history_tokens(contents)
+        if tokens < MIN_TOKENS or self._failed.get(key, 0) > time.monotonic():
+            return None
+        try:
+            cached = await asyncio.to_thread(
+                self.client().caching.CachedContent.create,
+                model=model,
+                display_name=f"lesson-{lesson_id}"[:128],
+                system_instruction=system_instruction,
+                contents=contents,
+                ttl=TTL_SECONDS,
+            )
+        except Exception as e:
+            self._failed[key] = time.monotonic() + RETRY_SECONDS
+            _count("fallbacks")
+            print(f"Warning: Could not cache context for {lesson_id} on {model} ({type(e).__name__}: {e}); "
+                  f"sending full prompts")
+            return None
+        prefix = CachedPrefix(cached.name, model, len(contents), contents_digest(contents), list(contents),
+                              time.time() + TTL_SECONDS, cached)
+        _count("refreshed" if key in self.entries else "created")
+        self.entries[key] = prefix
+        await self._record(lesson_id, model, prefix, stored)
+        return prefix
+
+    async def cover(self, lesson_id: str, model: str, contents: list, stored: dict = None):
+        """Existing CachedPrefix over the start of `contents` (never creates one), or None."""
+        if not ENABLED:
+            return None
+        return await self._reuse((lesson_id, model), contents, stored)
+
+    def needs_refresh(self, tail) -> bool:
+        """Whether a session's uncached history has grown enough to cache it too."""
+        return ENABLED and estimate_history_tokens(tail) >= REFRESH_TOKENS
+
+    def expiring(self, prefix: CachedPrefix) -> bool:
+        return prefix.expires - time.time() <= EXPIRY_MARGIN_SECONDS
+
+    def metas(self, lesson_id: str) -> dict:
+        """model -> recorded form of this container's caches for a lesson (for session state)."""
+        return {model: prefix.meta() for (lesson, model), prefix in self.entries.items() if lesson == lesson_id}
+
+    def forget(self, lesson_id: str):
+        """Drop this container's entries for a lesson (e.g. after a request on its cache failed)."""
+        for key in [k for k in self.entries if k[0] == lesson_id]:
+            del self.entries[key]
+
+    def spawn(self, coro):
+        """Run a refresh in the background; the turn that triggered it has already been answered."""
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def keep_alive(self, prefix: CachedPrefix):
+        """Renew the TTL of a prefix in use once less than half of it is left."""
+        if prefix.expires - time.time() >= TTL_SECONDS / 2:
+            return
+        try:
+            await asyncio.to_thread(prefix.cached.update, ttl=TTL_SECONDS)
+            prefix.expires = time.time() + TTL_SECONDS
+            _count("extended")
+        except Exception as e:
+            print(f"Warning: Could not extend context cache {prefix.name}: {e}")
+
+    async def _reuse(self, key, contents: list, stored: dict = None):
+        prefix = self.entries.get(key)
+        if prefix and prefix.usable(contents):
+            _count("hits")
+            await self.keep_alive(prefix)
+            return prefix
+        meta = (stored or {}).get(key[1])
+        if not meta or (prefix and prefix.name == meta.get('name')):
+            return None
+        shared = CachedPrefix(meta['name'], key[1], int(meta['turns']), meta['digest'],
+                              list(contents[:int(meta['turns'])]), int(meta['expiresAt']))
+        if not shared.usable(contents):
+            return None
+        try:
+            # Created by another container: bind to it (fails if it expired or was deleted)
+            shared.cached = await asyncio.to_thread(self.client().caching.CachedContent.get, shared.name)
+        except Exception as e:
+            print(f"Warning: Shared context cache {shared.name} unavailable ({type(e).__name__}: {e})")
+            return None
+        _count("shared_hits")
+        self.entries[key] = shared
+        await self.keep_alive(shared)
+        return shared
+
+    async def _record(self, lesson_id: str, model: str, prefix: CachedPrefix, stored: dict = None):
+        """Publish the cache on the lesson so other containers rebuilding the session reuse it."""
+        if self.store is None:
+            return
+        caches = {m: c for m, c in (stored or {}).items() if int(c.get('expiresAt', 0)) > time.time()}
+        caches[model] = prefix.meta()
+        try:
+            await self.store.update(
+                lesson_id,
+                UpdateExpression="SET contextCache = :c",
+                ExpressionAttributeValues={':c': caches},
+            )
+        except Exception as e:
+            print(f"Warning: Could not record context cache for {lesson_id}: {e}")
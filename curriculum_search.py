@@ -0,0 +1,253 @@
+"""
+Full-text search over the ATP curriculum (one document per term/week topic).
+
+The index is built from the same transform as the DynamoDB seed
+(seed_curriculum.transform_extracted_data) and written next to the data as
+curriculum_index.json, which ships in the profile Lambda zip. It is loaded
+once per container, on the first search.
+
+Index layout (compact JSON):
+    version     sha256 prefix of extracted_atp_data.json (= CURRICULUM_SEED_VERSION)
+    curricula   curriculumIds; docs refer to them by position
+    texts       unique subtopic strings; docs refer to them by position
+    docs        [topicId, curriculum idx, term, week, mainTopic, [text idx], [formulas]]
+    postings    token -> "gap:weight gap:weight ..." (doc positions delta-encoded)
+
+Weights are whole BM25 scores per (token, doc), precomputed at build time
+(scaled by 100), so a query is a sum over the query tokens' posting lists.
+Fields are weighted before scoring: mainTopic x3, formulas x2, subtopics x1.
+Posting strings are decoded on first use, which keeps the container's
+one-off load to a single fast json.load.
+
+Config (environment):
+    CURRICULUM_INDEX_FILE  path of the index (default: next to this module)
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import hashlib
+import unicodedata
+from collections import Counter, defaultdict
+from instrumentation import span
+
+CURRICULUM_INDEX_FILE = os.environ.get(
+    "CURRICULUM_INDEX_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "curriculum_index.json")
+)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+FIELD_WEIGHTS = {"mainTopic": 3, "formulas": 2, "subtopics": 1}
+WEIGHT_SCALE = 100
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in into is it its of on or the this "
+    "to what when where which who why with".split()
+)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+_index = None
+_decoded = {}
+
+
+def tokenize(text: str) -> list:
+    """Lowercase ASCII-folded word tokens, stopwords removed, plurals reduced ("Newton's laws" -> newton, law)."""
+    folded = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    tokens = []
+    for tok in _TOKEN.findall(folded):
+        if tok in STOPWORDS or (len(tok) < 2 and not tok.isdigit()):
+            continue
+        if len(tok) > 4 and tok.endswith("ies"):
+            tok = tok[:-3] + "y"
+        elif len(tok) > 3 and tok.endswith("s") and not tok.endswith(("ss", "us", "is")):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+def data_version(data_file: str) -> str:
+    """Same value Terraform sets as CURRICULUM_SEED_VERSION."""
+    with open(data_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+# --- Build (seed time) ---
+
+def build_index(data: dict, version: str = "") -> dict:
+    """Index from transform_extracted_data() output."""
+    subtopics = defaultdict(list)
+    for st in sorted(data["subtopics"], key=lambda s: (s["topicId"], s["orderIndex"])):
+        subtopics[st["topicId"]].append(st["content"])
+
+    curricula, curriculum_pos = [], {}
+    texts, text_pos = [], {}
+    docs, doc_terms = [], []
+    for topic in data["topics"]:
+        cid = topic["curriculumId"]
+        if cid not in curriculum_pos:
+            curriculum_pos[cid] = len(curricula)
+            curricula.append(cid)
+        text_ids = []
+        for content in subtopics.get(topic["topicId"], []):
+            if content not in text_pos:
+                text_pos[content] = len(texts)
+                texts.append(content)
+            text_ids.append(text_pos[content])
+        formulas = list(topic.get("formulas") or [])
+        docs.append([topic["topicId"], curriculum_pos[cid], int(topic["term"]), int(topic["week"]),
+                     topic.get("mainTopic", ""), text_ids, formulas])
+
+        tf = Counter()
+        for tok in tokenize(topic.get("mainTopic", "")):
+            tf[tok] += FIELD_WEIGHTS["mainTopic"]
+        for formula in formulas:
+            for tok in tokenize(formula):
+                tf[tok] += FIELD_WEIGHTS["formulas"]
+        for i in text_ids:
+            for tok in tokenize(texts[i]):
+                tf[tok] += FIELD_WEIGHTS["subtopics"]
+        doc_terms.append(tf)
+
+    n = len(docs)
+    lengths = [sum(tf.values()) for tf in doc_terms]
+    avgdl = (sum(lengths) / n) if n else 1.0
+    df = Counter(tok for tf in doc_terms for tok in tf)
+    postings = defaultdict(list)
+    for d, tf in enumerate(doc_terms):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[d] / avgdl)
+        for tok, f in tf.items():
+            idf = math.log(1 + (n - df[tok] + 0.5) / (df[tok] + 0.5))
+            weight = round(idf * f * (BM25_K1 + 1) / (f + norm) * WEIGHT_SCALE)
+            postings[tok].append((d, max(1, weight)))
+
+    return {"version": version, "curricula": curricula, "texts": texts, "docs": docs,
+            "postings": {tok: encode_postings(plist) for tok, plist in sorted(postings.items())}}
+
+
+def encode_postings(plist: list) -> str:
+    out, prev = [], 0
+    for d, weight in plist:
+        out.append(f"{d - prev}:{weight}")
+        prev = d
+    return " ".join(out)
+
+
+def decode_postings(encoded: str) -> list:
+    """[(doc, weight), ...] from encode_postings output."""
+    plist, doc = [], 0
+    for pair in encoded.split(" "):
+        gap, _, weight = pair.partition(":")
+        doc += int(gap)
+        plist.append((doc, int(weight)))
+    return plist
+
+
+def write_index(data: dict, path: str = None, version: str = "") -> dict:
+    """Build and save the index; returns {'docs', 'tokens', 'bytes'}."""
+    index = build_index(data, version)
+    path = path or CURRICULUM_INDEX_FILE
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    return {"docs": len(index["docs"]), "tokens": len(index["postings"]), "bytes": os.path.getsize(path)}
+
+
+# --- Query (per container) ---
+
+def load():
+    """The index, read once per container; None if the file is missing."""
+    global _index
+    if _index is None:
+        _decoded.clear()
+        if not os.path.exists(CURRICULUM_INDEX_FILE):
+            print(f"Warning: Curriculum search index not found at {CURRICULUM_INDEX_FILE}")
+            return None
+        with span("search.load_index"):
+            with open(CURRICULUM_INDEX_FILE, "r", encoding="utf-8") as f:
+                _index = json.load(f)
+        seed_version = os.environ.get("CURRICULUM_SEED_VERSION", "")
+        if seed_version and _index.get("version") != seed_version:
+            print(f"Warning: Curriculum index version {_index.get('version')} != seed {seed_version}; rebuild it with seed_curriculum.py")
+    return _index
+
+
+def curriculum_filter(index: dict, grade: str = None, subject: str = None, curriculum_id: str = None):
+    """Set of allowed curriculum positions, or None for no filter."""
+    if not (grade or subject or curriculum_id):
+        return None
+    allowed = set()
+    for pos, cid in enumerate(index["curricula"]):
+        _, c_grade, c_subject = (cid.split("#", 2) + ["", ""])[:3]
+        if curriculum_id and cid != curriculum_id:
+            continue
+        if grade and c_grade.lower() != grade.lower():
+            continue
+        if subject and c_subject.lower() != subject.lower():
+            continue
+        allowed.add(pos)
+    return allowed
+
+
+def postings(index: dict, token: str) -> list:
+    """Decoded posting list for a token (cached per container)."""
+    plist = _decoded.get(token)
+    if plist is None:
+        encoded = index["postings"].get(token)
+        plist = decode_postings(encoded) if encoded else []
+        _decoded[token] = plist
+    return plist
+
+
+def score(index: dict, tokens: list, allowed=None) -> dict:
+    """doc position -> BM25 score (scaled) for docs matching any token."""
+    docs = index["docs"]
+    scores = defaultdict(int)
+    for tok in set(tokens):
+        plist = postings(index, tok)
+        for d, weight in plist:
+            scores[d] += weight
+    if allowed is not None:
+        return {d: s for d, s in scores.items() if docs[d][1] in allowed}
+    return scores
+
+
+def matching_texts(index: dict, doc: list, tokens: list, limit: int = 2) -> list:
+    """The doc's subtopics that share the most tokens with the query (why it matched)."""
+    wanted = set(tokens)
+    ranked = []
+    for order, i in enumerate(doc[5]):
+        overlap = len(wanted.intersection(tokenize(index["texts"][i])))
+        if overlap:
+            ranked.append((-overlap, order, index["texts"][i]))
+    return [text for _, _, text in sorted(ranked)[:limit]]
+
+
+def search(query: str, grade: str = None, subject: str = None, curriculum_id: str = None, limit: int = 10):
+    """
+    Top topics for `query`, best first (ties: earliest term/week).
+
+    Returns:
+        list of dicts (topicId, curriculumId, grade, subjectName, term, week,
+        mainTopic, formulas, matches, score), or None if there is no index
+    """
+    index = load()
+    if index is None:
+        return None
+    tokens = tokenize(query)
+    scores = score(index, tokens, curriculum_filter(index, grade, subject, curriculum_id))
+    top = heapq.nsmallest(limit, scores.items(), key=lambda kv: (-kv[1], kv[0]))
+
+    results = []
+    for d, s in top:
+        doc = index["docs"][d]
+        cid = index["curricula"][doc[1]]
+        _, c_grade, c_subject = (cid.split("#", 2) + ["", ""])[:3]
+        results.append({
+            "topicId": doc[0], "curriculumId": cid, "grade": c_grade, "subjectName": c_subject,
+            "term": doc[2], "week": doc[3], "mainTopic": doc[4], "formulas": doc[6],
+            "matches": matching_texts(index, doc, tokens),
+            "score": round(s / WEIGHT_SCALE, 2),
+        })
+    return results
@@ -164,3 +164,98 @@ resource "aws_dynamodb_table" "subtopics" {
     Environment = "production"
   }
 }
+
+# =============================================================================
+# RATE LIMITING (shared per-learner and per-IP request counters, see admission.py)
+# =============================================================================
+
+resource "aws_dynamodb_table" "rate_limits" {
+  name           = "RateLimits"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "bucketKey"
+
+  attribute {
+    name = "bucketKey"
+    type = "S"
+  }
+
+  # One item per learner (IP + lesson) or source IP per minute; expired windows are cleaned up by TTL
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Environment = "production"
+  }
+}
+
+# =============================================================================
+# STREAM REPLAY (resumable /chat-stream turns across containers, see stream_replay.py)
+# =============================================================================
+
+resource "aws_dynamodb_table" "stream_replay" {
+  name           = "StreamReplay"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "streamKey"
+
+  attribute {
+    name = "streamKey"
+    type = "S"
+  }
+
+  # A head item per chat turn plus one item per checkpointed chunk of frames;
+  # replayable for a few minutes, then removed by TTL
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Environment = "production"
+  }
+}
+
+# =============================================================================
+# LESSON OPENERS (first AI message per ATP topic/subtopic, see pregenerate_openers.py)
+# =============================================================================
+
+resource "aws_dynamodb_table" "lesson_openers" {
+  name           = "LessonOpeners"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "openerKey"
+
+  attribute {
+    name = "openerKey"
+    type = "S"
+  }
+
+  tags = {
+    Environment = "production"
+  }
+}
+
+# =============================================================================
+# SESSION STATE (compact chat sessions shared across Gemini containers, see session_state.py)
+# =============================================================================
+
+resource "aws_dynamodb_table" "session_state" {
+  name           = "SessionState"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "sessionKey"
+
+  attribute {
+    name = "sessionKey"
+    type = "S"
+  }
+
+  # One item per lesson with an active chat; idle sessions are removed by TTL
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Environment = "production"
+  }
+}
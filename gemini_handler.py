@@ -1,28 +1,88 @@
 import os
+import sys
 import json
+import time
 import asyncio
+import importlib.util
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-import google.generativeai as genai
-from mangum import Mangum
-import boto3
+import aws_clients
+from lesson_prompt import resolve_system_instruction
+from lesson_openers import OPENER_REQUEST
+from instrumentation import MetricsMiddleware, instrument_dynamodb, span, add_metric, record_usage
+from admission import (AdmissionMiddleware, RateLimiter, ConcurrencyGate, RATE_LIMIT_TABLE,
+                       CLIENT_RATE_PER_MINUTE, CLIENT_RATE_BURST, stats as admission_stats)
+import gemini_policy
+import model_routing
+from context_cache import ContextCache, stats as context_cache_stats
+from session_state import SessionStore, SessionState, SESSION_STATE_TABLE, stats as session_state_stats
+import atp_retrieval
+from stream_replay import ReplayBuffer, REPLAY_TABLE, stats as replay_stats
+from chat_turns import WriteBehind, new_turn_id
+from json_stream import ItemStream
+from lesson_store import LessonStore, stats as lesson_store_stats
+from single_flight import SingleFlight, LessonLease, LessonNotFound, generation_key, generate_once
+from image_ingest import (
+    decode_data_url, prepare_image, prepare_images, is_binary_upload,
+    read_stream_bounded, read_upload_file, UploadTooLarge
+)
+
+def lazy_import(name):
+    """Return a module whose body only executes on first attribute access (keeps cold start lean)."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# Heavy SDK: google.generativeai pulls in grpc/protobuf/googleapiclient
+# (boto3/botocore are imported by aws_clients on the first AWS call)
+genai = lazy_import("google.generativeai")
 
 # --- Lazy Configuration ---
 GEMINI_CONFIGURED = False
+# Longest the Lambda handler waits for queued chat-turn writes before returning
+TURN_DRAIN_SECONDS = float(os.environ.get("TURN_DRAIN_SECONDS", "2"))
+GRADE_MAX_PAGES = int(os.environ.get("GRADE_MAX_PAGES", "8"))
+
+# AWS Services (resource is created on the first table call, not at import)
+_dynamodb = None
 
-# AWS Services
-dynamodb = boto3.resource('dynamodb')
-lesson_table = dynamodb.Table('Lessons')
-topics_table = dynamodb.Table('Topics')
+class LazyTable:
+    """DynamoDB Table stand-in that binds to the real Table on first use."""
+    def __init__(self, name):
+        self.name = name
+        self._table = None
+
+    def __getattr__(self, attr):
+        global _dynamodb
+        if self._table is None:
+            if _dynamodb is None:
+                _dynamodb = instrument_dynamodb(aws_clients.resource('dynamodb'))
+            self._table = _dynamodb.Table(self.name)
+        return getattr(self._table, attr)
+
+lesson_table = LazyTable('Lessons')
+topics_table = LazyTable('Topics')
+# Awaitable Lessons access for the async routes (boto3 calls run on the DynamoDB executor)
+lessons = LessonStore(lesson_table)
 
 def ensure_config():
     global GEMINI_CONFIGURED
     if not GEMINI_CONFIGURED:
         param_name = os.environ.get("SSM_PARAMETER_NAME", "/smart-ai-tutor/gemini-api-key")
         try:
-            ssm = boto3.client('ssm')
-            response = ssm.get_parameter(Name=param_name, WithDecryption=True)
+            ssm = aws_clients.client('ssm')
+            with span("ssm.get_parameter"):
+                response = ssm.get_parameter(Name=param_name, WithDecryption=True)
             key = response['Parameter']['Value']
             genai.configure(api_key=key)
             GEMINI_CONFIGURED = True
@@ -34,6 +94,15 @@ def ensure_config():
 print("INFO: Gemini Handler Loading...")
 app = FastAPI()
 
+# Rate limiting + concurrency cap on the Gemini routes (innermost, so 429s still get CORS headers)
+app.add_middleware(
+    AdmissionMiddleware,
+    limiter=RateLimiter(table=LazyTable(RATE_LIMIT_TABLE) if RATE_LIMIT_TABLE else None),
+    client_limiter=RateLimiter(CLIENT_RATE_PER_MINUTE, CLIENT_RATE_BURST,
+                               table=LazyTable(RATE_LIMIT_TABLE) if RATE_LIMIT_TABLE else None),
+    gate=ConcurrencyGate(),
+)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -42,101 +111,315 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-request spans/metrics (outermost, so CORS preflights are timed too)
+app.add_middleware(MetricsMiddleware, service="gemini")
 
 @app.get("/")
 async def root():
-    return {"status": "ok", "message": "Gemini Streaming API is live"}
+    return {"status": "ok", "message": "Gemini Streaming API is live",
+            "admission": admission_stats, "gemini": gemini_policy.stats,
+            "turns": {**turn_writer.stats, "pending": turn_writer.pending()},
+            "dynamodb": lesson_store_stats, "atp": atp_retrieval.stats, "replay": replay_stats,
+            "chat": chat_stats, "routing": model_routing.stats, "context_cache": context_cache_stats,
+            "session_state": session_state_stats}
+
+@app.get("/models")
+async def list_models():
+    """Models available to the configured key (diagnostics; kept out of the request error paths)"""
+    ensure_config()
+    try:
+        models = await asyncio.to_thread(
+            lambda: [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+        )
+        return {"models": models}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
 # --- Memory-Efficient Session Handling ---
 sessions = {}
+# Models keyed by (model name, prompt hash): lessons on the same subtopic share one instance
+models = {}
+# (model name, prompt hash, system instruction, cached prefix) per session, to move it to the other tier
+session_specs = {}
+# Gemini cached content per lesson transcript (names recorded in Lessons.contextCache)
+context_cache = ContextCache(lambda: genai, lessons)
+
+# Chat turns are written after the stream finishes; positions[lesson_id] is the
+# history length this container expects, so turns land in order
+turn_writer = WriteBehind(lessons)
+positions = {}
+# topicId per lesson, for per-message ATP retrieval from its curriculum
+lesson_topics = {}
+# Stored transcript per lesson (as in Lessons.history), saved with each turn as shared session state
+transcripts = {}
+session_store = SessionStore(table=LazyTable(SESSION_STATE_TABLE) if SESSION_STATE_TABLE else None,
+                             on_conflict=lambda lesson_id: discard_session(lesson_id))
 
-def get_chat_session(session_id: str, history=None, system_instruction=None):
+# In-progress/recent chat streams by turn id, so a reconnect with Last-Event-ID resumes instead of regenerating
+replay = ReplayBuffer(table=LazyTable(REPLAY_TABLE) if REPLAY_TABLE else None)
+
+# Completed vs aborted (client gone) chat answers; saved tokens are estimated from the average full answer
+chat_stats = {"completed": 0, "output_tokens": 0, "aborted": 0, "partial_tokens": 0, "tokens_saved_est": 0}
+
+# Coalescing of duplicate quiz/test generations (in-process + DynamoDB lease)
+generations = SingleFlight()
+quiz_lease = LessonLease(lessons, 'generatedQuiz')
+test_lease = LessonLease(lessons, 'generatedTest')
+
+# Lessons attributes needed to rebuild a chat session
+SESSION_FIELDS = ['history', 'systemInstruction', 'promptVersion', 'promptHash',
+                  'subjectName', 'grade', 'topicName', 'topicContext', 'topicId', 'contextCache']
+
+def chat_history(raw_history: list) -> list:
+    """Gemini chat contents for a stored transcript."""
+    contents = []
+    if raw_history and raw_history[0]['role'] != 'user':
+        # Lessons seeded with a pre-generated opener: replay the request it answers
+        contents.append({'role': 'user', 'parts': [OPENER_REQUEST]})
+    for h in raw_history:
+        role = 'user' if h['role'] == 'user' else 'model'
+        contents.append({'role': role, 'parts': [h['content']]})
+    return contents
+
+async def get_chat_session(session_id: str, history=None, system_instruction=None, context_hash=None,
+                           model_name=None, stored_caches=None):
     ensure_config()
+    model_name = model_name or model_routing.MODEL_TIERS["full"]
+    if session_id in sessions:
+        spec_model, spec_hash, spec_instruction, prefix = session_specs[session_id]
+        if (spec_model != model_name or context_cache.entries.get((session_id, model_name), prefix) is not prefix
+                or (prefix and context_cache.expiring(prefix))):
+            # Moved up to full, a longer cache is ready, or the cache is about to expire:
+            # rebuild with the whole conversation
+            context_hash, system_instruction = spec_hash, spec_instruction
+            history = (prefix.contents if prefix else []) + list(sessions.pop(session_id).history)
+        elif prefix:
+            await context_cache.keep_alive(prefix)
     if session_id not in sessions:
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            system_instruction=system_instruction
-        )
-        formatted_history = history or []
-        sessions[session_id] = model.start_chat(history=formatted_history)
+        history = history or []
+        # Long transcripts start from the lesson's cached prefix and only send the rest
+        prefix = await context_cache.attach(session_id, model_name, system_instruction, history, stored_caches)
+        if prefix:
+            model = genai.GenerativeModel.from_cached_content(prefix.cached)
+            sessions[session_id] = model.start_chat(history=history[prefix.turns:])
+        else:
+            model_key = (model_name, context_hash or session_id)
+            if model_key not in models:
+                models[model_key] = genai.GenerativeModel(
+                    model_name,
+                    system_instruction=system_instruction
+                )
+            sessions[session_id] = models[model_key].start_chat(history=history)
+        session_specs[session_id] = (model_name, context_hash, system_instruction, prefix)
     return sessions[session_id]
 
+async def refresh_context_cache(lesson_id: str, chat):
+    """Cache a session's grown history in the background; its next message switches to the new cache."""
+    spec = session_specs.get(lesson_id)
+    if spec is None or sessions.get(lesson_id) is not chat or not context_cache.needs_refresh(chat.history):
+        return
+    model_name, _, system_instruction, prefix = spec
+    contents = (prefix.contents if prefix else []) + list(chat.history)
+    if await context_cache.attach(lesson_id, model_name, system_instruction, contents, force=True):
+        # Same transcript, new caches: stored under the turn it already ends with
+        save_session_state(lesson_id)
+
+def save_session_state(lesson_id: str, turn_id: str = None):
+    """Share this container's session (transcript, instruction, caches), ending with turn `turn_id`."""
+    spec = session_specs.get(lesson_id)
+    if spec is None or lesson_id not in transcripts:
+        return
+    _, context_hash, system_instruction, _ = spec
+    session_store.save(lesson_id, SessionState(list(transcripts[lesson_id]), system_instruction, context_hash,
+                                               lesson_topics.get(lesson_id), context_cache.metas(lesson_id)),
+                       turn_id)
+
+def discard_session(lesson_id: str):
+    """Drop this container's session; the next message rebuilds it from the shared state or Lessons."""
+    sessions.pop(lesson_id, None)
+    session_specs.pop(lesson_id, None)
+    positions.pop(lesson_id, None)
+    lesson_topics.pop(lesson_id, None)
+    transcripts.pop(lesson_id, None)
+
+def forget_session(lesson_id: str):
+    """Drop a lesson's session everywhere; the next message rebuilds it from Lessons."""
+    discard_session(lesson_id)
+    session_store.drop(lesson_id)
+
+def cached_lesson_prompt(lesson_id: str, item: dict, history: list, build_prompt):
+    """
+    with_cache for routed_generate/stream_assessment: the lesson's existing context cache
+    plus build_prompt(uncached_history, True), so the transcript is not sent again.
+    """
+    async def with_cache(model_name: str):
+        contents = chat_history(history)
+        prefix = await context_cache.cover(lesson_id, model_name, contents, item.get('contextCache'))
+        if prefix is None:
+            return None
+        tail = history[max(prefix.turns - (len(contents) - len(history)), 0):]
+        return genai.GenerativeModel.from_cached_content(prefix.cached), build_prompt(tail, True)
+    return with_cache
+
+async def routed_generate(endpoint: str, contents, attachments: int = 0, with_cache=None):
+    """
+    gemini_policy.generate on the model tier and generation config model_routing picks.
+    with_cache(model_name) may return (cached model, shorter contents) to use instead.
+    """
+    chosen = model_routing.route(endpoint, model_routing.estimate_tokens(contents), attachments)
+    found = await with_cache(chosen.model) if with_cache else None
+    model, contents = found or (genai.GenerativeModel(chosen.model), contents)
+    t_send = time.perf_counter()
+    with span("gemini.generate_content"):
+        response = await gemini_policy.generate(endpoint, model, contents, generation_config=chosen.config)
+    model_routing.observe(chosen, (time.perf_counter() - t_send) * 1000, response)
+    record_usage(response)
+    return response
+
+def send_chat_attempt(chat, base_history: list, attempts: list, message_parts: list, config, timeout: float):
+    """
+    One attempt at opening a chat turn: (session, stream). The first attempt uses
+    the session itself; a retry starts a fresh one on the same model from the
+    history the turn began with, since a timed-out attempt may still be running
+    in its thread and recording its exchange on the session it was given.
+    """
+    session = chat if not attempts else chat.model.start_chat(history=base_history)
+    attempts.append(session)
+    response = session.send_message(message_parts, stream=True, generation_config=config,
+                                    request_options={"timeout": timeout})
+    return session, response
+
+def drop_reference(chat, reference: str):
+    """Take the per-message ATP reference back out of the session history once the turn is done."""
+    history = list(chat.history)
+    if len(history) < 2:
+        return
+    parts = list(getattr(history[-2], 'parts', []))
+    if parts and getattr(parts[0], 'text', None) == reference:
+        history[-2] = {'role': 'user', 'parts': parts[1:]}
+        chat.history = history
+
+async def read_chat_request(request: Request):
+    """Collect message, lesson_id and optional raw image bytes from a JSON or multipart body."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # Image arrives as a binary part: no base64 inflation, no JSON string copies
+        form = await request.form()
+        upload = form.get("image")
+        image_raw = await read_upload_file(upload) if hasattr(upload, "read") else None
+        return form.get("message"), form.get("lesson_id"), image_raw
+    data = await request.json()
+    image_data = data.get("image")
+    return data.get("message"), data.get("lesson_id"), decode_data_url(image_data) if image_data else None
+
 @app.post("/chat-stream")
 async def chat_stream(request: Request):
     try:
-        data = await request.json()
-        user_message = data.get("message")
-        lesson_id = data.get("lesson_id")
+        # Reconnect after a dropped connection: replay the rest of that turn (the body is not needed)
+        last_event_id = request.headers.get("last-event-id")
+        if last_event_id:
+            resumed = await replay.resume(last_event_id)
+            if resumed is not None:
+                return StreamingResponse(resumed, media_type="text/event-stream")
+            if not await request.body():
+                return JSONResponse(status_code=410, content={"error": "Stream is no longer available; send the message again"})
+
+        user_message, lesson_id, image_raw = await read_chat_request(request)
         
         if not user_message or not lesson_id:
             raise HTTPException(status_code=400, detail="message and lesson_id are required")
 
         # Persistence: Solve the 'Amnesia' failure
         db_history = []
-        topic_context = ""
-        topic_name = ""
-        subject_name = ""
-        grade = ""
+        system_instruction = None
+        context_hash = None
+        stored_caches = None
+
+        if lesson_id in sessions and not await session_store.is_current(lesson_id):
+            # Another container has answered since: this session's history is behind the shared one
+            discard_session(lesson_id)
         
         if lesson_id not in sessions:
-            res = lesson_table.get_item(Key={'lessonId': lesson_id})
-            item = res.get('Item', {})
-            raw_history = item.get('history', [])
-            topic_context = item.get('topicContext', '')
-            topic_name = item.get('topicName', '')
-            subject_name = item.get('subjectName', '')
-            grade = item.get('grade', '')
-            
-            for h in raw_history:
-                role = 'user' if h['role'] == 'user' else 'model'
-                db_history.append({'role': role, 'parts': [h['content']]})
-        
-        # Build ATP-aware system instruction
-        system_instruction = f"""You are a South African CAPS-aligned AI tutor teaching {subject_name} to Grade {grade} learners.
-
-CURRENT TOPIC: {topic_name}
+            # Our own queued turns must land before the transcript is re-read
+            await turn_writer.flush(lesson_id)
+            # One small read of the state another container shared, else rebuild from Lessons
+            state = await session_store.load(lesson_id)
+            if state is None:
+                # Only the transcript and the instruction rendered at /lessons/start (legacy fields as fallback)
+                item = await lessons.get(lesson_id, SESSION_FIELDS)
+                system_instruction, context_hash = resolve_system_instruction(item)
+                state = SessionState(item.get('history', []), system_instruction, context_hash,
+                                     item.get('topicId'), item.get('contextCache'))
+            raw_history = state.history
+            system_instruction, context_hash = state.system_instruction, state.context_hash
+            positions[lesson_id] = len(raw_history)
+            transcripts[lesson_id] = list(raw_history)
+            lesson_topics[lesson_id] = state.topic_id
+            stored_caches = state.context_caches
+            db_history = chat_history(raw_history)
 
-TEACHING CONTEXT:
-{topic_context}
+        # Relevant ATP subtopics/formulas from the lesson's curriculum, for this message only
+        topic_id = lesson_topics.get(lesson_id)
+        reference = ""
+        if topic_id:
+            # Off the loop: the first call in a container loads the index
+            reference = await asyncio.to_thread(
+                atp_retrieval.context_for, user_message, atp_retrieval.curriculum_of(topic_id), topic_id
+            )
 
-TEACHING APPROACH:
-1. Be warm, encouraging, and patient with learners
-2. Use examples relevant to South African context when possible
-3. Introduce key definitions naturally as concepts come up
-4. Break down complex concepts into digestible parts
-5. Ask follow-up questions to check understanding
-6. Suggest related topics when appropriate for enrichment
-7. Use proper formatting: **bold** for emphasis, bullet points for lists
-8. For math/science, use LaTeX notation ($inline$ or $$block$$)
+        message_parts = [reference, user_message] if reference else [user_message]
+        if image_raw:
+            # Sniff, downsize and re-encode before it reaches the model (off the loop: Pillow blocks)
+            message_parts.append(await asyncio.to_thread(prepare_image, image_raw))
 
-Remember: Your goal is to help the learner truly understand, not just memorize."""
+        # Tier for this message: short clarifications go fast, images and long lessons full;
+        # a session on full stays there (a fast one moves up at most once)
+        known_history = sessions[lesson_id].history if lesson_id in sessions else db_history
+        spec = session_specs.get(lesson_id) if lesson_id in sessions else None
+        chosen = model_routing.route(
+            "chat-stream",
+            model_routing.estimate_history_tokens(known_history) + model_routing.estimate_tokens(message_parts),
+            attachments=1 if image_raw else 0,
+            message_tokens=model_routing.estimate_tokens(user_message),
+            session_tier=model_routing.tier_of(spec[0]) if spec else None,
+        )
+        chat = await get_chat_session(lesson_id, history=db_history, system_instruction=system_instruction,
+                                      context_hash=context_hash, model_name=chosen.model, stored_caches=stored_caches)
 
-        chat = get_chat_session(lesson_id, history=db_history, system_instruction=system_instruction)
-        
-        message_parts = [user_message]
-        image_data = data.get("image")
-        if image_data:
-            import base64
-            if "," in image_data:
-                image_data = image_data.split(",")[1]
-            
-            message_parts.append({
-                "mime_type": "image/jpeg",
-                "data": base64.b64decode(image_data)
-            })
+        # Idempotency key + slot for this turn; the client echoes them to /lessons/chat
+        turn_id = new_turn_id()
+        position = positions.get(lesson_id)
+        base_history = list(chat.history)
 
         async def generate():
             full_ai_response = ""  # Accumulate full response for DB storage
             try:
                 # 1. Connection established probe
+                yield f"data: {json.dumps({'turn': {'id': turn_id, 'position': position}})}\n\n"
                 yield f"data: {json.dumps({'text': 'Reflecting...'})}\n\n"
                 await asyncio.sleep(0.1)
 
-                # Gemini 1.5 Flash supports streaming
-                response = chat.send_message(message_parts, stream=True)
-                for chunk in response:
+                # Gemini 1.5 Flash supports streaming; opening is retried until the first chunk,
+                # chunks are read off the event loop with a stall timeout
+                t_send = time.perf_counter()
+                first_token = None
+                attempts = []
+                turn_chat, response = await gemini_policy.call(
+                    "chat-stream",
+                    lambda timeout: send_chat_attempt(chat, base_history, attempts, message_parts, chosen.config, timeout),
+                    hedge_after=0,
+                    attempt_timeout=gemini_policy.FIRST_CHUNK_SECONDS,
+                    on_abandoned=lambda attempt: gemini_policy.cancel_stream(attempt[1]),
+                )
+                if turn_chat is not chat and sessions.get(lesson_id) is chat:
+                    # A retry answered: its session (same history + this turn) replaces the one it was built from
+                    sessions[lesson_id] = turn_chat
+                async for chunk in gemini_policy.iterate("chat-stream", response):
                     try:
                         if chunk.text:
+                            if first_token is None:
+                                first_token = time.perf_counter()
+                                add_metric("gemini_ttft_ms", (first_token - t_send) * 1000)
                             full_ai_response += chunk.text  # Accumulate
                             yield f"data: {json.dumps({'text': chunk.text})}\n\n"
                             await asyncio.sleep(0.01) # Small buffer
@@ -145,48 +428,181 @@ Remember: Your goal is to help the learner truly understand, not just memorize."
                         msg = " [Content Blocked by Safety Filters] "
                         full_ai_response += msg
                         yield f"data: {json.dumps({'text': msg})}\n\n"
+                add_metric("gemini_stream_ms", (time.perf_counter() - t_send) * 1000)
+                # The chat SLO is time to first token
+                model_routing.observe(chosen, ((first_token or time.perf_counter()) - t_send) * 1000, response)
+                record_usage(response)
+                usage = getattr(response, "usage_metadata", None)
+                chat_stats["completed"] += 1
+                chat_stats["output_tokens"] += getattr(usage, "candidates_token_count", None) or len(full_ai_response) // 4
+                if reference:
+                    # Later turns retrieve their own; don't carry this one in every prompt
+                    drop_reference(turn_chat, reference)
                 
-                # Sync back to DynamoDB with FULL AI response
-                try:
-                    new_msgs = [
-                        {'role': 'user', 'content': user_message + (" [Image Attached]" if image_data else "")},
-                        {'role': 'ai', 'content': full_ai_response}  # Save full response
-                    ]
-                    lesson_table.update_item(
-                        Key={'lessonId': lesson_id},
-                        UpdateExpression="SET history = list_append(if_not_exists(history, :empty), :m)",
-                        ExpressionAttributeValues={':m': new_msgs, ':empty': []}
-                    )
-                except Exception as db_err:
-                     print(f"DB Error: {db_err}")
+                # Write-behind: the turn is committed after [DONE], in order, deduplicated by turn id
+                new_msgs = [
+                    {'role': 'user', 'content': user_message + (" [Image Attached]" if image_raw else "")},
+                    {'role': 'ai', 'content': full_ai_response}  # Save full response
+                ]
+                await turn_writer.submit(lesson_id, turn_id, new_msgs, position)
+                if position is not None:
+                    positions[lesson_id] = position + len(new_msgs)
+                if lesson_id in transcripts:
+                    transcripts[lesson_id].extend(new_msgs)
+                    save_session_state(lesson_id, turn_id)
+                context_cache.spawn(refresh_context_cache(lesson_id, turn_chat))
 
                 yield "data: [DONE]\n\n"
 
+            except asyncio.CancelledError:
+                # Nobody followed the stream for the grace period (stream_replay); Gemini was stopped.
+                # Keep what was said so far, and rebuild the SDK chat from DynamoDB next turn.
+                partial_tokens = len(full_ai_response) // 4
+                if chat_stats["completed"]:
+                    average = chat_stats["output_tokens"] / chat_stats["completed"]
+                    chat_stats["tokens_saved_est"] += max(0, round(average) - partial_tokens)
+                chat_stats["aborted"] += 1
+                chat_stats["partial_tokens"] += partial_tokens
+                forget_session(lesson_id)
+                new_msgs = [
+                    {'role': 'user', 'content': user_message + (" [Image Attached]" if image_raw else "")},
+                    {'role': 'ai', 'content': full_ai_response, 'partial': True}
+                ]
+                await turn_writer.submit(lesson_id, turn_id, new_msgs, position)
+                raise
+
             except Exception as e:
                 print(f"Stream Critical Error: {e}")
                 import traceback
                 trace = traceback.format_exc()
-                
-                # Probe available models
-                model_list_str = "Could not list models."
-                try:
-                    models = []
-                    for m in genai.list_models():
-                        if 'generateContent' in m.supported_generation_methods:
-                            models.append(m.name)
-                    model_list_str = "\\n".join(models)
-                except Exception as list_err:
-                    model_list_str = f"List failed: {list_err}"
-
-                # Yield the actual error to the client for debugging
-                yield f"data: {json.dumps({'text': f' [Error: {str(e)}] \\n\\n--- AVAILABLE MODELS ---\\n{model_list_str}'})}\n\n"
+                # A broken stream leaves the SDK chat unusable; rebuild it from DynamoDB next turn
+                # (without this container's cache entry, in case the cache is what failed)
+                forget_session(lesson_id)
+                context_cache.forget(lesson_id)
+
+                # Yield the actual error to the client for debugging (model list: GET /models)
+                yield f"data: {json.dumps({'text': f' [Error: {str(e)}] '})}\n\n"
                 yield f"data: {json.dumps({'debug': trace})}\n\n"
 
-        return StreamingResponse(generate(), media_type="text/event-stream")
+        # Generation runs to completion even if this connection drops; the response follows the buffer
+        stream = replay.open(turn_id, lesson_id, generate())
+        return StreamingResponse(stream.follow(), media_type="text/event-stream")
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
     except Exception as e:
         print(f"API Error: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+def transcript_source(history: list, cached: bool) -> str:
+    """How a quiz/test prompt refers to the transcript: inline, or cached before it (plus any later messages)."""
+    if not cached:
+        return "the following lesson conversation"
+    return "the lesson conversation above" + (" and its later messages below" if history else "")
+
+def quiz_prompt(history: list, cached: bool = False) -> str:
+    context = "\n".join([f"{h['role']}: {h['content']}" for h in history])
+    return f"""
+            Based on {transcript_source(history, cached)}, generate a 5-question multiple choice quiz.
+            Return ONLY a JSON array of objects with the following structure:
+            {{
+                "id": "q1",
+                "question": "...",
+                "options": ["...", "...", "...", "..."],
+                "correctAnswer": 0
+            }}
+            
+            Context:
+            {context}
+            """
+
+def test_prompt(history: list, subject_name: str, cached: bool = False) -> str:
+    context = "\n".join([f"{h['role']}: {h['content']}" for h in history])
+    source = transcript_source(history, cached).replace("lesson", f"{subject_name} lesson", 1)
+    return f"""
+            Based on {source}, generate a structured test.
+            
+            Create 3 questions that test understanding of the concepts discussed.
+            For Mathematics/Science subjects, include equations using LaTeX format (wrap in $ for inline, $$ for block).
+            
+            Return ONLY a JSON object with this structure:
+            {{
+                "subject": "{subject_name}",
+                "questions": [
+                    {{
+                        "id": "q1",
+                        "question": "Question text with $LaTeX$ if needed",
+                        "type": "open_ended",
+                        "marks": 10,
+                        "expectedAnswer": "The model answer with proper formatting and $equations$ if applicable"
+                    }}
+                ],
+                "totalMarks": 30,
+                "instructions": "Answer all questions. Show your working where applicable."
+            }}
+            
+            Context:
+            {context}
+            """
+
+_FLIGHT_DONE = object()
+
+async def stream_assessment(endpoint: str, lease: LessonLease, lesson_id: str, history: list,
+                            prompt: str, path: tuple, result_key: str, with_cache=None, item: dict = None):
+    """
+    SSE for a quiz/test generation: {"question", "index"} for each question as soon as
+    the model has finished writing it, then {result_key: document} and [DONE].
+
+    Shares the generation key, single-flight and lease with the blocking route, so the
+    result is still stored once, whole, at the end. Callers that join a generation
+    already in flight (or stored on `item`, the Lessons item read for the request) get
+    all questions at once when it completes.
+    """
+    queue = asyncio.Queue()
+
+    async def produce():
+        chosen = model_routing.route(endpoint, model_routing.estimate_tokens(prompt))
+        found = await with_cache(chosen.model) if with_cache else None
+        model, contents = found or (genai.GenerativeModel(chosen.model), prompt)
+        t_send = time.perf_counter()
+        with span("gemini.generate_content"):
+            response = await gemini_policy.generate_stream(endpoint, model, contents, generation_config=chosen.config)
+        parser = ItemStream(path)
+        async for chunk in gemini_policy.iterate(endpoint, response):
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # Safety filter blocked this chunk; result() reports the gap
+            for question in parser.feed(text):
+                queue.put_nowait(question)
+        model_routing.observe(chosen, (time.perf_counter() - t_send) * 1000, response)
+        record_usage(response)
+        return parser.result()
+
+    t0 = time.perf_counter()
+    key = generation_key(endpoint, lesson_id, history)
+    # Runs to completion (and is stored) even if this client goes away
+    flight = asyncio.ensure_future(generate_once(generations, lease, lesson_id, key, produce, item))
+    flight.add_done_callback(lambda _: queue.put_nowait(_FLIGHT_DONE))
+    sent = 0
+    try:
+        while (question := await queue.get()) is not _FLIGHT_DONE:
+            if not sent:
+                add_metric("first_question_ms", (time.perf_counter() - t0) * 1000)
+            yield f"data: {json.dumps({'question': question, 'index': sent})}\n\n"
+            sent += 1
+        # A stored result (from another caller's generation) carries DynamoDB Decimals
+        result = jsonable_encoder(flight.result())
+        questions = result.get(path[0], []) if path else result
+        for question in questions[sent:]:
+            yield f"data: {json.dumps({'question': question, 'index': sent})}\n\n"
+            sent += 1
+        add_metric("generation_ms", (time.perf_counter() - t0) * 1000)
+        yield f"data: {json.dumps({result_key: result})}\n\n"
+        yield "data: [DONE]\n\n"
+    except Exception as e:
+        print(f"ERROR: {endpoint} stream failed: {e}")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
 @app.post("/generate-quiz")
 async def generate_quiz(request: Request):
     ensure_config()
@@ -194,36 +610,53 @@ async def generate_quiz(request: Request):
         data = await request.json()
         lesson_id = data.get("lesson_id")
         
-        res = lesson_table.get_item(Key={'lessonId': lesson_id})
-        item = res.get('Item', {})
+        item = await lessons.get(lesson_id)
+        if not item:
+            raise LessonNotFound(lesson_id)
         history = item.get('history', [])
         
-        context = "\n".join([f"{h['role']}: {h['content']}" for h in history])
-        
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        prompt = f"""
-        Based on the following lesson conversation, generate a 5-question multiple choice quiz.
-        Return ONLY a JSON array of objects with the following structure:
-        {{
-            "id": "q1",
-            "question": "...",
-            "options": ["...", "...", "...", "..."],
-            "correctAnswer": 0
-        }}
-        
-        Context:
-        {context}
-        """
-        
-        response = model.generate_content(prompt)
-        json_text = response.text.strip()
-        if json_text.startswith("```json"):
-            json_text = json_text[7:-3].strip()
-        elif json_text.startswith("```"):
-            json_text = json_text[3:-3].strip()
+        async def produce():
+            prompt = quiz_prompt(history)
             
-        quiz = json.loads(json_text)
+            # Off the event loop so duplicates arriving meanwhile can join this flight
+            response = await routed_generate(
+                "generate-quiz", prompt, with_cache=cached_lesson_prompt(lesson_id, item, history, quiz_prompt)
+            )
+            json_text = response.text.strip()
+            if json_text.startswith("```json"):
+                json_text = json_text[7:-3].strip()
+            elif json_text.startswith("```"):
+                json_text = json_text[3:-3].strip()
+                
+            return json.loads(json_text)
+        
+        # Double-clicks and retries for the same transcript share one generation
+        key = generation_key("generate-quiz", lesson_id, history)
+        quiz = await generate_once(generations, quiz_lease, lesson_id, key, produce, item)
         return {"quiz": quiz}
+    except LessonNotFound:
+        return JSONResponse(status_code=404, content={"error": "Lesson not found"})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.post("/generate-quiz-stream")
+async def generate_quiz_stream(request: Request):
+    """/generate-quiz as SSE: each question as soon as it is written, then the whole quiz."""
+    ensure_config()
+    try:
+        data = await request.json()
+        lesson_id = data.get("lesson_id")
+        
+        item = await lessons.get(lesson_id)
+        if not item:
+            raise LessonNotFound(lesson_id)
+        history = item.get('history', [])
+        events = stream_assessment("generate-quiz", quiz_lease, lesson_id, history,
+                                   quiz_prompt(history), (), "quiz",
+                                   cached_lesson_prompt(lesson_id, item, history, quiz_prompt), item)
+        return StreamingResponse(events, media_type="text/event-stream")
+    except LessonNotFound:
+        return JSONResponse(status_code=404, content={"error": "Lesson not found"})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -236,7 +669,6 @@ async def grade_quiz(request: Request):
         answers = data.get("answers")
         quiz = data.get("quiz")
         
-        model = genai.GenerativeModel('gemini-2.5-flash')
         prompt = f"""
         Grade this quiz attempt.
         Original Quiz: {json.dumps(quiz)}
@@ -250,15 +682,15 @@ async def grade_quiz(request: Request):
         }}
         """
         
-        response = model.generate_content(prompt)
+        response = await routed_generate("grade-quiz", prompt)
         json_text = response.text.strip()
         if json_text.startswith("```json"):
             json_text = json_text[7:-3].strip()
         
         result = json.loads(json_text)
         
-        lesson_table.update_item(
-            Key={'lessonId': lesson_id},
+        await lessons.update(
+            lesson_id,
             UpdateExpression="SET quizScore = :s, quizResult = :r",
             ExpressionAttributeValues={
                 ':s': result['score'],
@@ -278,100 +710,117 @@ async def generate_test(request: Request):
         data = await request.json()
         lesson_id = data.get("lesson_id")
         
-        res = lesson_table.get_item(Key={'lessonId': lesson_id})
-        item = res.get('Item', {})
+        item = await lessons.get(lesson_id)
+        if not item:
+            raise LessonNotFound(lesson_id)
         history = item.get('history', [])
         subject_name = item.get('subjectName', 'General')
         
-        context = "\n".join([f"{h['role']}: {h['content']}" for h in history])
-        
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        prompt = f"""
-        Based on the following {subject_name} lesson conversation, generate a structured test.
-        
-        Create 3 questions that test understanding of the concepts discussed.
-        For Mathematics/Science subjects, include equations using LaTeX format (wrap in $ for inline, $$ for block).
-        
-        Return ONLY a JSON object with this structure:
-        {{
-            "subject": "{subject_name}",
-            "questions": [
-                {{
-                    "id": "q1",
-                    "question": "Question text with $LaTeX$ if needed",
-                    "type": "open_ended",
-                    "marks": 10,
-                    "expectedAnswer": "The model answer with proper formatting and $equations$ if applicable"
-                }}
-            ],
-            "totalMarks": 30,
-            "instructions": "Answer all questions. Show your working where applicable."
-        }}
-        
-        Context:
-        {context}
-        """
-        
-        response = model.generate_content(prompt)
-        
-        # Robust JSON extraction using Regex
-        import re
-        match = re.search(r'\{.*\}', response.text, re.DOTALL)
-        if match:
-            json_text = match.group(0)
-            test = json.loads(json_text)
-        else:
-             raise ValueError(f"No JSON found in response: {response.text}")
-        
-        # Store test in lesson record
-        lesson_table.update_item(
-            Key={'lessonId': lesson_id},
-            UpdateExpression="SET generatedTest = :t",
-            ExpressionAttributeValues={':t': test}
-        )
+        async def produce():
+            prompt = test_prompt(history, subject_name)
+            response = await routed_generate(
+                "generate-test", prompt,
+                with_cache=cached_lesson_prompt(lesson_id, item, history,
+                                                lambda tail, cached: test_prompt(tail, subject_name, cached)),
+            )
+            
+            # Robust JSON extraction using Regex
+            import re
+            match = re.search(r'\{.*\}', response.text, re.DOTALL)
+            if match:
+                json_text = match.group(0)
+                return json.loads(json_text)
+            else:
+                 raise ValueError(f"No JSON found in response: {response.text}")
+        
+        # Double-clicks and retries share one generation; the lease holder stores
+        # the test in the lesson record (generatedTest) for every waiter
+        key = generation_key("generate-test", lesson_id, history)
+        test = await generate_once(generations, test_lease, lesson_id, key, produce, item)
         
         return {"test": test}
+    except LessonNotFound:
+        return JSONResponse(status_code=404, content={"error": "Lesson not found"})
     except Exception as e:
         import traceback
         return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
 
-@app.post("/grade-image")
-async def grade_image(request: Request):
-    """Grade student's uploaded work using Gemini Vision"""
+@app.post("/generate-test-stream")
+async def generate_test_stream(request: Request):
+    """/generate-test as SSE: each question as soon as it is written, then the whole test."""
     ensure_config()
     try:
-        import base64
         data = await request.json()
         lesson_id = data.get("lesson_id")
-        image_data = data.get("image")
         
-        if not image_data:
+        item = await lessons.get(lesson_id)
+        if not item:
+            raise LessonNotFound(lesson_id)
+        history = item.get('history', [])
+        subject_name = item.get('subjectName', 'General')
+        events = stream_assessment("generate-test", test_lease, lesson_id, history,
+                                   test_prompt(history, subject_name), ("questions",), "test",
+                                   cached_lesson_prompt(lesson_id, item, history,
+                                                        lambda tail, cached: test_prompt(tail, subject_name, cached)),
+                                   item)
+        return StreamingResponse(events, media_type="text/event-stream")
+    except LessonNotFound:
+        return JSONResponse(status_code=404, content={"error": "Lesson not found"})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+async def read_grading_pages(request: Request):
+    """Collect lesson_id and raw page bytes from a raw image, multipart/form-data or JSON body."""
+    content_type = request.headers.get("content-type", "")
+    if is_binary_upload(content_type):
+        # Single page posted as the body itself; lesson_id travels in the query string
+        lesson_id = request.query_params.get("lesson_id")
+        raw_pages = [await read_stream_bounded(request.stream())]
+    elif content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        lesson_id = form.get("lesson_id")
+        uploads = form.getlist("pages") or form.getlist("image")
+        raw_pages = [await read_upload_file(f) for f in uploads if hasattr(f, "read")]
+    else:
+        data = await request.json()
+        lesson_id = data.get("lesson_id")
+        # `images` carries several pages; `image` is the original single-page field
+        encoded = data.get("images") or ([data["image"]] if data.get("image") else [])
+        raw_pages = [decode_data_url(page) for page in encoded]
+    return lesson_id, raw_pages
+
+@app.post("/grade-image")
+async def grade_image(request: Request):
+    """Grade student's uploaded work (one or more pages) using Gemini Vision"""
+    ensure_config()
+    try:
+        lesson_id, raw_pages = await read_grading_pages(request)
+        
+        if not raw_pages:
             raise HTTPException(status_code=400, detail="Image is required")
+        if len(raw_pages) > GRADE_MAX_PAGES:
+            raise HTTPException(status_code=400, detail=f"At most {GRADE_MAX_PAGES} pages per submission")
         
         # Get lesson context and test
-        res = lesson_table.get_item(Key={'lessonId': lesson_id})
-        item = res.get('Item', {})
+        item = await lessons.get(lesson_id)
         subject_name = item.get('subjectName', 'General')
         test = item.get('generatedTest', {})
         
-        # Prepare image for Gemini
-        if "," in image_data:
-            image_data = image_data.split(",")[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        # Prepare pages for Gemini concurrently (real MIME type, bounded size, handwriting-friendly)
+        image_parts = await prepare_images(raw_pages)
+        page_count = len(image_parts)
         
         prompt = f"""
-        You are grading a {{subject_name}} test. Analyze this student's handwritten/typed work.
+        You are grading a {subject_name} test. Analyze this student's handwritten/typed work.
+        The work is spread over {page_count} page image(s), supplied in order as Page 1 to Page {page_count}.
         
         The test questions were:
-        {{json.dumps(test.get('questions', []), indent=2)}}
+        {json.dumps(test.get('questions', []), indent=2, default=str)}
         
-        Total marks: {{test.get('totalMarks', 30)}}
+        Total marks: {test.get('totalMarks', 30)}
         
         Please:
-        1. Identify each answer the student provided
+        1. Identify each answer the student provided and the page(s) it appears on
         2. Compare with expected answers
         3. Award marks fairly
         4. Provide constructive feedback
@@ -381,10 +830,12 @@ async def grade_image(request: Request):
             "score": number (0-100 percentage),
             "marksAwarded": number,
             "totalMarks": number,
+            "pageCount": {page_count},
             "feedback": "Overall feedback on performance",
             "questionResults": [
                 {{
                     "questionId": "q1",
+                    "pages": [1],
                     "marksAwarded": number,
                     "marksAvailable": number,
                     "feedback": "Specific feedback for this question"
@@ -394,10 +845,12 @@ async def grade_image(request: Request):
         }}
         """
         
-        response = model.generate_content([
-            prompt,
-            {"mime_type": "image/jpeg", "data": image_bytes}
-        ])
+        # One model call for all pages, each labelled so answers can be attributed
+        contents = [prompt]
+        for page_num, part in enumerate(image_parts, start=1):
+            contents.extend([f"Page {page_num}:", part])
+        
+        response = await routed_generate("grade-image", contents, attachments=page_count)
         
         import re
         match = re.search(r'\{.*\}', response.text, re.DOTALL)
@@ -408,9 +861,8 @@ async def grade_image(request: Request):
              raise ValueError(f"No JSON found in response: {response.text}")
         
         # Save score to lesson
-        lesson_table.update_item(
-        # ... logic continues
-            Key={'lessonId': lesson_id},
+        await lessons.update(
+            lesson_id,
             UpdateExpression="SET assessmentScore = :s, assessmentResult = :r, #st = :st",
             ExpressionAttributeNames={'#st': 'status'},
             ExpressionAttributeValues={
@@ -421,10 +873,28 @@ async def grade_image(request: Request):
         )
         
         return result
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
     except Exception as e:
         import traceback
         return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
 
-# Bridge for AWS Lambda
-handler = Mangum(app, lifespan="off")
+# Bridge for AWS Lambda (Mangum adapter built on the first invocation)
+_mangum = None
+
+def handler(event, context):
+    global _mangum
+    if _mangum is None:
+        from mangum import Mangum
+        _mangum = Mangum(app, lifespan="off")
+    response = _mangum(event, context)
+    # Commit queued chat turns (and session states) before the container can be frozen
+    # (the rest resume next invocation)
+    if turn_writer.pending():
+        asyncio.get_event_loop().run_until_complete(turn_writer.flush(timeout=TURN_DRAIN_SECONDS))
+    if session_store.tasks:
+        asyncio.get_event_loop().run_until_complete(session_store.flush(timeout=TURN_DRAIN_SECONDS))
+    return response
 
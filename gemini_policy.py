@@ -0,0 +1,229 @@
+"""
+Call policy for Gemini requests: per-endpoint deadlines, retries with
+exponential backoff + full jitter on transient errors, and optional hedging
+(a second identical request if the first is slow) for non-streaming calls.
+
+The SDK is blocking, so every attempt runs in a worker thread and also gets
+the remaining time as its HTTP timeout; a stalled call can no longer hold the
+Lambda for its full 300 s.
+
+Config (environment):
+    GEMINI_DEADLINES            JSON overrides, e.g. {"grade-image": 120}
+    GEMINI_FIRST_CHUNK_SECONDS  time allowed for a stream's first chunk (per attempt)
+    GEMINI_STALL_SECONDS        longest gap between stream chunks
+    GEMINI_MAX_RETRIES          retries after the first attempt
+    GEMINI_BACKOFF_BASE         first backoff ceiling in seconds (doubles per retry)
+    GEMINI_BACKOFF_CAP          backoff ceiling in seconds
+    GEMINI_HEDGE_AFTER          seconds before a hedged duplicate is sent (0 = off)
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+from instrumentation import add_metric
+
+# Total time budget per endpoint, retries included (seconds)
+DEADLINES = {
+    "chat-stream": 120,
+    "generate-quiz": 45,
+    "grade-quiz": 30,
+    "generate-test": 60,
+    "grade-image": 90,
+}
+DEADLINES.update(json.loads(os.environ.get("GEMINI_DEADLINES", "{}")))
+DEFAULT_DEADLINE = 60
+
+FIRST_CHUNK_SECONDS = float(os.environ.get("GEMINI_FIRST_CHUNK_SECONDS", "20"))
+STALL_SECONDS = float(os.environ.get("GEMINI_STALL_SECONDS", "30"))
+MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP = float(os.environ.get("GEMINI_BACKOFF_CAP", "4"))
+HEDGE_AFTER = float(os.environ.get("GEMINI_HEDGE_AFTER", "0"))
+
+# google.api_core exception names (matched by name so the SDK stays lazily imported)
+RETRYABLE_ERRORS = {
+    "ServiceUnavailable", "InternalServerError", "TooManyRequests", "ResourceExhausted",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "RetryError",
+    "ConnectionError", "ReadTimeout", "ConnectTimeout", "GeminiTimeout",
+}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Counters since container start (also added to the per-request metrics)
+stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0, "cancelled": 0}
+
+_END = object()
+
+
+class GeminiTimeout(TimeoutError):
+    """A Gemini call (or stream chunk) exceeded its deadline."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if any(cls.__name__ in RETRYABLE_ERRORS for cls in type(exc).__mro__):
+        return True
+    return getattr(exc, "code", None) in RETRYABLE_STATUS
+
+
+def backoff(attempt: int) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _count(name: str):
+    stats[name] += 1
+    add_metric(f"gemini_{name}", 1)
+
+
+def _abandon(task, on_abandoned=None):
+    """
+    Let a losing/timed-out attempt finish in its thread without 'exception never
+    retrieved' noise; if it still succeeds, its result goes to `on_abandoned`.
+    """
+    def done(t):
+        if t.cancelled() or t.exception() is not None:
+            return
+        if on_abandoned:
+            on_abandoned(t.result())
+    task.add_done_callback(done)
+
+
+async def _attempt(fn, timeout: float, hedge_after: float, on_abandoned=None):
+    """One attempt (plus an optional hedge); returns the first successful result."""
+    start = time.monotonic()
+    primary = asyncio.ensure_future(asyncio.to_thread(fn, timeout))
+    pending = {primary}
+    hedged = False
+    error = None
+    while pending:
+        remaining = timeout - (time.monotonic() - start)
+        wait_for = min(remaining, hedge_after - (time.monotonic() - start)) if hedge_after and not hedged else remaining
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=max(wait_for, 0), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                if task is not primary:
+                    _count("hedge_wins")
+                for other in pending:
+                    _abandon(other, on_abandoned)
+                return task.result()
+            error = error or task.exception()
+        if hedge_after and not hedged and pending and time.monotonic() - start >= hedge_after:
+            # Primary is slow; race an identical request against it
+            hedged = True
+            _count("hedges")
+            pending.add(asyncio.ensure_future(asyncio.to_thread(fn, timeout - hedge_after)))
+    if pending:
+        for task in pending:
+            _abandon(task, on_abandoned)
+        _count("timeouts")
+        raise GeminiTimeout(f"Gemini call exceeded {timeout:.1f}s")
+    raise error
+
+
+async def call(endpoint: str, fn, hedge_after: float = None, attempt_timeout: float = None, on_abandoned=None):
+    """
+    Run blocking `fn(timeout)` under the endpoint's policy.
+
+    Args:
+        endpoint: key into DEADLINES
+        fn: callable taking the seconds left for this attempt (pass it on as the SDK timeout)
+        hedge_after: override GEMINI_HEDGE_AFTER (0 disables hedging, e.g. for chat sessions)
+        attempt_timeout: cap on a single attempt, below the overall deadline
+        on_abandoned: called with the result of an attempt that succeeds after it was
+            given up on (e.g. cancel_stream, so a stream nobody reads stops generating)
+    """
+    deadline = time.monotonic() + DEADLINES.get(endpoint, DEFAULT_DEADLINE)
+    hedge_after = HEDGE_AFTER if hedge_after is None else hedge_after
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        timeout = min(remaining, attempt_timeout) if attempt_timeout else remaining
+        try:
+            return await _attempt(fn, timeout, hedge_after, on_abandoned)
+        except Exception as e:
+            delay = backoff(attempt)
+            if attempt >= MAX_RETRIES or not is_retryable(e) or time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            _count("retries")
+            print(f"Warning: Gemini {endpoint} failed ({type(e).__name__}: {e}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def generate(endpoint: str, model, contents, **kwargs):
+    """model.generate_content under the endpoint's deadline/retry/hedge policy."""
+    return await call(
+        endpoint,
+        lambda timeout: model.generate_content(contents, request_options={"timeout": timeout}, **kwargs),
+    )
+
+
+async def generate_stream(endpoint: str, model, contents, **kwargs):
+    """
+    Streaming model.generate_content, retried until its first chunk arrives
+    (FIRST_CHUNK_SECONDS per attempt); read the chunks with iterate(). The SDK
+    timeout covers the whole stream, so it gets the endpoint's remaining deadline.
+    """
+    deadline = time.monotonic() + DEADLINES.get(endpoint, DEFAULT_DEADLINE)
+    return await call(
+        endpoint,
+        lambda timeout: model.generate_content(
+            contents, stream=True, request_options={"timeout": max(timeout, deadline - time.monotonic())}, **kwargs
+        ),
+        hedge_after=0,
+        attempt_timeout=FIRST_CHUNK_SECONDS,
+        on_abandoned=cancel_stream,
+    )
+
+
+async def iterate(endpoint: str, response, stall: float = None):
+    """
+    Async-iterate a blocking SDK stream off the event loop, failing with
+    GeminiTimeout if a chunk takes longer than `stall` or the endpoint deadline passes.
+    """
+    stall = stall or STALL_SECONDS
+    deadline = time.monotonic() + DEADLINES.get(endpoint, DEFAULT_DEADLINE)
+    chunks = iter(response)
+    finished = False
+    try:
+        while True:
+            timeout = min(stall, deadline - time.monotonic())
+            if timeout <= 0:
+                _count("timeouts")
+                raise GeminiTimeout(f"Gemini stream exceeded its {endpoint} deadline")
+            try:
+                chunk = await asyncio.wait_for(asyncio.to_thread(next, chunks, _END), timeout)
+            except asyncio.TimeoutError:
+                _count("timeouts")
+                raise GeminiTimeout(f"Gemini stream stalled for {timeout:.1f}s")
+            if chunk is _END:
+                finished = True
+                return
+            yield chunk
+    finally:
+        # Timed out, failed or abandoned by the caller: stop the upstream generation too
+        if not finished:
+            _count("cancelled")
+            cancel_stream(response)
+
+
+def cancel_stream(response) -> bool:
+    """
+    Best effort: close a streaming SDK response's connection, so Gemini stops
+    generating (and billing) tokens nobody will read. A chunk already being
+    read in a worker thread still arrives; nothing after it does.
+    """
+    upstream = getattr(response, "_iterator", None) or response
+    for name in ("cancel", "close"):
+        method = getattr(upstream, name, None)
+        if callable(method):
+            try:
+                method()
+                return True
+            except Exception as e:
+                print(f"Warning: Could not cancel Gemini stream: {e}")
+                return False
+    return False
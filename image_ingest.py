@@ -0,0 +1,153 @@
+"""
+Image ingestion for the Gemini endpoints.
+Sniffs the real MIME type of uploaded work, downsizes it to a bounded
+dimension, optionally boosts it for handwriting and re-encodes it before
+it is sent to the model.
+"""
+
+import os
+import io
+import time
+import base64
+import asyncio
+
+# Tunables (overridable per Lambda via environment)
+IMAGE_MAX_DIM = int(os.environ.get("IMAGE_MAX_DIM", "1600"))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+# "color" keeps the photo as-is, "grayscale" drops chroma, "contrast" also auto-levels for pencil work
+IMAGE_MODE = os.environ.get("IMAGE_MODE", "grayscale").lower()
+
+# Magic-number signatures -> MIME type
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+SUPPORTED_MIME_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"}
+
+# Hard cap on a single uploaded image, whichever transport it arrives by
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an uploaded image exceeds MAX_UPLOAD_BYTES."""
+
+
+def sniff_mime(data: bytes, default: str = "image/jpeg") -> str:
+    """Detect the image type from its leading bytes rather than trusting the client."""
+    head = bytes(data[:16])
+    for magic, mime in _SIGNATURES:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1"):
+            return "image/heif"
+    return default
+
+
+def is_binary_upload(content_type: str) -> bool:
+    """True for raw-body uploads (image bytes posted as the request body itself)."""
+    return content_type.startswith("image/") or content_type.startswith("application/octet-stream")
+
+
+async def read_stream_bounded(chunks, max_bytes: int = None) -> bytearray:
+    """Accumulate an async byte stream into one buffer, refusing anything over max_bytes."""
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    buf = bytearray()
+    async for chunk in chunks:
+        if len(buf) + len(chunk) > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+        buf += chunk
+    return buf
+
+
+async def read_upload_file(upload, max_bytes: int = None) -> bytes:
+    """Read a multipart UploadFile (spooled to disk past 1MB by Starlette) within the size cap."""
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+    return await upload.read()
+
+
+def decode_data_url(image_data: str) -> bytes:
+    """Strip an optional `data:<mime>;base64,` prefix and decode the payload."""
+    if "," in image_data:
+        image_data = image_data.split(",", 1)[1]
+    return base64.b64decode(image_data)
+
+
+def prepare_image(raw: bytes, max_dim: int = None, quality: int = None, mode: str = None) -> dict:
+    """
+    Normalise raw image bytes into a Gemini inline-data part.
+
+    Returns:
+        dict with 'mime_type' and 'data' (bytes)
+    """
+    max_dim = max_dim or IMAGE_MAX_DIM
+    quality = quality or IMAGE_QUALITY
+    mode = (mode or IMAGE_MODE).lower()
+
+    t0 = time.perf_counter()
+    mime = sniff_mime(raw)
+    timings = {"sniff": time.perf_counter() - t0}
+
+    try:
+        from PIL import Image, ImageOps  # Deferred: only image requests pay for Pillow
+
+        t = time.perf_counter()
+        img = Image.open(io.BytesIO(raw))
+        img = ImageOps.exif_transpose(img)  # Phone photos carry rotation in EXIF
+        timings["decode"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        if max(img.size) > max_dim:
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        timings["resize"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        if mode in ("grayscale", "contrast"):
+            img = img.convert("L")
+            if mode == "contrast":
+                img = ImageOps.autocontrast(img, cutoff=2)
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        timings["enhance"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        data = out.getvalue()
+        timings["encode"] = time.perf_counter() - t
+
+        # Never hand the model a bigger payload than we were given
+        if len(data) >= len(raw) and mime in SUPPORTED_MIME_TYPES:
+            data = bytes(raw)
+        else:
+            mime = "image/jpeg"
+    except Exception as e:
+        print(f"Warning: Image preprocessing skipped ({mime}): {e}")
+        data = bytes(raw)
+
+    stages = ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in timings.items())
+    print(f"INFO: Image ingest {mime} {len(raw)}B -> {len(data)}B (saved {len(raw) - len(data)}B) [{stages}]")
+    return {"mime_type": mime, "data": data}
+
+
+def ingest_data_url(image_data: str, **kwargs) -> dict:
+    """Convenience wrapper for base64 data URLs posted in JSON bodies."""
+    return prepare_image(decode_data_url(image_data), **kwargs)
+
+
+async def prepare_images(raw_pages: list, **kwargs) -> list:
+    """Preprocess several pages concurrently; Pillow releases the GIL for decode/resize/encode."""
+    t0 = time.perf_counter()
+    parts = await asyncio.gather(*(asyncio.to_thread(prepare_image, raw, **kwargs) for raw in raw_pages))
+    print(f"INFO: Image ingest {len(parts)} page(s) in {(time.perf_counter() - t0) * 1000:.1f}ms")
+    return list(parts)
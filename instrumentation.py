@@ -0,0 +1,207 @@
+"""
+Per-request latency instrumentation shared by both Lambdas.
+Collects spans (DynamoDB calls, Gemini calls, serialisation) for the current
+request and emits one structured log line per request, either plain JSON or
+CloudWatch Embedded Metric Format (EMF) so the numbers become metrics.
+
+Config (environment):
+    METRICS_FORMAT       "emf" (default) or "json"
+    METRICS_SAMPLE_RATE  fraction of requests logged, 0.0-1.0 (cold starts and errors always are)
+    METRICS_NAMESPACE    CloudWatch namespace for EMF
+"""
+
+import os
+import json
+import time
+import random
+import contextvars
+from contextlib import contextmanager
+
+METRICS_FORMAT = os.environ.get("METRICS_FORMAT", "emf").lower()
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", "1.0"))
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "SmartAITutor")
+
+# Operations that accept ReturnConsumedCapacity
+_CAPACITY_OPS = {"GetItem", "PutItem", "UpdateItem", "DeleteItem", "Query", "Scan",
+                 "BatchGetItem", "BatchWriteItem", "TransactGetItems", "TransactWriteItems"}
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+_cold_start = True
+
+
+class RequestMetrics:
+    """Spans and counters gathered while serving one request."""
+
+    def __init__(self, service: str, route: str):
+        global _cold_start
+        self.service = service
+        self.route = route
+        self.cold_start = _cold_start
+        _cold_start = False
+        self.start = time.perf_counter()
+        self.spans = []
+        self.metrics = {}
+        self.properties = {}
+
+    def add_span(self, name: str, duration_ms: float, **attrs):
+        self.spans.append({"name": name, "ms": round(duration_ms, 3), **attrs})
+        # Roll spans up into per-name totals so they can be charted
+        key = name.replace(".", "_") + "_ms"
+        self.metrics[key] = self.metrics.get(key, 0.0) + duration_ms
+
+    def add_metric(self, name: str, value: float):
+        self.metrics[name] = self.metrics.get(name, 0) + value
+
+    def emit(self, status: int):
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        if not (self.cold_start or status >= 500 or random.random() < METRICS_SAMPLE_RATE):
+            return
+        metrics = {"duration_ms": round(duration_ms, 3), **{k: round(v, 3) for k, v in self.metrics.items()}}
+        record = {
+            "service": self.service,
+            "route": self.route,
+            "status": status,
+            "coldStart": self.cold_start,
+            **self.properties,
+            **metrics,
+            "spans": self.spans,
+        }
+        if METRICS_FORMAT == "emf":
+            record["_aws"] = {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["service", "route"]],
+                    "Metrics": [
+                        {"Name": k, "Unit": "Milliseconds" if k.endswith("_ms") else "Count"}
+                        for k in metrics
+                    ],
+                }],
+            }
+        print(json.dumps(record, default=str))
+
+
+def begin_request(service: str, route: str) -> RequestMetrics:
+    """Start collecting for a request (bound to the current context)."""
+    metrics = RequestMetrics(service, route)
+    _current.set(metrics)
+    return metrics
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block and attach it to the current request (no-op outside one)."""
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_span(name, (time.perf_counter() - t0) * 1000, **attrs)
+
+
+def add_metric(name: str, value: float):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_metric(name, value)
+
+
+def record_usage(response, prefix: str = "gemini"):
+    """Add Gemini token counts from a response's usage_metadata, if present."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    add_metric(f"{prefix}_prompt_tokens", getattr(usage, "prompt_token_count", 0) or 0)
+    add_metric(f"{prefix}_output_tokens", getattr(usage, "candidates_token_count", 0) or 0)
+    # Part of the prompt served from a context cache (billed at the cached-input rate)
+    add_metric(f"{prefix}_cached_tokens", getattr(usage, "cached_content_token_count", 0) or 0)
+
+
+# --- DynamoDB (botocore event hooks, so call sites stay untouched) ---
+
+def _request_capacity(params, model, **kwargs):
+    if model.name in _CAPACITY_OPS:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _before_call(context, **kwargs):
+    context["metrics_t0"] = time.perf_counter()
+
+
+def _after_call(context, model, parsed, **kwargs):
+    t0 = context.get("metrics_t0")
+    metrics = _current.get()
+    if t0 is None or metrics is None:
+        return
+    capacity = parsed.get("ConsumedCapacity")
+    if isinstance(capacity, dict):
+        capacity = [capacity]
+    units = sum(c.get("CapacityUnits", 0) for c in capacity or [])
+    table = (capacity or [{}])[0].get("TableName", "")
+    metrics.add_span(f"dynamodb.{model.name}", (time.perf_counter() - t0) * 1000, table=table, capacity=units)
+    metrics.add_metric("dynamodb_calls", 1)
+    metrics.add_metric("dynamodb_capacity", units)
+
+
+def instrument_dynamodb(resource_or_client):
+    """Register timing/capacity hooks on a boto3 DynamoDB resource or client."""
+    client = getattr(getattr(resource_or_client, "meta", None), "client", resource_or_client)
+    events = client.meta.events
+    events.register("provide-client-params.dynamodb.*", _request_capacity, unique_id="metrics-capacity")
+    events.register("before-call.dynamodb.*", _before_call, unique_id="metrics-before")
+    events.register("after-call.dynamodb.*", _after_call, unique_id="metrics-after")
+    return resource_or_client
+
+
+# --- Entry points ---
+
+def instrumented_handler(service: str):
+    """Decorator for API Gateway proxy handlers (statusCode in the returned dict)."""
+    def wrap(fn):
+        def handler(event, context):
+            route = f"{str(event.get('httpMethod', '')).upper()} {event.get('path', '')}"
+            metrics = begin_request(service, route)
+            status = 500
+            try:
+                response = fn(event, context)
+                status = response.get("statusCode", 200) if isinstance(response, dict) else 200
+                return response
+            finally:
+                metrics.emit(status)
+        handler.__name__ = fn.__name__
+        handler.__doc__ = fn.__doc__
+        return handler
+    return wrap
+
+
+class MetricsMiddleware:
+    """ASGI middleware; the record is emitted when the last body chunk is sent, so SSE streams are covered."""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        metrics = begin_request(self.service, f"{scope['method']} {scope['path']}")
+        state = {"status": 500, "done": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["done"] = True
+                metrics.emit(state["status"])
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not state["done"]:
+                metrics.emit(state["status"])
@@ -0,0 +1,97 @@
+"""
+Incremental parsing of a model's streamed JSON answer.
+
+ItemStream is fed text chunks as Gemini streams them and returns each
+element of one array as soon as that element's closing brace arrives, so
+/generate-quiz-stream and /generate-test-stream can send question 1 while
+question 2 is still being written. Text before the first '{' or '[' (a
+```json fence, a sentence of preamble) and after the document is ignored.
+result() parses the whole document once it is complete; that, not the
+early items, is what gets stored.
+
+The scanner only tracks strings, nesting and object keys; every emitted
+element is parsed by json.loads, so malformed output is never half-accepted.
+"""
+
+import json
+
+
+class ItemStream:
+    """
+    Elements of the array at `path` (object keys from the top-level value):
+    () for a top-level array, ("questions",) for {"questions": [...]}.
+    """
+
+    def __init__(self, path=()):
+        self.path = tuple(path)
+        self.text = ""
+        self.done = False
+        self.emitted = 0
+        self._pos = 0
+        self._start = None      # Offset of the top-level value
+        self._end = None
+        self._stack = []        # (kind '{' or '[', path, start offset)
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._key = None
+
+    def feed(self, chunk: str) -> list:
+        """Add streamed text; returns the elements completed by it (possibly none)."""
+        self.text += chunk
+        items = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            if self.done:
+                break
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+            if self._start is None:
+                if c not in "{[":
+                    continue
+                self._start = i
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":" and self._stack and self._stack[-1][0] == "{":
+                self._key = json.loads(f'"{self._last_string}"')
+            elif c == "," and self._stack and self._stack[-1][0] == "{":
+                self._key = None
+            elif c in "{[":
+                self._stack.append((c, self._child_path(), i))
+                if c == "{":
+                    self._key = None
+            elif c in "}]":
+                kind, path, start = self._stack.pop()
+                if self._stack and self._stack[-1][0] == "[" and self._stack[-1][1] == self.path:
+                    try:
+                        items.append(json.loads(text[start:i + 1]))
+                    except ValueError:
+                        pass  # Left to result(), which fails loudly
+                if not self._stack:
+                    self._end = i + 1
+                    self.done = True
+        self._pos = len(text)
+        self.emitted += len(items)
+        return items
+
+    def _child_path(self):
+        if not self._stack:
+            return ()
+        kind, path, _ = self._stack[-1]
+        return path + ((self._key,) if kind == "{" else (None,))
+
+    def result(self):
+        """The complete document; ValueError if the stream ended before it did."""
+        if not self.done:
+            raise ValueError(f"Incomplete JSON in model response: {self.text[:200]}")
+        return json.loads(self.text[self._start:self._end])
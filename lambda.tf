@@ -6,20 +6,47 @@ variable "gemini_api_key" {
 
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "process_user.py"
   output_path = "process_user.zip"
+
+  source {
+    content  = file("process_user.py")
+    filename = "process_user.py"
+  }
+
+  source {
+    content  = file("aws_clients.py")
+    filename = "aws_clients.py"
+  }
 }
 
 # Build Gemini Lambda ensuring dependencies are packaged
 resource "null_resource" "build_gemini_lambda" {
   triggers = {
     handler_hash = filebase64sha256("gemini_handler.py")
+    ingest_hash  = filebase64sha256("image_ingest.py")
+    prompt_hash  = filebase64sha256("lesson_prompt.py")
+    metrics_hash = filebase64sha256("instrumentation.py")
+    flight_hash  = filebase64sha256("single_flight.py")
+    admit_hash   = filebase64sha256("admission.py")
+    policy_hash  = filebase64sha256("gemini_policy.py")
+    turns_hash   = filebase64sha256("chat_turns.py")
+    aws_hash     = filebase64sha256("aws_clients.py")
+    store_hash   = filebase64sha256("lesson_store.py")
+    search_hash  = filebase64sha256("curriculum_search.py")
+    atp_hash     = filebase64sha256("atp_retrieval.py")
+    index_hash   = filebase64sha256("curriculum_index.json")
+    replay_hash  = filebase64sha256("stream_replay.py")
+    jstream_hash = filebase64sha256("json_stream.py")
+    opener_hash  = filebase64sha256("lesson_openers.py")
+    routing_hash = filebase64sha256("model_routing.py")
+    cache_hash   = filebase64sha256("context_cache.py")
+    session_hash = filebase64sha256("session_state.py")
     req_hash     = filebase64sha256("requirements.txt")
     script_hash  = filebase64sha256("package_gemini.py")
   }
 
   provisioner "local-exec" {
-    command = "python3 package_gemini.py"
+    command = "python3 package_gemini.py --slim"
   }
 }
 
@@ -77,6 +104,7 @@ resource "aws_iam_role_policy" "lambda_policy" {
         "dynamodb:PutItem",
         "dynamodb:UpdateItem",
         "dynamodb:GetItem",
+        "dynamodb:DeleteItem",
         "dynamodb:Query",
         "dynamodb:Scan"
       ]
@@ -95,8 +123,83 @@ resource "aws_iam_role_policy" "lambda_policy" {
 
 data "archive_file" "profile_zip" {
   type        = "zip"
-  source_file = "profile_handler.py"
   output_path = "profile_handler.zip"
+
+  source {
+    content  = file("profile_handler.py")
+    filename = "profile_handler.py"
+  }
+
+  source {
+    content  = file("image_ingest.py")
+    filename = "image_ingest.py"
+  }
+
+  source {
+    content  = file("lesson_prompt.py")
+    filename = "lesson_prompt.py"
+  }
+
+  source {
+    content  = file("lesson_openers.py")
+    filename = "lesson_openers.py"
+  }
+
+  source {
+    content  = file("instrumentation.py")
+    filename = "instrumentation.py"
+  }
+
+  source {
+    content  = file("chat_turns.py")
+    filename = "chat_turns.py"
+  }
+
+  source {
+    content  = file("aws_clients.py")
+    filename = "aws_clients.py"
+  }
+
+  source {
+    content  = file("response_encoding.py")
+    filename = "response_encoding.py"
+  }
+
+  source {
+    content  = file("json_codec.py")
+    filename = "json_codec.py"
+  }
+
+  source {
+    content  = file("curriculum_search.py")
+    filename = "curriculum_search.py"
+  }
+
+  # Written by seed_curriculum.py (or --index-only) from extracted_atp_data.json
+  source {
+    content  = file("curriculum_index.json")
+    filename = "curriculum_index.json"
+  }
+}
+
+# Compiled extras for the profile Lambda (orjson for json_codec, brotli for response_encoding)
+resource "null_resource" "build_profile_layer" {
+  triggers = {
+    req_hash = filebase64sha256("requirements-profile.txt")
+  }
+
+  provisioner "local-exec" {
+    command = "python3 -m pip install -r requirements-profile.txt --target profile_layer/python --platform manylinux2014_x86_64 --implementation cp --python-version 3.12 --only-binary=:all: --upgrade && python3 -c \"import shutil; shutil.make_archive('profile_layer', 'zip', 'profile_layer')\""
+  }
+}
+
+resource "aws_lambda_layer_version" "profile_deps" {
+  depends_on          = [null_resource.build_profile_layer]
+  filename            = "profile_layer.zip"
+  layer_name          = "ProfileAPIDeps"
+  compatible_runtimes = ["python3.12"]
+  # The zip only exists after the build step, so version on its inputs
+  source_code_hash    = filebase64sha256("requirements-profile.txt")
 }
 
 resource "aws_lambda_function" "profile_api" {
@@ -108,10 +211,13 @@ resource "aws_lambda_function" "profile_api" {
   memory_size   = 512
   timeout       = 30
   source_code_hash = data.archive_file.profile_zip.output_base64sha256
+  layers           = [aws_lambda_layer_version.profile_deps.arn]
 
   environment {
     variables = {
       ENVIRONMENT = "production"
+      # Curriculum ETags follow the seeded data file (reseed after changing it)
+      CURRICULUM_SEED_VERSION = substr(filesha256("extracted_atp_data.json"), 0, 16)
     }
   }
 }
@@ -126,6 +232,10 @@ resource "aws_lambda_permission" "apigw_lambda" {
 # API Gateway
 resource "aws_api_gateway_rest_api" "tutor_api" {
   name = "TutorAPI"
+
+  # Every media type is binary so the Lambda can return compressed (base64) bodies;
+  # request bodies arrive base64-encoded and response_encoding decodes the non-image ones
+  binary_media_types = ["*/*"]
 }
 
 resource "aws_api_gateway_resource" "proxy" {
@@ -180,6 +290,7 @@ resource "aws_api_gateway_deployment" "prod" {
       aws_api_gateway_integration.lambda_proxy.id,
       aws_api_gateway_method.root_method.id,
       aws_api_gateway_integration.root_lambda.id,
+      aws_api_gateway_rest_api.tutor_api.binary_media_types,
     ]))
   }
   lifecycle {
@@ -215,6 +326,9 @@ resource "aws_lambda_function" "gemini_api" {
     variables = {
       ENVIRONMENT    = "production"
       SSM_PARAMETER_NAME = "/smart-ai-tutor/gemini-api-key"
+      RATE_LIMIT_TABLE   = aws_dynamodb_table.rate_limits.name
+      REPLAY_TABLE       = aws_dynamodb_table.stream_replay.name
+      SESSION_STATE_TABLE = aws_dynamodb_table.session_state.name
     }
   }
 }
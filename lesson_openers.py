@@ -0,0 +1,87 @@
+"""
+Pre-generated lesson openers, shared by profile_handler (/lessons/start),
+gemini_handler (session rebuild) and pregenerate_openers.py (batch job).
+
+The first AI message of a lesson only depends on the ATP topic/subtopic, so
+it is generated once per (curriculumId, topicId, subtopicId) offline and
+stored in the LessonOpeners table. /lessons/start seeds the new lesson's
+history with it, so the chat renders instantly instead of waiting for a live
+generation on the learner's first message.
+
+Each opener is stamped with opener_version(): a hash of OPENER_VERSION, the
+model and the exact lesson context it was written from. A reseeded topic or
+a new opener prompt changes the stamp, and stale openers are ignored until
+the batch job regenerates them.
+"""
+
+import hashlib
+from lesson_prompt import render_system_instruction
+
+# Bump whenever OPENER_REQUEST or OPENER_MODEL changes so stored openers are regenerated
+OPENER_VERSION = 1
+OPENER_MODEL = "gemini-2.5-flash"
+
+# The user turn the opener answers; also replayed before it when a chat session is rebuilt,
+# since Gemini histories start with a user turn
+OPENER_REQUEST = (
+    "Start the lesson. Greet me warmly (without using a name), explain in a few short "
+    "paragraphs what this topic is about and why it matters, introduce the first key idea "
+    "with a simple South African example, and end with one question to check I'm ready to continue."
+)
+
+
+def opener_key(topic_id: str, subtopic_id: str = None) -> str:
+    """
+    Table key. Seeded ids already nest (curriculumId#T1#W5 for topics, topicId#0
+    for subtopics), so a subtopic's id is its key and a whole topic is topicId#-.
+    """
+    return subtopic_id or f"{topic_id}#-"
+
+
+def curriculum_parts(topic_id: str):
+    """(curriculumId, grade, subjectName) from a seeded topicId."""
+    parts = (topic_id or "").split("#")
+    if len(parts) < 3:
+        return "", "", ""
+    grade = parts[1].replace("Grade", "").strip()
+    return "#".join(parts[:3]), grade, parts[2]
+
+
+def lesson_context(topic_id: str, topic_data: dict, subtopic_id: str = None, subtopic_data: dict = None):
+    """
+    (topic_name, subtopic_name, topic_context) for a lesson, from the Topics and
+    Subtopics items. Seeded items carry mainTopic/content rather than
+    topicName/subtopicName/context, so those are used as fallbacks.
+    """
+    topic_name = topic_data.get('topicName') or topic_data.get('mainTopic') or topic_id
+    topic_context = topic_data.get('context', '')
+    if not topic_context and topic_data.get('formulas'):
+        topic_context = "Formulas: " + "; ".join(topic_data['formulas'])
+    subtopic_name = ""
+    if subtopic_id:
+        subtopic_data = subtopic_data or {}
+        subtopic_name = subtopic_data.get('subtopicName') or subtopic_data.get('content', '')
+        subtopic_context = subtopic_data.get('context', '')
+        topic_context = f"Topic: {topic_name}\nSubtopic: {subtopic_name}\n\nTerm/Main Context: {topic_context}\n\nSpecific Focus: {subtopic_context}"
+    return topic_name, subtopic_name, topic_context
+
+
+def opener_version(topic_name: str, topic_context: str) -> str:
+    digest = hashlib.sha256(
+        f"v{OPENER_VERSION}:{OPENER_MODEL}:{OPENER_REQUEST}:{topic_name}:{topic_context}".encode("utf-8")
+    ).hexdigest()
+    return digest[:16]
+
+
+def opener_instruction(topic_id: str, topic_name: str, topic_context: str) -> str:
+    """The tutor instruction the opener is generated under (subject/grade from the curriculumId)."""
+    _, grade, subject_name = curriculum_parts(topic_id)
+    return render_system_instruction(subject_name, grade, topic_name, topic_context)
+
+
+def get_opener(table, topic_id: str, subtopic_id: str, version: str):
+    """Stored opener text for this lesson context, or None if missing or stale."""
+    item = table.get_item(Key={'openerKey': opener_key(topic_id, subtopic_id)}).get('Item')
+    if not item or item.get('version') != version:
+        return None
+    return item.get('content')
@@ -0,0 +1,68 @@
+"""
+Tutor system instruction shared by both Lambdas.
+profile_handler renders it once at /lessons/start and stores it on the lesson;
+gemini_handler reuses the stored copy instead of re-assembling it per message.
+"""
+
+import hashlib
+
+# Bump whenever SYSTEM_INSTRUCTION_TEMPLATE changes so stale stored prompts get re-rendered
+PROMPT_VERSION = 1
+
+SYSTEM_INSTRUCTION_TEMPLATE = """You are a South African CAPS-aligned AI tutor teaching {subject_name} to Grade {grade} learners.
+
+CURRENT TOPIC: {topic_name}
+
+TEACHING CONTEXT:
+{topic_context}
+
+TEACHING APPROACH:
+1. Be warm, encouraging, and patient with learners
+2. Use examples relevant to South African context when possible
+3. Introduce key definitions naturally as concepts come up
+4. Break down complex concepts into digestible parts
+5. Ask follow-up questions to check understanding
+6. Suggest related topics when appropriate for enrichment
+7. Use proper formatting: **bold** for emphasis, bullet points for lists
+8. For math/science, use LaTeX notation ($inline$ or $$block$$)
+
+Remember: Your goal is to help the learner truly understand, not just memorize."""
+
+
+def render_system_instruction(subject_name: str, grade: str, topic_name: str, topic_context: str) -> str:
+    """Fill the tutor template for one lesson."""
+    return SYSTEM_INSTRUCTION_TEMPLATE.format(
+        subject_name=subject_name or "",
+        grade=grade or "",
+        topic_name=topic_name or "",
+        topic_context=(topic_context or "").strip(),
+    )
+
+
+def prompt_hash(system_instruction: str) -> str:
+    """Short content hash of a rendered instruction (identical lessons share it)."""
+    return hashlib.sha256(f"v{PROMPT_VERSION}:{system_instruction}".encode("utf-8")).hexdigest()[:16]
+
+
+def build_prompt_fields(subject_name: str, grade: str, topic_name: str, topic_context: str) -> dict:
+    """Lesson attributes persisted at /lessons/start."""
+    instruction = render_system_instruction(subject_name, grade, topic_name, topic_context)
+    return {
+        'systemInstruction': instruction,
+        'promptVersion': PROMPT_VERSION,
+        'promptHash': prompt_hash(instruction),
+    }
+
+
+def resolve_system_instruction(item: dict):
+    """
+    Return (system_instruction, prompt_hash) for a Lessons item, re-rendering only
+    for lessons created before the prompt was stored or under an older version.
+    """
+    if item.get('systemInstruction') and int(item.get('promptVersion', 0)) == PROMPT_VERSION:
+        return item['systemInstruction'], item.get('promptHash') or prompt_hash(item['systemInstruction'])
+    fields = build_prompt_fields(
+        item.get('subjectName', ''), item.get('grade', ''),
+        item.get('topicName', ''), item.get('topicContext', ''),
+    )
+    return fields['systemInstruction'], fields['promptHash']
@@ -0,0 +1,89 @@
+"""
+Async access to the Lessons table for the FastAPI Gemini app.
+
+boto3 is blocking, so a get_item/update_item awaited-in-place would stall the
+event loop (and every SSE stream on it) for the whole round trip. LessonStore
+keeps boto3's semantics — same arguments, same return values and exceptions —
+but runs each call on a dedicated thread pool, so DynamoDB work never queues
+behind long Gemini stream reads on asyncio's default executor. The request
+context is carried over, so instrumentation spans still land on the request.
+
+Config (environment):
+    DYNAMO_THREADS  threads in the DynamoDB executor (keep <= AWS_MAX_POOL_CONNECTIONS)
+"""
+
+import os
+import time
+import asyncio
+import functools
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import add_metric
+
+DYNAMO_THREADS = int(os.environ.get("DYNAMO_THREADS", "16"))
+
+_executor = None
+_lock = threading.Lock()
+
+stats = {"calls": 0, "inflight": 0, "max_inflight": 0}
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DYNAMO_THREADS, thread_name_prefix="dynamodb")
+    return _executor
+
+
+async def run(fn, *args, **kwargs):
+    """Run a blocking boto3 call on the DynamoDB executor and await its result."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def call():
+        # Time spent waiting for a free thread; a steady non-zero value means DYNAMO_THREADS is too low
+        add_metric("dynamodb_queue_ms", (time.perf_counter() - submitted) * 1000)
+        return fn(*args, **kwargs)
+
+    stats["calls"] += 1
+    stats["inflight"] += 1
+    stats["max_inflight"] = max(stats["max_inflight"], stats["inflight"])
+    try:
+        return await loop.run_in_executor(executor(), functools.partial(context.run, call))
+    finally:
+        stats["inflight"] -= 1
+
+
+class LessonStore:
+    """Awaitable wrapper around a boto3 Lessons Table (or anything with the same methods)."""
+
+    def __init__(self, table):
+        self.table = table
+
+    @property
+    def exceptions(self):
+        """The table client's modelled exceptions, e.g. store.exceptions.ConditionalCheckFailedException."""
+        return self.table.meta.client.exceptions
+
+    async def get(self, lesson_id: str, fields=None, consistent: bool = False) -> dict:
+        """The lesson item ({} if missing), optionally projected to `fields`."""
+        kwargs = {'Key': {'lessonId': lesson_id}}
+        if fields:
+            kwargs['ProjectionExpression'] = ", ".join(f"#{i}" for i in range(len(fields)))
+            kwargs['ExpressionAttributeNames'] = {f"#{i}": f for i, f in enumerate(fields)}
+        if consistent:
+            kwargs['ConsistentRead'] = True
+        res = await run(self.table.get_item, **kwargs)
+        return res.get('Item', {})
+
+    async def update(self, lesson_id: str, **kwargs) -> dict:
+        """update_item on the lesson; kwargs are passed through (UpdateExpression, ConditionExpression, ...)."""
+        return await run(self.table.update_item, Key={'lessonId': lesson_id}, **kwargs)
+
+    async def call(self, fn, *args, **kwargs):
+        """Any other blocking helper taking the table first, e.g. chat_turns.append_turn."""
+        return await run(fn, self.table, *args, **kwargs)
@@ -0,0 +1,195 @@
+"""
+Model tier and generation config per Gemini request.
+
+Two tiers: "fast" (Flash-Lite) for short, text-only, structured work and
+"full" (Flash) for images, long prompts and open-ended writing. route()
+decides per request, first match wins:
+
+    1. config      GEMINI_ROUTES forces a tier for the endpoint
+    2. attachment  images (handwritten pages, chat photos) go to full
+    3. long        prompt estimate over FAST_MAX_PROMPT_TOKENS goes to full
+    4. session     a chat session on full stays on full: switching tiers
+                   rebuilds the session from the whole history (and may
+                   cache its context again for the other model), so a
+                   session moves at most once, up, and only a new session
+                   starts on fast
+    5. short chat  chat messages up to CHAT_FAST_MAX_TOKENS (a one-line
+                   clarification) go to fast, with a shorter answer cap
+    6. slo         the endpoint defaults to full, but full's recent latency
+                   (EWMA) for it is over its SLO: fast, except every
+                   SLO_PROBE_EVERY-th request, which keeps measuring full
+    7. default     DEFAULT_TIERS (a fast chat session moves up here)
+
+observe() records latency (time to first token for chat, whole call
+otherwise), tokens and estimated cost per tier, both as request metrics and
+in `stats` (GET / on the Gemini API), so each routing choice can be judged
+by what it saved.
+
+Config (environment):
+    GEMINI_MODEL_TIERS         JSON tier -> model, e.g. {"fast": "gemini-2.5-flash-lite"}
+    GEMINI_ROUTES              JSON endpoint -> tier, overrides the policy
+    GEMINI_LATENCY_SLO_MS      JSON endpoint -> latency SLO in ms
+    GEMINI_GENERATION_CONFIG   JSON endpoint -> generation config merged over the defaults
+    GEMINI_TIER_PRICES         JSON tier -> [input, output] USD per 1M tokens
+    FAST_MAX_PROMPT_TOKENS     longest prompt (estimated tokens) the fast tier gets
+    CHAT_FAST_MAX_TOKENS       longest chat message (estimated tokens) routed to fast
+    SLO_PROBE_EVERY            while over SLO, every n-th eligible request still uses full
+"""
+
+import os
+import json
+import math
+from collections import namedtuple
+from instrumentation import add_metric
+
+MODEL_TIERS = {"fast": "gemini-2.5-flash-lite", "full": "gemini-2.5-flash"}
+MODEL_TIERS.update(json.loads(os.environ.get("GEMINI_MODEL_TIERS", "{}")))
+
+DEFAULT_TIERS = {
+    "chat-stream": "full",
+    "generate-quiz": "fast",
+    "grade-quiz": "fast",
+    "generate-test": "full",
+    "grade-image": "full",
+}
+ROUTE_OVERRIDES = json.loads(os.environ.get("GEMINI_ROUTES", "{}"))
+
+# Time to first token for chat, whole call for the rest
+LATENCY_SLO_MS = {
+    "chat-stream": 1500,
+    "generate-quiz": 8000,
+    "grade-quiz": 4000,
+    "generate-test": 15000,
+    "grade-image": 30000,
+}
+LATENCY_SLO_MS.update(json.loads(os.environ.get("GEMINI_LATENCY_SLO_MS", "{}")))
+
+# Answers parsed as JSON; graded answers should not vary between attempts
+JSON_ENDPOINTS = {"generate-quiz", "grade-quiz", "generate-test", "grade-image"}
+GRADING_ENDPOINTS = {"grade-quiz", "grade-image"}
+CONFIG_OVERRIDES = json.loads(os.environ.get("GEMINI_GENERATION_CONFIG", "{}"))
+
+# Public list prices, USD per 1M tokens (input, output); cached input is billed at CACHED_INPUT_RATE
+CACHED_INPUT_RATE = 0.25
+TIER_PRICES = {"fast": (0.10, 0.40), "full": (0.30, 2.50)}
+TIER_PRICES.update({k: tuple(v) for k, v in json.loads(os.environ.get("GEMINI_TIER_PRICES", "{}")).items()})
+
+FAST_MAX_PROMPT_TOKENS = int(os.environ.get("FAST_MAX_PROMPT_TOKENS", "8000"))
+CHAT_FAST_MAX_TOKENS = int(os.environ.get("CHAT_FAST_MAX_TOKENS", "24"))
+SLO_PROBE_EVERY = int(os.environ.get("SLO_PROBE_EVERY", "20"))
+
+# Rough Gemini tokenisation for English prose; images are billed at a flat rate
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+EWMA_ALPHA = 0.2
+
+Route = namedtuple("Route", "endpoint tier model config reason")
+
+stats = {tier: {"calls": 0, "ms": 0.0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+         for tier in MODEL_TIERS}
+stats["reasons"] = {}
+
+_latency = {}   # (endpoint, tier) -> EWMA ms
+_over_slo = {}  # endpoint -> eligible requests routed down since the last probe
+
+
+def estimate_tokens(contents) -> int:
+    """Prompt size estimate for a string or a list of parts (strings and images)."""
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    total = 0
+    for part in parts:
+        total += math.ceil(len(part) / CHARS_PER_TOKEN) if isinstance(part, str) else IMAGE_TOKENS
+    return total
+
+
+def estimate_history_tokens(history) -> int:
+    """Prompt size estimate for a chat history: DynamoDB-shaped dicts or SDK Content objects."""
+    parts = []
+    for turn in history:
+        turn_parts = turn['parts'] if isinstance(turn, dict) else getattr(turn, 'parts', [])
+        parts.extend(getattr(part, 'text', part) for part in turn_parts)
+    return estimate_tokens(parts)
+
+
+def tier_of(model: str):
+    """Tier name for a model name (None if it is not one of MODEL_TIERS)."""
+    return next((tier for tier, name in MODEL_TIERS.items() if name == model), None)
+
+
+def generation_config(endpoint: str, tier: str, reason: str = None) -> dict:
+    config = {}
+    if endpoint in JSON_ENDPOINTS:
+        config["response_mime_type"] = "application/json"
+    if endpoint in GRADING_ENDPOINTS:
+        config["temperature"] = 0
+    if endpoint == "chat-stream" and tier == "fast" and reason == "short chat":
+        # Clarifications: keep the quick answer quick (not a full answer that is only on fast for latency)
+        config["max_output_tokens"] = 1024
+    config.update(CONFIG_OVERRIDES.get(endpoint, {}))
+    return config
+
+
+def _tier(endpoint: str, prompt_tokens: int, attachments: int, message_tokens, session_tier):
+    if endpoint in ROUTE_OVERRIDES:
+        return ROUTE_OVERRIDES[endpoint], "config"
+    if attachments:
+        return "full", "attachment"
+    if prompt_tokens > FAST_MAX_PROMPT_TOKENS:
+        return "full", "long"
+    if endpoint == "chat-stream" and session_tier == "full":
+        return "full", "session"
+    if endpoint == "chat-stream" and message_tokens is not None and message_tokens <= CHAT_FAST_MAX_TOKENS:
+        return "fast", "short chat"
+    tier = DEFAULT_TIERS.get(endpoint, "full")
+    slo = LATENCY_SLO_MS.get(endpoint)
+    if tier == "full" and slo and _latency.get((endpoint, "full"), 0) > slo:
+        skipped = _over_slo.get(endpoint, 0) + 1
+        if skipped < SLO_PROBE_EVERY:
+            _over_slo[endpoint] = skipped
+            return "fast", "slo"
+        _over_slo[endpoint] = 0
+        return "full", "slo probe"
+    return tier, "default"
+
+
+def route(endpoint: str, prompt_tokens: int = 0, attachments: int = 0, message_tokens: int = None,
+          session_tier: str = None) -> Route:
+    """
+    Tier, model and generation config for one request. session_tier is the tier of
+    the chat session the message continues (None for a new session or a one-shot call);
+    only a session on full is kept there.
+    """
+    tier, reason = _tier(endpoint, prompt_tokens, attachments, message_tokens, session_tier)
+    if tier not in MODEL_TIERS:
+        print(f"Warning: Unknown model tier {tier!r} for {endpoint}, using full")
+        tier = "full"
+    stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+    add_metric(f"route_{tier}", 1)
+    return Route(endpoint, tier, MODEL_TIERS[tier], generation_config(endpoint, tier, reason), reason)
+
+
+def observe(chosen: Route, latency_ms: float, response=None):
+    """Record what a routed call cost: latency, tokens and estimated USD, per tier."""
+    key = (chosen.endpoint, chosen.tier)
+    previous = _latency.get(key)
+    _latency[key] = latency_ms if previous is None else previous + EWMA_ALPHA * (latency_ms - previous)
+
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    price_in, price_out = TIER_PRICES.get(chosen.tier, (0.0, 0.0))
+    billed_input = prompt_tokens - cached_tokens + cached_tokens * CACHED_INPUT_RATE
+    cost = (billed_input * price_in + output_tokens * price_out) / 1_000_000
+
+    tier_stats = stats[chosen.tier]
+    tier_stats["calls"] += 1
+    tier_stats["ms"] += latency_ms
+    tier_stats["prompt_tokens"] += prompt_tokens
+    tier_stats["cached_tokens"] += cached_tokens
+    tier_stats["output_tokens"] += output_tokens
+    tier_stats["cost_usd"] += cost
+    add_metric(f"gemini_{chosen.tier}_ms", latency_ms)
+    add_metric(f"gemini_{chosen.tier}_prompt_tokens", prompt_tokens)
+    add_metric(f"gemini_{chosen.tier}_output_tokens", output_tokens)
+    add_metric(f"gemini_{chosen.tier}_cost_usd", cost)
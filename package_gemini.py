@@ -1,14 +1,92 @@
 import os
+import sys
 import shutil
+import argparse
+import compileall
+import py_compile
 import subprocess
-import sys
 import zipfile
 
-def package():
+# Lambda runtime the bytecode has to match (see lambda.tf)
+TARGET_PYTHON = (3, 12)
+
+# Directory names dropped anywhere in the tree when --slim is set
+PRUNE_DIR_NAMES = {"__pycache__", "tests", "test", "benchmarks", "examples"}
+
+# Packages/paths the Lambda never imports at runtime
+PRUNE_PATHS = [
+    "uvicorn",                                   # Local dev server only; Lambda goes through Mangum
+    "boto3", "botocore", "s3transfer",           # Provided by the Lambda runtime
+    "pip", "setuptools", "wheel", "_distutils_hack",
+    "googleapiclient/discovery_cache/documents", # ~100MB of bundled discovery docs; genai fetches its own
+]
+
+# dist-info files kept so importlib.metadata.version() keeps working
+DIST_INFO_KEEP = {"METADATA", "entry_points.txt", "top_level.txt"}
+
+
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def prune(build_dir):
+    """Strip tests, caches, unused packages and dist-info payloads from the build tree."""
+    before = dir_size(build_dir)
+
+    for rel_path in PRUNE_PATHS:
+        target = os.path.join(build_dir, rel_path)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        for entry in os.listdir(build_dir):
+            # Matching dist-info for whole packages, e.g. uvicorn-0.30.0.dist-info
+            if "/" not in rel_path and entry.startswith(rel_path + "-") and entry.endswith(".dist-info"):
+                shutil.rmtree(os.path.join(build_dir, entry))
+
+    for root, dirs, files in os.walk(build_dir, topdown=True):
+        for d in list(dirs):
+            if d in PRUNE_DIR_NAMES:
+                shutil.rmtree(os.path.join(root, d))
+                dirs.remove(d)
+        if root.endswith(".dist-info"):
+            for file in files:
+                if file not in DIST_INFO_KEEP:
+                    os.remove(os.path.join(root, file))
+        for file in files:
+            if file.endswith((".pyc", ".pyo", ".pyi")):
+                path = os.path.join(root, file)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    after = dir_size(build_dir)
+    print(f"✂️  Pruned {(before - after) / (1024 * 1024):.2f} MB")
+
+
+def precompile(build_dir):
+    """Write __pycache__ bytecode up front; /var/task is read-only so Lambda can't cache it itself."""
+    if sys.version_info[:2] != TARGET_PYTHON:
+        print(f"⚠️ Skipping bytecode precompile: running {sys.version_info[0]}.{sys.version_info[1]}, "
+              f"Lambda runs {TARGET_PYTHON[0]}.{TARGET_PYTHON[1]}")
+        return
+    print("⚙️  Precompiling bytecode...")
+    # Unchecked hashes: zip extraction doesn't preserve source mtimes, so skip validation entirely
+    compileall.compile_dir(
+        build_dir, quiet=1, workers=0,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+
+
+def package(slim=False):
     build_dir = "gemini_build"
     zip_file = "gemini_handler.zip"
     requirements_file = "requirements.txt"
     handler_file = "gemini_handler.py"
+    module_files = ["image_ingest.py", "lesson_prompt.py", "instrumentation.py", "single_flight.py", "admission.py", "gemini_policy.py", "chat_turns.py", "aws_clients.py", "lesson_store.py", "curriculum_search.py", "atp_retrieval.py", "stream_replay.py", "json_stream.py", "lesson_openers.py", "model_routing.py", "context_cache.py", "session_state.py"]
+    # Written by seed_curriculum.py; read by atp_retrieval for per-message ATP snippets
+    data_files = ["curriculum_index.json"]
 
     print("🚀 Starting Zero-Cost Lambda Packaging (Python Edition)...")
 
@@ -23,9 +101,9 @@ def package():
     print(f"📦 Installing dependencies from {requirements_file}...")
     try:
         subprocess.check_call([
-            sys.executable, "-m", "pip", "install", 
-            "--target", build_dir, 
-            "-r", requirements_file, 
+            sys.executable, "-m", "pip", "install",
+            "--target", build_dir,
+            "-r", requirements_file,
             "--no-cache-dir",
             "--platform", "manylinux2014_x86_64",
             "--only-binary=:all:",
@@ -37,17 +115,26 @@ def package():
         # Fallback to standard install if platform-specific fails (though risky for binaries)
         print("⚠️ Retrying with standard install...")
         subprocess.check_call([
-            sys.executable, "-m", "pip", "install", 
-            "--target", build_dir, 
-            "-r", requirements_file, 
+            sys.executable, "-m", "pip", "install",
+            "--target", build_dir,
+            "-r", requirements_file,
             "--no-cache-dir"
         ])
 
     # 3. Copy handler
     print(f"📄 Copying {handler_file}...")
     shutil.copy(handler_file, os.path.join(build_dir, handler_file))
+    for module_file in module_files:
+        shutil.copy(module_file, os.path.join(build_dir, module_file))
+    for data_file in data_files:
+        shutil.copy(data_file, os.path.join(build_dir, data_file))
+
+    # 4. Slim down (optional)
+    if slim:
+        prune(build_dir)
+        precompile(build_dir)
 
-    # 4. Create ZIP
+    # 5. Create ZIP
     print(f"🤐 Creating {zip_file}...")
     with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zf:
         for root, dirs, files in os.walk(build_dir):
@@ -57,7 +144,12 @@ def package():
                 zf.write(full_path, rel_path)
 
     size = os.path.getsize(zip_file) / (1024 * 1024)
-    print(f"✅ Packaging complete: {zip_file} ({size:.2f} MB)")
+    unpacked = dir_size(build_dir) / (1024 * 1024)
+    print(f"✅ Packaging complete: {zip_file} ({size:.2f} MB zipped, {unpacked:.2f} MB unpacked)")
 
 if __name__ == "__main__":
-    package()
+    parser = argparse.ArgumentParser(description="Build the Gemini Lambda deployment zip.")
+    parser.add_argument("--slim", action="store_true",
+                        help="Prune tests/caches/unused packages and precompile bytecode")
+    args = parser.parse_args()
+    package(slim=args.slim)
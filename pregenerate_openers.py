@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Pre-generate the first AI message of a lesson for every seeded ATP topic and
+subtopic, and store it in the LessonOpeners table (see lesson_openers.py).
+/lessons/start seeds new lessons with it, so the first screen renders without
+a live Gemini call.
+
+Runs with bounded concurrency (--concurrency Gemini calls in flight) and
+writes each opener as soon as it is generated. Re-running resumes: openers
+already stored with the current version stamp are skipped, so an interrupted
+run (Ctrl-C, expired credentials, quota) continues where it stopped. Reseeded
+topics and opener prompt changes get new stamps and are regenerated.
+
+Requires AWS credentials (uses the 'capaciti' profile by default) and a
+Gemini key (GEMINI_API_KEY, else the SSM parameter the Gemini Lambda uses).
+
+Usage: python pregenerate_openers.py [--curriculum "CAPS#Grade 11#Physical Science"]
+                                     [--topics-only] [--concurrency 8] [--limit N] [--dry-run] [--force]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import boto3
+from botocore.config import Config
+from lesson_openers import (
+    OPENER_MODEL, OPENER_REQUEST, opener_key, curriculum_parts, lesson_context,
+    opener_version, opener_instruction,
+)
+
+# AWS Configuration
+AWS_PROFILE = os.environ.get("AWS_PROFILE", "capaciti")
+AWS_REGION = os.environ.get("AWS_REGION", "af-south-1")
+SSM_PARAMETER_NAME = os.environ.get("SSM_PARAMETER_NAME", "/smart-ai-tutor/gemini-api-key")
+
+# Table names
+TOPICS_TABLE = "Topics"
+SUBTOPICS_TABLE = "Subtopics"
+OPENERS_TABLE = "LessonOpeners"
+
+MAX_ATTEMPTS = 4
+
+
+def get_session():
+    """boto3 session for the configured profile (falls back to the default chain)."""
+    try:
+        return boto3.Session(profile_name=AWS_PROFILE)
+    except Exception:
+        return boto3.Session()
+
+
+def configure_gemini(session):
+    import google.generativeai as genai
+    key = os.environ.get("GEMINI_API_KEY")
+    if not key:
+        ssm = session.client('ssm', region_name=AWS_REGION)
+        key = ssm.get_parameter(Name=SSM_PARAMETER_NAME, WithDecryption=True)['Parameter']['Value']
+    genai.configure(api_key=key)
+    return genai
+
+
+def scan_all(table, **kwargs):
+    """Every item of a table (paginated scan)."""
+    response = table.scan(**kwargs)
+    items = response.get('Items', [])
+    while 'LastEvaluatedKey' in response:
+        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'], **kwargs)
+        items.extend(response.get('Items', []))
+    return items
+
+
+def collect_jobs(topics: list, subtopics: list, curriculum: str = None, topics_only: bool = False) -> list:
+    """
+    One job per topic (lessons started without a subtopic) and per subtopic.
+
+    Returns:
+        list of dicts: key, curriculumId, topicId, subtopicId, topicName, topicContext, version
+    """
+    by_topic = {}
+    for st in subtopics:
+        by_topic.setdefault(st['topicId'], []).append(st)
+
+    jobs = []
+    for topic in sorted(topics, key=lambda t: t['topicId']):
+        topic_id = topic['topicId']
+        curriculum_id = curriculum_parts(topic_id)[0]
+        if curriculum and curriculum_id != curriculum:
+            continue
+        targets = [(None, None)]
+        if not topics_only:
+            targets += [(st['subtopicId'], st) for st in sorted(by_topic.get(topic_id, []), key=lambda s: int(s['orderIndex']))]
+        for subtopic_id, st_data in targets:
+            topic_name, _, topic_context = lesson_context(topic_id, topic, subtopic_id, st_data)
+            jobs.append({
+                'key': opener_key(topic_id, subtopic_id),
+                'curriculumId': curriculum_id,
+                'topicId': topic_id,
+                'subtopicId': subtopic_id,
+                'topicName': topic_name,
+                'topicContext': topic_context,
+                'version': opener_version(topic_name, topic_context),
+            })
+    return jobs
+
+
+def stored_versions(openers_table) -> dict:
+    """openerKey -> version of every stored opener (what a resumed run can skip)."""
+    items = scan_all(openers_table, ProjectionExpression='openerKey, version')
+    return {item['openerKey']: item.get('version') for item in items}
+
+
+def generate_opener(genai, job: dict):
+    """(text, usage) for one job, retrying transient errors with jittered backoff."""
+    model = genai.GenerativeModel(
+        OPENER_MODEL,
+        system_instruction=opener_instruction(job['topicId'], job['topicName'], job['topicContext']),
+    )
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            response = model.generate_content(OPENER_REQUEST, request_options={"timeout": 60})
+            return response.text.strip(), getattr(response, 'usage_metadata', None)
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = random.uniform(0, min(30, 2 * 2 ** attempt))
+            print(f"  Warning: {job['key']} failed ({type(e).__name__}: {e}), retry in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def run(jobs: list, genai, openers_table, concurrency: int = 8) -> dict:
+    """Generate and store openers; returns counts and token totals."""
+    totals = {"generated": 0, "failed": 0, "prompt_tokens": 0, "output_tokens": 0}
+    started = time.monotonic()
+
+    def work(job):
+        text, usage = generate_opener(genai, job)
+        if not text:
+            raise ValueError("empty opener")
+        openers_table.put_item(Item={
+            'openerKey': job['key'],
+            'curriculumId': job['curriculumId'],
+            'topicId': job['topicId'],
+            'subtopicId': job['subtopicId'] or '-',
+            'content': text,
+            'version': job['version'],
+            'model': OPENER_MODEL,
+            'createdAt': int(time.time()),
+        })
+        return usage
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(work, job): job for job in jobs}
+        try:
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    usage = future.result()
+                    totals["generated"] += 1
+                    totals["prompt_tokens"] += getattr(usage, 'prompt_token_count', 0) or 0
+                    totals["output_tokens"] += getattr(usage, 'candidates_token_count', 0) or 0
+                except Exception as e:
+                    totals["failed"] += 1
+                    print(f"  ERROR: {job['key']}: {e}")
+                done = totals["generated"] + totals["failed"]
+                if done % 25 == 0 or done == len(jobs):
+                    rate = done / max(time.monotonic() - started, 1e-9)
+                    print(f"  {done}/{len(jobs)} openers ({totals['failed']} failed), {rate:.1f}/s")
+        except KeyboardInterrupt:
+            # Stored openers are kept; the next run skips them
+            print("\nInterrupted: cancelling queued jobs (re-run to resume)...")
+            for future in futures:
+                future.cancel()
+            raise
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--curriculum", help="Only this curriculumId, e.g. 'CAPS#Grade 11#Physical Science'")
+    parser.add_argument("--topics-only", action="store_true", help="Skip per-subtopic openers")
+    parser.add_argument("--concurrency", type=int, default=8, help="Gemini calls in flight")
+    parser.add_argument("--limit", type=int, help="Generate at most this many openers")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be generated")
+    parser.add_argument("--force", action="store_true", help="Regenerate openers that are up to date")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Lesson Opener Pre-generation")
+    print("=" * 60)
+    print(f"Profile: {AWS_PROFILE}")
+    print(f"Region: {AWS_REGION}")
+
+    session = get_session()
+    dynamodb = session.resource('dynamodb', config=Config(region_name=AWS_REGION, retries={'max_attempts': 10, 'mode': 'adaptive'}))
+    openers_table = dynamodb.Table(OPENERS_TABLE)
+
+    print("\nScanning Topics and Subtopics...")
+    topics = scan_all(dynamodb.Table(TOPICS_TABLE))
+    subtopics = [] if args.topics_only else scan_all(dynamodb.Table(SUBTOPICS_TABLE))
+    jobs = collect_jobs(topics, subtopics, args.curriculum, args.topics_only)
+
+    stored = {} if args.force else stored_versions(openers_table)
+    pending = [job for job in jobs if stored.get(job['key']) != job['version']]
+    stale = sum(1 for job in jobs if job['key'] in stored and stored[job['key']] != job['version'])
+    print(f"  - {len(jobs)} openers for {len(topics)} topics / {len(subtopics)} subtopics")
+    print(f"  - {len(jobs) - len(pending)} up to date, {stale} stale, {len(pending)} to generate")
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    if args.dry_run or not pending:
+        return
+
+    genai = configure_gemini(session)
+    print(f"\nGenerating with {OPENER_MODEL}, {args.concurrency} at a time...")
+    t0 = time.monotonic()
+    try:
+        totals = run(pending, genai, openers_table, args.concurrency)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    print("\n" + "=" * 60)
+    print("Pre-generation Complete!")
+    print("=" * 60)
+    print(f"  Generated: {totals['generated']}, failed: {totals['failed']} (re-run to retry)")
+    print(f"  Tokens: {totals['prompt_tokens']} prompt, {totals['output_tokens']} output")
+    print(f"  Time: {time.monotonic() - t0:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
-import boto3
 import os
+import aws_clients
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = aws_clients.resource('dynamodb')
 table = dynamodb.Table('UserProfiles')
 
 def lambda_handler(event, context):
@@ -19,8 +19,8 @@ def lambda_handler(event, context):
             'name': '',
             'surname': '',
             'grade': '',
-            'curriculum': 'CAPS', # Default
-            'subjects': []
+            'curriculum': 'CAPS' # Default
+            # `subjects` is a string set, created on first enrollment (sets can't be empty)
         }
     )
     return event
\ No newline at end of file
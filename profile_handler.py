@@ -1,16 +1,25 @@
 import boto3
 import json
 import os
+import base64
 from decimal import Decimal
-
-# Helper for JSON serialization of DynamoDB numbers
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
-
-dynamodb = boto3.resource('dynamodb')
+import aws_clients
+import json_codec
+from image_ingest import sniff_mime, is_binary_upload
+from lesson_prompt import build_prompt_fields
+from lesson_openers import lesson_context, opener_version, get_opener
+from chat_turns import append_turn, turn_messages, PENDING
+from instrumentation import instrumented_handler, instrument_dynamodb, span, add_metric
+from response_encoding import negotiated, cors_headers
+import curriculum_search
+
+# profilePicture lives inline on the UserProfiles item (400KB item limit)
+PROFILE_PICTURE_MAX_BYTES = int(os.environ.get("PROFILE_PICTURE_MAX_BYTES", str(300 * 1024)))
+# Upper bound on /curriculum/search `limit`
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", "50"))
+
+# Shared tuned resource (pool size, adaptive retries, keep-alive), reused across invocations
+dynamodb = instrument_dynamodb(aws_clients.resource('dynamodb'))
 user_table = dynamodb.Table('UserProfiles')
 subject_table = dynamodb.Table('Subjects')
 lesson_table = dynamodb.Table('Lessons')
@@ -19,7 +28,11 @@ lesson_table = dynamodb.Table('Lessons')
 curriculum_table = dynamodb.Table('Curriculum')
 topics_table = dynamodb.Table('Topics')
 subtopics_table = dynamodb.Table('Subtopics')
+# Pre-generated first messages per topic/subtopic
+openers_table = dynamodb.Table('LessonOpeners')
 
+@instrumented_handler("profile")
+@negotiated
 def lambda_handler(event, context):
     method = str(event.get('httpMethod', '')).upper()
     path = str(event.get('path', '')).lower()
@@ -85,6 +98,28 @@ def lambda_handler(event, context):
         unique_grades = sorted(grades, key=extract_grade_num)
         return build_response(200, unique_grades)
 
+    # GET Search ATP topics (in-memory BM25 index built at seed time; no DynamoDB reads)
+    elif method == 'GET' and path.endswith('/curriculum/search'):
+        q = (query_params.get('q') or '').strip()
+        if not q:
+            return build_response(400, {"error": "q parameter required"})
+        try:
+            limit = min(max(int(query_params.get('limit', 10)), 1), SEARCH_MAX_RESULTS)
+        except ValueError:
+            return build_response(400, {"error": "limit must be a number"})
+
+        with span("search.query"):
+            results = curriculum_search.search(
+                q,
+                grade=query_params.get('grade'),
+                subject=query_params.get('subjectName'),
+                curriculum_id=query_params.get('curriculumId'),
+                limit=limit
+            )
+        if results is None:
+            return build_response(503, {"error": "Curriculum search is not available"})
+        return build_response(200, {"query": q, "results": results})
+
     # GET ATP Curriculum Subjects by Grade
     elif method == 'GET' and (path.endswith('/curriculum') or path == 'curriculum'):
         grade = query_params.get('grade')
@@ -159,25 +194,13 @@ def lambda_handler(event, context):
         subj = body.get('subjectName')
         curr = body.get('curriculum')
 
-        user_res = user_table.get_item(Key={'email': email})
-        user = user_res.get('Item', {})
-        if subj in user.get('subjects', []):
-            return build_response(400, {"error": "Already enrolled in this subject"})
+        if not email or not subj or not curr:
+            return build_response(400, {"error": "email, subjectName and curriculum required"})
 
-        user_table.update_item(
-            Key={'email': email},
-            UpdateExpression="SET subjects = list_append(if_not_exists(subjects, :empty_list), :s)",
-            ExpressionAttributeValues={
-                ':s': [subj],
-                ':empty_list': []
-            }
-        )
-        
-        subject_table.update_item(
-            Key={'curriculum': curr, 'subjectName': subj},
-            UpdateExpression="ADD studentCount :inc",
-            ExpressionAttributeValues={':inc': 1}
-        )
+        try:
+            enroll(email, subj, curr)
+        except AlreadyEnrolled:
+            return build_response(400, {"error": "Already enrolled in this subject"})
         
         return build_response(200, {"message": "Enrolled successfully"})
 
@@ -233,13 +256,29 @@ def lambda_handler(event, context):
 
     # UPLOAD PROFILE PICTURE
     elif method == 'POST' and (path.endswith('/profile/picture') or '/profile/picture' in path):
-        body = json.loads(event.get('body', '{}'))
-        email = body.get('email')
-        picture_data = body.get('profilePicture') # Base64 string
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        if is_binary_upload(headers.get('content-type', '')):
+            # Raw image body: API Gateway hands it over already base64-encoded, so reuse
+            # that string as-is and only decode the leading bytes to sniff the type
+            email = query_params.get('email')
+            encoded = event.get('body') or ''
+            if not event.get('isBase64Encoded'):
+                encoded = base64.b64encode(encoded.encode('latin-1')).decode('ascii')
+            picture_data = None
+            if encoded:
+                mime = sniff_mime(base64.b64decode(encoded[:24]))
+                picture_data = f"data:{mime};base64,{encoded}"
+        else:
+            body = json.loads(event.get('body', '{}'))
+            email = body.get('email')
+            picture_data = body.get('profilePicture') # Base64 string
 
         if not email or not picture_data:
             return build_response(400, {"error": "email and profilePicture required"})
 
+        if len(picture_data) * 3 // 4 > PROFILE_PICTURE_MAX_BYTES:
+            return build_response(413, {"error": f"profilePicture exceeds {PROFILE_PICTURE_MAX_BYTES} bytes"})
+
         user_table.update_item(
             Key={'email': email},
             UpdateExpression="SET profilePicture = :p",
@@ -316,32 +355,33 @@ def lambda_handler(event, context):
             
             # Fetch ATP context
             topic_context = ""
-            subtopic_context = ""
             topic_name = topic_id
             subtopic_name = ""
+            opener = None
 
             try:
                 # 1. Fetch Topic Level
                 topic_resp = topics_table.get_item(Key={'topicId': topic_id})
                 topic_data = topic_resp.get('Item', {})
-                topic_name = topic_data.get('topicName', topic_id)
-                topic_context = topic_data.get('context', '')
                 
                 # 2. Fetch Subtopic Level (if provided)
+                st_data = {}
                 if subtopic_id:
                     st_resp = subtopics_table.get_item(Key={'subtopicId': subtopic_id})
                     st_data = st_resp.get('Item', {})
-                    subtopic_name = st_data.get('subtopicName', '')
-                    subtopic_context = st_data.get('context', '')
                     
-                    # Merge context for AI
-                    topic_context = f"Topic: {topic_name}\nSubtopic: {subtopic_name}\n\nTerm/Main Context: {topic_context}\n\nSpecific Focus: {subtopic_context}"
+                # Merge context for AI
+                topic_name, subtopic_name, topic_context = lesson_context(topic_id, topic_data, subtopic_id, st_data)
                     
             except Exception as e:
                 print(f"Warning: Could not fetch context: {e}")
             
-            # Context-aware welcome is now generated by AI, so we initiate with a system instruction mostly
-            # But we serve the valid context to the Frontend to display or use.
+            try:
+                # Opening explanation pre-generated for this exact context (pregenerate_openers.py)
+                opener = get_opener(openers_table, topic_id, subtopic_id, opener_version(topic_name, topic_context))
+            except Exception as e:
+                print(f"Warning: Could not fetch lesson opener: {e}")
+            add_metric("opener_hit", 1 if opener else 0)
             
             lesson = {
                 'lessonId': f"L_{os.urandom(4).hex()}",
@@ -354,8 +394,11 @@ def lambda_handler(event, context):
                 'grade': grade,
                 'topicContext': topic_context,
                 'status': 'teaching',
-                'history': [] # AI generates first message now
+                # Pre-generated opener when there is one; otherwise the AI opens on the first message
+                'history': [{'role': 'ai', 'content': opener, 'opener': True}] if opener else []
             }
+            # Render the tutor instruction once; /chat-stream reuses it as-is
+            lesson.update(build_prompt_fields(subject_name, grade, topic_name, topic_context))
             lesson_table.put_item(Item=lesson)
             return build_response(200, lesson)
 
@@ -363,10 +406,20 @@ def lambda_handler(event, context):
             l_id = body.get('lessonId')
             user_msg = body.get('message')
             ai_response = body.get('aiResponse')
+            turn_id = body.get('turnId')
+            
+            messages = turn_messages(user_msg, ai_response)
             
-            messages = [{'role': 'user', 'content': user_msg}]
-            if ai_response:
-                messages.append({'role': 'ai', 'content': ai_response})
+            if turn_id:
+                # Same turn the Gemini Lambda writes behind; whichever lands second is a no-op
+                position = body.get('position')
+                result = append_turn(lesson_table, l_id, turn_id, messages,
+                                     int(position) if position is not None else None)
+                if result == PENDING:
+                    # An earlier turn is still in flight; the Gemini Lambda's write-behind
+                    # places this one at its position once it lands
+                    return build_response(202, {"message": "Queued", "result": result})
+                return build_response(200, {"message": "Stored", "result": result})
             
             lesson_table.update_item(
                 Key={'lessonId': l_id},
@@ -423,14 +476,85 @@ def lambda_handler(event, context):
 
     return build_response(404, {"error": "Not Found"})
 
+class AlreadyEnrolled(Exception):
+    pass
+
+
+def enroll(email, subj, curr, migrate=True):
+    """
+    Add `subj` to the learner's `subjects` string set and bump the subject's
+    studentCount in one TransactWriteItems; the condition makes a second
+    (or concurrent) enrollment in the same subject fail instead of duplicating.
+    """
+    client = dynamodb.meta.client  # The resource's client: plain Python values, serialised for us
+    try:
+        client.transact_write_items(TransactItems=[
+            {'Update': {
+                'TableName': user_table.name,
+                'Key': {'email': email},
+                'UpdateExpression': "ADD subjects :s",
+                'ConditionExpression': "attribute_not_exists(subjects) OR NOT contains(subjects, :subj)",
+                'ExpressionAttributeValues': {':s': {subj}, ':subj': subj},
+            }},
+            {'Update': {
+                'TableName': subject_table.name,
+                'Key': {'curriculum': curr, 'subjectName': subj},
+                'UpdateExpression': "ADD studentCount :inc",
+                'ExpressionAttributeValues': {':inc': 1},
+            }},
+        ])
+    except client.exceptions.TransactionCanceledException as e:
+        codes = [r.get('Code') for r in e.response.get('CancellationReasons', [])]
+        if codes and codes[0] == 'ConditionalCheckFailed':
+            raise AlreadyEnrolled()
+        # Otherwise most likely a legacy list-typed `subjects` (ADD needs a set)
+        if not migrate or not migrate_subjects(email):
+            raise
+        enroll(email, subj, curr, migrate=False)
+    except client.exceptions.ClientError as e:
+        # ADD on a legacy list-typed `subjects` is rejected before the transaction runs
+        if not migrate or e.response['Error']['Code'] != 'ValidationException' or not migrate_subjects(email):
+            raise
+        enroll(email, subj, curr, migrate=False)
+
+
+def migrate_subjects(email):
+    """
+    One-off conversion of a legacy `subjects` list to a string set. True if
+    `subjects` is now a set (converted here or by a concurrent request), so the
+    enrollment is worth retrying; False if the failure had another cause.
+    """
+    user = user_table.get_item(Key={'email': email}, ProjectionExpression='subjects').get('Item', {})
+    subjects = user.get('subjects')
+    if isinstance(subjects, set):
+        return True
+    if not isinstance(subjects, list):
+        return False
+    expression = "REMOVE subjects" if not subjects else "SET subjects = :ss"
+    values = {':old': subjects}
+    if subjects:
+        values[':ss'] = set(subjects)
+    try:
+        user_table.update_item(
+            Key={'email': email},
+            UpdateExpression=expression,
+            ConditionExpression="subjects = :old",
+            ExpressionAttributeValues=values
+        )
+    except user_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass  # Someone else migrated or changed it; the retry will see the new value
+    return True
+
+
 def build_response(status, body):
+    with span("serialize"):
+        payload = json_codec.dumps(body)
+    add_metric("response_bytes", len(payload))
     return {
         'statusCode': status,
         'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+            **cors_headers(),
             'Content-Type': 'application/json'
         },
-        'body': json.dumps(body, cls=DecimalEncoder)
+        'body': payload
     }
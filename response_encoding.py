@@ -0,0 +1,191 @@
+"""
+HTTP response negotiation for the API Gateway (REST, proxy) Lambda.
+Large JSON bodies are compressed according to Accept-Encoding (brotli when
+the module is installed, else gzip) and returned base64-encoded with
+isBase64Encoded so API Gateway sends the raw bytes. Successful GETs carry a
+strong ETag per representation (the entity's tag, plus "-gzip"/"-br" when the
+body is compressed) and answer If-None-Match with any current one with 304.
+
+Curriculum data only changes on reseed, so with CURRICULUM_SEED_VERSION set
+its ETag comes from the seed version and the request path; a revalidation is
+answered before any DynamoDB read. Other ETags hash the serialised body.
+
+Config (environment):
+    COMPRESS_MIN_BYTES       smallest body worth compressing
+    GZIP_LEVEL / BROTLI_QUALITY
+    CURRICULUM_SEED_VERSION  version of the seeded ATP data ("" = hash bodies)
+"""
+
+import os
+import gzip
+import base64
+import hashlib
+from image_ingest import is_binary_upload
+from instrumentation import span, add_metric, current
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+CURRICULUM_SEED_VERSION = os.environ.get("CURRICULUM_SEED_VERSION", "")
+
+# GET routes whose content only changes when the curriculum is reseeded
+SEED_VERSIONED_PATHS = ("/grades", "/curriculum", "/curriculum/topics", "/curriculum/search")
+
+
+def header(event: dict, name: str) -> str:
+    """Case-insensitive request header lookup."""
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ""
+    return ""
+
+
+def choose_encoding(accept_encoding: str):
+    """Pick br or gzip from an Accept-Encoding header (honouring q=0), or None."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # Fixed mtime: the same body must compress to the same bytes under a strong ETag
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def content_etag(payload: str) -> str:
+    return '"' + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def encoded_etag(etag: str, encoding) -> str:
+    """ETag of one representation: the entity tag with its content coding appended."""
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def seed_etag(event: dict):
+    """ETag for seed-versioned routes, derived without reading the data; None if not applicable."""
+    if not CURRICULUM_SEED_VERSION:
+        return None
+    path = str(event.get('path', '')).lower().rstrip('/')
+    if not path.endswith(SEED_VERSIONED_PATHS):
+        return None
+    query = "&".join(f"{k}={v}" for k, v in sorted((event.get('queryStringParameters') or {}).items()))
+    digest = hashlib.sha256(f"{path}?{query}".encode("utf-8")).hexdigest()[:16]
+    return f'"seed-{CURRICULUM_SEED_VERSION}-{digest}"'
+
+
+def matching_etag(if_none_match: str, etag: str):
+    """
+    The If-None-Match tag naming a current representation of the entity tagged
+    `etag` (identity, gzip or br), or None. A cache holding any of them is fresh.
+    """
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return etag
+    current = {encoded_etag(etag, encoding) for encoding in (None, "gzip", "br")}
+    # Intermediaries may weaken our tags; the prefix doesn't change what they name
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag in current:
+            return tag
+    return None
+
+
+def not_modified(response_headers: dict, etag: str) -> dict:
+    headers = {k: v for k, v in response_headers.items() if k != 'Content-Type'}
+    headers.update({'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'})
+    return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+
+def decode_request_body(event: dict):
+    """
+    The REST API treats every media type as binary (so responses can be), which
+    means JSON request bodies arrive base64-encoded too; turn them back into text.
+    Image uploads are left encoded for the picture route.
+    """
+    if event.get('isBase64Encoded') and event.get('body') and not is_binary_upload(header(event, 'content-type')):
+        event['body'] = base64.b64decode(event['body']).decode('utf-8')
+        event['isBase64Encoded'] = False
+
+
+def negotiate(event: dict, response: dict) -> dict:
+    """ETag/304 and compression for one handler response."""
+    method = str(event.get('httpMethod', '')).upper()
+    if not isinstance(response, dict) or response.get('isBase64Encoded') or not isinstance(response.get('body'), str):
+        return response
+    headers = response.setdefault('headers', {})
+    payload = response['body']
+    raw = payload.encode("utf-8")
+    encoding = choose_encoding(header(event, 'accept-encoding')) if len(raw) >= COMPRESS_MIN_BYTES else None
+
+    if method == 'GET' and response.get('statusCode') == 200:
+        etag = seed_etag(event) or content_etag(payload)
+        matched = matching_etag(header(event, 'if-none-match'), etag)
+        if matched:
+            add_metric("not_modified", 1)
+            return not_modified(headers, matched)
+        headers['ETag'] = encoded_etag(etag, encoding)
+        headers['Cache-Control'] = 'no-cache'
+
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding is None:
+        add_metric("response_bytes_sent", len(raw))
+        return response
+
+    with span("compress", encoding=encoding):
+        body = compress(raw, encoding)
+    add_metric("response_bytes_sent", len(body))
+    metrics = current()
+    if metrics is not None:
+        metrics.properties['contentEncoding'] = encoding
+    headers['Content-Encoding'] = encoding
+    response['body'] = base64.b64encode(body).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+
+def negotiated(fn):
+    """Decorator for API Gateway proxy handlers: body decoding, early seed 304s, compression."""
+    def handler(event, context):
+        decode_request_body(event)
+        if str(event.get('httpMethod', '')).upper() == 'GET':
+            etag = seed_etag(event)
+            matched = etag and matching_etag(header(event, 'if-none-match'), etag)
+            if matched:
+                add_metric("not_modified", 1)
+                return not_modified(cors_headers(), matched)
+        return negotiate(event, fn(event, context))
+    handler.__name__ = fn.__name__
+    handler.__doc__ = fn.__doc__
+    return handler
+
+
+def cors_headers() -> dict:
+    return {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    }
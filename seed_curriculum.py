@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 """
 Seed DynamoDB tables with extracted ATP curriculum data.
-Transforms extracted_atp_data.json into Curriculum, Topics, and Subtopics tables.
+Transforms extracted_atp_data.json into Curriculum, Topics, and Subtopics tables,
+and writes the matching search index (curriculum_index.json) for /curriculum/search.
 Requires AWS credentials configured (uses 'capaciti' profile by default).
+
+Usage: python seed_curriculum.py [--index-only]
 """
 
 import os
+import sys
 import json
 import boto3
 from botocore.config import Config
+import curriculum_search
 
 # AWS Configuration
 AWS_PROFILE = os.environ.get("AWS_PROFILE", "capaciti")
@@ -200,6 +205,14 @@ def main():
     print(f"  - Topic entries: {len(data['topics'])}")
     print(f"  - Subtopic entries: {len(data['subtopics'])}")
     
+    # Search index for the same data (ships with the profile Lambda; redeploy after reseeding)
+    print("\nBuilding search index...")
+    built = curriculum_search.write_index(data, version=curriculum_search.data_version(data_file))
+    print(f"  - {built['docs']} topics, {built['tokens']} tokens, {built['bytes'] / 1024:.0f} KB "
+          f"-> {curriculum_search.CURRICULUM_INDEX_FILE}")
+    if "--index-only" in sys.argv:
+        return
+    
     # Connect to DynamoDB
     print("\nConnecting to DynamoDB...")
     dynamodb = get_dynamodb_client()
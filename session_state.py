@@ -0,0 +1,234 @@
+"""
+Chat-session state shared by every Gemini Lambda container.
+
+Without it a lesson's first message on a container that has not seen it
+(scale-out, a recycled container) rebuilds the chat from Lessons: the whole
+item is read (GetItem bills for all of it, generated quiz/test and results
+included) and the transcript comes back as DynamoDB-typed JSON. After each
+completed turn the container now stores the session in the SessionState table
+as one compact blob: the transcript, the rendered system instruction, its
+prompt hash, the lesson's topicId and its Gemini context caches. Another
+container rehydrates from that single small item and falls back to Lessons
+when it is missing, expired, too large or written in another format.
+
+Blob layout: one format byte, then zlib-compressed JSON with short keys
+(roles "u"/"a"). FORMAT_VERSION changes whenever the layout does; old blobs
+are ignored and the session is rebuilt from Lessons once.
+
+Each state carries the id of the turn it ends with (`turnId`). A container
+remembers the turnId of the state its session continues, and a save replaces
+the stored state only while it still has that turnId (compare-and-swap). A
+container whose session fell behind therefore cannot overwrite a newer state:
+its save fails and its session is discarded (on_conflict). Before answering
+from a session kept in memory, is_current() compares the stored turnId with
+the remembered one, so a session that another container has moved on is
+rebuilt from the shared state first.
+
+Config (environment):
+    SESSION_STATE_TABLE         DynamoDB table for the shared tier ("" = off, rebuild from Lessons)
+    SESSION_STATE_TTL_SECONDS   how long an idle session's state is kept
+    SESSION_STATE_MAX_BYTES     larger states are not stored (DynamoDB items are capped at 400 KB)
+"""
+
+import os
+import json
+import time
+import zlib
+import asyncio
+from collections import namedtuple
+import lesson_store
+from instrumentation import add_metric
+
+SESSION_STATE_TABLE = os.environ.get("SESSION_STATE_TABLE", "")
+SESSION_STATE_TTL_SECONDS = int(os.environ.get("SESSION_STATE_TTL_SECONDS", str(24 * 3600)))
+SESSION_STATE_MAX_BYTES = int(os.environ.get("SESSION_STATE_MAX_BYTES", str(350 * 1024)))
+
+FORMAT_VERSION = 1
+
+ROLES = {"user": "u", "ai": "a"}
+ROLE_NAMES = {code: role for role, code in ROLES.items()}
+
+SessionState = namedtuple("SessionState", "history system_instruction context_hash topic_id context_caches")
+
+stats = {"saved": 0, "loaded": 0, "misses": 0, "stale_format": 0, "too_large": 0, "conflicts": 0,
+         "stale_sessions": 0, "bytes_written": 0, "bytes_read": 0}
+
+
+def encode(state: SessionState) -> bytes:
+    payload = {
+        "h": [[ROLES.get(m['role'], "a"), m['content']] for m in state.history],
+        "s": state.system_instruction,
+        "k": state.context_hash,
+        "t": state.topic_id,
+        "c": state.context_caches or {},
+    }
+    body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=int).encode("utf-8")
+    return bytes([FORMAT_VERSION]) + zlib.compress(body, 6)
+
+
+def decode(blob: bytes):
+    """SessionState, or None for a blob in another format."""
+    if not blob or blob[0] != FORMAT_VERSION:
+        return None
+    payload = json.loads(zlib.decompress(blob[1:]).decode("utf-8"))
+    history = [{'role': ROLE_NAMES.get(role, 'ai'), 'content': content} for role, content in payload["h"]]
+    return SessionState(history, payload.get("s"), payload.get("k"), payload.get("t"), payload.get("c") or {})
+
+
+class SessionStore:
+    """
+    Get/put of encoded session states in the shared table (table=None disables it).
+
+    Args:
+        table: SessionState table (sessionKey, state, turnId, position, expiresAt)
+        on_conflict: lesson_id -> None, called when a save finds a newer state stored
+            (this container's session is behind and must not be used again)
+    """
+
+    def __init__(self, table=None, on_conflict=None):
+        self.table = table
+        self.on_conflict = on_conflict
+        self.versions = {}  # lesson_id -> turnId of the stored state this container's session continues
+        self.tasks = set()
+        self._writes = {}   # lesson_id -> last queued write (writes per lesson run in order)
+
+    async def load(self, lesson_id: str):
+        """The lesson's stored SessionState, or None (rebuild from Lessons)."""
+        if self.table is None:
+            return None
+        await self._settled(lesson_id)
+        try:
+            item = (await lesson_store.run(self.table.get_item, Key={'sessionKey': lesson_id})).get('Item')
+        except Exception as e:
+            print(f"Warning: Session state lookup for {lesson_id} failed: {e}")
+            return None
+        # Whatever is stored (even expired or in another format) is what the next save replaces
+        self.versions[lesson_id] = item.get('turnId') if item else None
+        if item is None or int(item.get('expiresAt', 0)) < time.time():
+            stats["misses"] += 1
+            return None
+        blob = bytes(getattr(item['state'], 'value', item['state']))
+        stats["bytes_read"] += len(blob)
+        add_metric("session_state_bytes", len(blob))
+        try:
+            state = decode(blob)
+        except Exception as e:
+            print(f"Warning: Unreadable session state for {lesson_id}: {e}")
+            state = None
+        if state is None:
+            stats["stale_format"] += 1
+            return None
+        stats["loaded"] += 1
+        return state
+
+    async def is_current(self, lesson_id: str) -> bool:
+        """Whether the stored state is still the one this container's session continues."""
+        if self.table is None:
+            return True
+        await self._settled(lesson_id)
+        try:
+            item = (await lesson_store.run(
+                self.table.get_item,
+                Key={'sessionKey': lesson_id},
+                ProjectionExpression="turnId",
+            )).get('Item')
+        except Exception as e:
+            print(f"Warning: Session state check for {lesson_id} failed: {e}")
+            return True
+        if (item or {}).get('turnId') == self.versions.get(lesson_id):
+            return True
+        stats["stale_sessions"] += 1
+        return False
+
+    def save(self, lesson_id: str, state: SessionState, turn_id: str = None):
+        """
+        Store the state (ending with turn `turn_id`; None: the turn the stored state
+        already ends with) in the background; the turn has already been answered.
+        Replaces only the state this container's session continues.
+        """
+        if self.table is None:
+            return
+        self._queue(lesson_id, self._put(lesson_id, state, turn_id))
+
+    def drop(self, lesson_id: str):
+        """Forget the stored state, so the next rebuild reads Lessons (e.g. after an aborted turn)."""
+        self.versions.pop(lesson_id, None)
+        if self.table is None:
+            return
+        self._queue(lesson_id, self._delete(lesson_id))
+
+    async def flush(self, timeout: float = None):
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=timeout)
+
+    def _queue(self, lesson_id: str, coro):
+        previous = self._writes.get(lesson_id)
+
+        async def run_after():
+            if previous is not None:
+                await asyncio.wait([previous])
+            await coro
+
+        task = asyncio.ensure_future(run_after())
+        self._writes[lesson_id] = task
+        self.tasks.add(task)
+
+        def done(t):
+            self.tasks.discard(t)
+            if self._writes.get(lesson_id) is t:
+                del self._writes[lesson_id]
+        task.add_done_callback(done)
+
+    async def _settled(self, lesson_id: str):
+        """Wait for this container's queued writes for the lesson, so versions is up to date."""
+        pending = self._writes.get(lesson_id)
+        if pending is not None:
+            await asyncio.wait([pending])
+
+    async def _put(self, lesson_id: str, state: SessionState, turn_id: str = None):
+        base = self.versions.get(lesson_id)
+        turn_id = turn_id or base
+        if turn_id is None:
+            return  # Nothing stored to update
+        blob = encode(state)
+        if len(blob) > SESSION_STATE_MAX_BYTES:
+            stats["too_large"] += 1
+            await self._delete(lesson_id)
+            self.versions[lesson_id] = None
+            return
+        if base is None:
+            condition = {'ConditionExpression': "attribute_not_exists(sessionKey)"}
+        else:
+            condition = {'ConditionExpression': "turnId = :base", 'ExpressionAttributeValues': {':base': base}}
+        try:
+            await lesson_store.run(
+                self.table.put_item,
+                Item={
+                    'sessionKey': lesson_id,
+                    'state': blob,
+                    'turnId': turn_id,
+                    'position': len(state.history),
+                    'expiresAt': int(time.time()) + SESSION_STATE_TTL_SECONDS,
+                },
+                **condition,
+            )
+            self.versions[lesson_id] = turn_id
+            stats["saved"] += 1
+            stats["bytes_written"] += len(blob)
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            # Another container answered from a newer transcript: ours is behind, don't use it again
+            stats["conflicts"] += 1
+            add_metric("session_state_conflicts", 1)
+            self.versions.pop(lesson_id, None)
+            if self.on_conflict:
+                self.on_conflict(lesson_id)
+        except Exception as e:
+            print(f"Warning: Session state save for {lesson_id} failed: {e}")
+            await self._delete(lesson_id)
+            self.versions[lesson_id] = None
+
+    async def _delete(self, lesson_id: str):
+        try:
+            await lesson_store.run(self.table.delete_item, Key={'sessionKey': lesson_id})
+        except Exception as e:
+            print(f"Warning: Session state delete for {lesson_id} failed: {e}")
@@ -0,0 +1,205 @@
+"""
+Request coalescing for expensive, idempotent generations.
+Concurrent duplicates inside a container share one in-flight call
+(SingleFlight); duplicates landing on other containers are collapsed by a
+conditional-write lease on the Lessons item (LessonLease), whose holder
+stores the result for everyone else to pick up. A result stored for the same
+key within the last lease period is returned as is, so a retry or double-click
+just after the generation finished does not call the model again; a later
+request for a new quiz/test generates a new one.
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from decimal import Decimal
+from instrumentation import add_metric
+
+GENERATION_LEASE_SECONDS = int(os.environ.get("GENERATION_LEASE_SECONDS", "90"))
+LEASE_POLL_SECONDS = float(os.environ.get("LEASE_POLL_SECONDS", "0.5"))
+
+# Identifies this container as a lease owner
+CONTAINER_ID = os.urandom(6).hex()
+
+
+def generation_key(endpoint: str, lesson_id: str, history: list) -> str:
+    """Stable key for (endpoint, lesson, transcript): a new chat turn means a new generation."""
+    digest = hashlib.sha256(json.dumps(history, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return f"{endpoint}#{lesson_id}#{digest}"
+
+
+class LessonNotFound(LookupError):
+    """The lesson a generation was requested for does not exist."""
+
+
+def dynamo_safe(value):
+    """Round-trip model JSON so floats become Decimals (boto3 rejects float)."""
+    return json.loads(json.dumps(value), parse_float=Decimal)
+
+
+class SingleFlight:
+    """In-process: callers with the same key await one shared call."""
+
+    def __init__(self):
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        """Run `await fn()` once per key at a time; concurrent callers get the same result or error."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            add_metric("singleflight_coalesced", 1)
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        # Mark the outcome as retrieved even if nobody else ended up waiting
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
+
+
+class LessonLease:
+    """
+    Cross-container: a short lease stored on the Lessons item, per result attribute.
+
+    Attributes used for result attribute `generatedTest`:
+        generatedTestLease  {key, owner, expiresAt} while a container is generating
+        generatedTestKey    generation key the stored result belongs to
+        generatedTestAt     when it was stored (epoch seconds); reused for `ttl` seconds
+    """
+
+    def __init__(self, store, result_attr: str, ttl: int = None):
+        self.store = store  # lesson_store.LessonStore
+        self.result_attr = result_attr
+        self.lease_attr = f"{result_attr}Lease"
+        self.key_attr = f"{result_attr}Key"
+        self.at_attr = f"{result_attr}At"
+        self.ttl = ttl or GENERATION_LEASE_SECONDS
+
+    def stored(self, item: dict, key: str):
+        """The result stored on a Lessons item for `key` within the last lease period, or None."""
+        if (item.get(self.key_attr) == key and self.result_attr in item
+                and int(item.get(self.at_attr, 0)) >= time.time() - self.ttl):
+            return item[self.result_attr]
+        return None
+
+    async def acquire(self, lesson_id: str, key: str) -> bool:
+        """
+        Take the lease unless another live holder has it, the result for `key` was
+        stored within the last lease period, or the lesson does not exist (no
+        lease-only item is created).
+        """
+        now = int(time.time())
+        try:
+            await self.store.update(
+                lesson_id,
+                UpdateExpression="SET #l = :lease",
+                ConditionExpression=("attribute_exists(lessonId) "
+                                     "AND (attribute_not_exists(#k) OR #k <> :key OR attribute_not_exists(#a) "
+                                     "OR #a < :fresh) "
+                                     "AND (attribute_not_exists(#l) OR #l.expiresAt < :now OR #l.#o = :owner)"),
+                ExpressionAttributeNames={'#l': self.lease_attr, '#k': self.key_attr, '#a': self.at_attr,
+                                          '#o': 'owner'},
+                ExpressionAttributeValues={
+                    ':lease': {'key': key, 'owner': CONTAINER_ID, 'expiresAt': now + self.ttl},
+                    ':key': key,
+                    ':fresh': now - self.ttl,
+                    ':now': now,
+                    ':owner': CONTAINER_ID,
+                }
+            )
+            return True
+        except self.store.exceptions.ConditionalCheckFailedException:
+            return False
+
+    async def release(self, lesson_id: str):
+        """Drop our lease (e.g. after a failed generation) so waiters can take over."""
+        try:
+            await self.store.update(
+                lesson_id,
+                UpdateExpression="REMOVE #l",
+                ConditionExpression="#l.#o = :owner",
+                ExpressionAttributeNames={'#l': self.lease_attr, '#o': 'owner'},
+                ExpressionAttributeValues={':owner': CONTAINER_ID}
+            )
+        except self.store.exceptions.ConditionalCheckFailedException:
+            pass
+
+    async def save(self, lesson_id: str, key: str, result):
+        """Persist the result under its key and release the lease in the same write."""
+        await self.store.update(
+            lesson_id,
+            UpdateExpression="SET #r = :r, #k = :k, #a = :a REMOVE #l",
+            ExpressionAttributeNames={'#r': self.result_attr, '#k': self.key_attr, '#a': self.at_attr,
+                                      '#l': self.lease_attr},
+            ExpressionAttributeValues={':r': result, ':k': key, ':a': int(time.time())}
+        )
+
+    async def wait_for_result(self, lesson_id: str, key: str):
+        """
+        Poll until the lease holder stores a result for `key` (checked straight
+        away first: acquire also fails when it is already stored).
+
+        Returns:
+            (result, None) when another container produced it, or
+            (None, True) once the holder vanished and we acquired the lease ourselves
+
+        Raises:
+            LessonNotFound: the lesson does not exist
+        """
+        deadline = time.monotonic() + self.ttl
+        while time.monotonic() < deadline:
+            item = await self.store.get(lesson_id, ['lessonId', self.result_attr, self.key_attr, self.at_attr,
+                                                    self.lease_attr], consistent=True)
+            if not item:
+                raise LessonNotFound(lesson_id)
+            result = self.stored(item, key)
+            if result is not None:
+                return result, None
+            lease = item.get(self.lease_attr)
+            if (not lease or int(lease.get('expiresAt', 0)) < time.time()) and await self.acquire(lesson_id, key):
+                return None, True
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+        # Holder is still alive past a full lease period; generate anyway rather than fail
+        return None, await self.acquire(lesson_id, key)
+
+
+async def generate_once(flights: SingleFlight, lease: LessonLease, lesson_id: str, key: str, produce,
+                        item: dict = None):
+    """
+    Produce a result for `key` at most once across concurrent callers and containers.
+    `produce` is an async callable returning the result; it is stored via the lease.
+    `item` is the Lessons item the caller already read: a result stored on it for
+    `key` within the last lease period is returned without taking the lease.
+    """
+    stored = lease.stored(item or {}, key)
+    if stored is not None:
+        add_metric("generation_reused", 1)
+        return stored
+
+    async def leader():
+        if not await lease.acquire(lesson_id, key):
+            add_metric("lease_waits", 1)
+            result, _ = await lease.wait_for_result(lesson_id, key)
+            if result is not None:
+                return result
+        try:
+            result = await produce()
+        except BaseException:
+            await lease.release(lesson_id)
+            raise
+        await lease.save(lesson_id, key, dynamo_safe(result))
+        return result
+
+    return await flights.do(key, leader)
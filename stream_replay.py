@@ -0,0 +1,309 @@
+"""
+Resumable /chat-stream responses.
+
+Every SSE frame of a turn gets an id "<turnId>:<seq>". The turn is produced
+by a background task into a per-turn buffer, and the HTTP response only
+follows that buffer. So a dropped connection doesn't stop the generation (or
+the write-behind of the turn), and a reconnect carrying `Last-Event-ID`
+replays the frames after that id and then keeps following live ones, instead
+of starting a new Gemini generation and a duplicate turn.
+
+Buffers live in process. They are bounded by count and total bytes (finished
+streams are evicted oldest first; live ones never) and expire REPLAY_TTL_SECONDS
+after their last frame. With REPLAY_TABLE set, streams are also checkpointed to
+DynamoDB, so a reconnect that lands on another container can replay them too.
+Each checkpoint writes only the frames added since the previous one, as a chunk
+item "<turnId>#<n>", plus a small head item "<turnId>" with the chunk count and
+whether the stream is done, so write units grow linearly with the stream.
+
+A stream whose last follower went away (the client disconnected, or a send
+failed) is given STREAM_ABORT_GRACE_SECONDS to reconnect; after that the
+producer is cancelled, which stops the upstream Gemini stream, and the stream
+ends with an "interrupted" frame. Followers on other containers don't count,
+so a cross-container resume only sees frames produced before the abort.
+While a follower waits for the next frame it gets an SSE comment every
+STREAM_HEARTBEAT_SECONDS, so idle proxies don't cut long pauses.
+
+Config (environment):
+    REPLAY_TTL_SECONDS         how long a stream stays replayable after its last frame
+    REPLAY_MAX_STREAMS         buffered streams per container
+    REPLAY_MAX_BYTES           buffered frame bytes per container
+    REPLAY_TABLE               DynamoDB table for the shared tier ("" = off)
+    REPLAY_CHECKPOINT_SECONDS  shared-tier copy interval while a stream is live
+    REPLAY_POLL_SECONDS        shared-tier poll interval when following a remote live stream
+    STREAM_ABORT_GRACE_SECONDS time a stream may run with no follower before it is aborted (-1 = never)
+    STREAM_HEARTBEAT_SECONDS   keep-alive comment interval while waiting for frames (0 = off)
+"""
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+import lesson_store
+from gemini_policy import FIRST_CHUNK_SECONDS, STALL_SECONDS
+from instrumentation import add_metric
+
+REPLAY_TTL_SECONDS = int(os.environ.get("REPLAY_TTL_SECONDS", "300"))
+REPLAY_MAX_STREAMS = int(os.environ.get("REPLAY_MAX_STREAMS", "200"))
+REPLAY_MAX_BYTES = int(os.environ.get("REPLAY_MAX_BYTES", str(16 * 1024 * 1024)))
+REPLAY_TABLE = os.environ.get("REPLAY_TABLE", "")
+REPLAY_CHECKPOINT_SECONDS = float(os.environ.get("REPLAY_CHECKPOINT_SECONDS", "1.0"))
+REPLAY_POLL_SECONDS = float(os.environ.get("REPLAY_POLL_SECONDS", "0.5"))
+STREAM_ABORT_GRACE_SECONDS = float(os.environ.get("STREAM_ABORT_GRACE_SECONDS", "5"))
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", "15"))
+
+# DynamoDB items are capped at 400 KB; a stream with a larger chunk stops being shared
+SHARED_MAX_BYTES = 350 * 1024
+
+# Longest a live producer can go without a frame (so without a checkpoint): a
+# remote follower that sees nothing new for longer gives up
+SHARED_IDLE_SECONDS = max(10 * REPLAY_CHECKPOINT_SECONDS, FIRST_CHUNK_SECONDS, STALL_SECONDS)
+
+# SSE comment (ignored by clients) and the last frame of an aborted stream
+HEARTBEAT = ": keep-alive\n\n"
+INTERRUPTED = 'data: {"interrupted": true}\n\n'
+
+stats = {"streams": 0, "resumed": 0, "resumed_shared": 0, "misses": 0, "evicted": 0, "checkpoints": 0,
+         "disconnects": 0, "aborted": 0, "heartbeats": 0}
+
+
+def event_id(turn_id: str, seq: int) -> str:
+    return f"{turn_id}:{seq}"
+
+
+def parse_event_id(value: str):
+    """(turn_id, seq) from a Last-Event-ID header, or None."""
+    turn_id, sep, seq = (value or "").strip().rpartition(":")
+    if not sep or not turn_id or not seq.isdigit():
+        return None
+    return turn_id, int(seq)
+
+
+def with_id(turn_id: str, seq: int, frame: str) -> str:
+    return f"id: {event_id(turn_id, seq)}\n{frame}"
+
+
+class Stream:
+    """Frames of one turn, appended by the producer and read by any number of followers."""
+
+    def __init__(self, turn_id: str, lesson_id: str):
+        self.turn_id = turn_id
+        self.lesson_id = lesson_id
+        self.frames = []
+        self.size = 0
+        self.done = False
+        self.updated = time.monotonic()
+        self.task = None
+        self.followers = 0
+        self.aborted = False
+        self.shared = True       # Still checkpointed to the shared tier
+        self.checkpointed = 0    # Frames already written there
+        self.chunks = 0          # Chunk items written there
+        self.on_abandoned = None  # Called when the last follower leaves before the stream is done
+        self._changed = asyncio.Event()
+
+    def append(self, frame: str):
+        self.frames.append(frame)
+        self.size += len(frame)
+        self._touch()
+
+    def finish(self):
+        self.done = True
+        self._touch()
+
+    def expired(self, now: float) -> bool:
+        return self.done and now - self.updated > REPLAY_TTL_SECONDS
+
+    def _touch(self):
+        self.updated = time.monotonic()
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self, after: int = -1):
+        """SSE frames (with ids) after seq `after`, then live ones until the stream ends."""
+        seq = after + 1
+        self.followers += 1
+        try:
+            while True:
+                while seq < len(self.frames):
+                    yield with_id(self.turn_id, seq, self.frames[seq])
+                    seq += 1
+                if self.done:
+                    return
+                try:
+                    await asyncio.wait_for(self._changed.wait(), STREAM_HEARTBEAT_SECONDS or None)
+                except asyncio.TimeoutError:
+                    stats["heartbeats"] += 1
+                    yield HEARTBEAT
+        finally:
+            # Runs when the response finishes, is cancelled on disconnect, or its send fails
+            self.followers -= 1
+            if not self.followers and not self.done and self.on_abandoned:
+                self.on_abandoned(self)
+
+
+class ReplayBuffer:
+    def __init__(self, table=None):
+        self.table = table  # Optional shared tier (boto3 Table, e.g. a LazyTable)
+        self.streams = OrderedDict()
+
+    def open(self, turn_id: str, lesson_id: str, frames) -> Stream:
+        """Start producing `frames` (an async iterator of SSE frames) into a new replayable stream."""
+        self._evict()
+        stream = Stream(turn_id, lesson_id)
+        stream.on_abandoned = self._abandoned
+        self.streams[turn_id] = stream
+        stats["streams"] += 1
+        stream.task = asyncio.ensure_future(self._produce(stream, frames))
+        return stream
+
+    def get(self, turn_id: str):
+        stream = self.streams.get(turn_id)
+        if stream is not None and stream.expired(time.monotonic()):
+            del self.streams[turn_id]
+            return None
+        return stream
+
+    async def resume(self, last_event_id: str):
+        """Async iterator replaying from a Last-Event-ID, or None if the turn isn't buffered anywhere."""
+        parsed = parse_event_id(last_event_id)
+        if parsed is None:
+            return None
+        turn_id, seq = parsed
+        stream = self.get(turn_id)
+        if stream is not None:
+            stats["resumed"] += 1
+            add_metric("replay_resumed", 1)
+            return stream.follow(seq)
+        if self.table is not None:
+            item = await self._load(turn_id)
+            if item is not None and 'chunks' in item:  # A head, not a chunk item
+                stats["resumed_shared"] += 1
+                add_metric("replay_resumed_shared", 1)
+                return self._follow_shared(turn_id, seq, item)
+        stats["misses"] += 1
+        add_metric("replay_misses", 1)
+        return None
+
+    async def _produce(self, stream: Stream, frames):
+        last_checkpoint = time.monotonic()
+        try:
+            async for frame in frames:
+                stream.append(frame)
+                if (self.table is not None and REPLAY_CHECKPOINT_SECONDS > 0
+                        and time.monotonic() - last_checkpoint >= REPLAY_CHECKPOINT_SECONDS):
+                    last_checkpoint = time.monotonic()
+                    await self._checkpoint(stream)
+        except asyncio.CancelledError:
+            if not stream.aborted:
+                raise
+            stream.append(INTERRUPTED)
+        except Exception as e:
+            print(f"ERROR: Stream {stream.turn_id} producer failed: {e}")
+        finally:
+            stream.finish()
+            if self.table is not None:
+                await self._checkpoint(stream)
+
+    def _abandoned(self, stream: Stream):
+        """Last follower left mid-stream: abort it unless someone reconnects within the grace period."""
+        stats["disconnects"] += 1
+        add_metric("stream_disconnects", 1)
+        if STREAM_ABORT_GRACE_SECONDS >= 0 and stream.task is not None:
+            asyncio.get_running_loop().call_later(STREAM_ABORT_GRACE_SECONDS, self._abort_if_abandoned, stream)
+
+    def _abort_if_abandoned(self, stream: Stream):
+        if stream.followers or stream.done or stream.task.done():
+            return
+        print(f"INFO: Aborting stream {stream.turn_id} after {len(stream.frames)} frames (no client for {STREAM_ABORT_GRACE_SECONDS:.0f}s)")
+        stats["aborted"] += 1
+        stream.aborted = True
+        stream.task.cancel()
+
+    def _evict(self):
+        now = time.monotonic()
+        for turn_id in [t for t, s in self.streams.items() if s.expired(now)]:
+            del self.streams[turn_id]
+        total = sum(s.size for s in self.streams.values())
+        for turn_id in list(self.streams):
+            if len(self.streams) < REPLAY_MAX_STREAMS and total <= REPLAY_MAX_BYTES:
+                break
+            stream = self.streams[turn_id]
+            if stream.done:
+                total -= stream.size
+                del self.streams[turn_id]
+                stats["evicted"] += 1
+
+    # --- Shared tier ---
+
+    async def _checkpoint(self, stream: Stream):
+        """Write the frames added since the last checkpoint as a new chunk, then the head."""
+        if not stream.shared:
+            return
+        frames = stream.frames[stream.checkpointed:]
+        if not frames and not stream.done:
+            return
+        if sum(len(f) for f in frames) > SHARED_MAX_BYTES:
+            stream.shared = False
+            return
+        expires_at = int(time.time()) + REPLAY_TTL_SECONDS
+        chunks = stream.chunks + (1 if frames else 0)
+        try:
+            if frames:
+                await lesson_store.run(self.table.put_item, Item={
+                    'streamKey': f"{stream.turn_id}#{stream.chunks}",
+                    'frames': frames,
+                    'expiresAt': expires_at,
+                })
+            await lesson_store.run(self.table.put_item, Item={
+                'streamKey': stream.turn_id,
+                'lessonId': stream.lesson_id,
+                'chunks': chunks,
+                'done': stream.done,
+                'expiresAt': expires_at,
+            })
+            stream.checkpointed += len(frames)
+            stream.chunks = chunks
+            stats["checkpoints"] += 1
+        except Exception as e:
+            # Nothing advanced: the next checkpoint rewrites the same chunk with the newer frames too
+            print(f"Warning: Replay checkpoint for {stream.turn_id} failed: {e}")
+
+    async def _load(self, stream_key: str):
+        """A head or chunk item of the shared tier, or None if it is missing or expired."""
+        try:
+            item = (await lesson_store.run(self.table.get_item, Key={'streamKey': stream_key})).get('Item')
+        except Exception as e:
+            print(f"Warning: Replay lookup for {stream_key} failed: {e}")
+            return None
+        if item is None or int(item.get('expiresAt', 0)) < time.time():
+            return None
+        return item
+
+    async def _follow_shared(self, turn_id: str, after: int, head: dict):
+        """Replay a stream produced on another container, polling its head until it is done."""
+        seq = after + 1
+        frames = []  # Frames of the chunks read so far
+        chunks = 0
+        idle_since = last_sent = time.monotonic()
+        while True:
+            while chunks < int(head.get('chunks', 0)):
+                chunk = await self._load(f"{turn_id}#{chunks}")
+                if chunk is None:
+                    return
+                frames.extend(chunk.get('frames', []))
+                chunks += 1
+            if seq < len(frames):
+                idle_since = last_sent = time.monotonic()
+            while seq < len(frames):
+                yield with_id(turn_id, seq, frames[seq])
+                seq += 1
+            # Producer gone quiet for longer than it could go without a frame: stop rather than hang
+            if head.get('done') or time.monotonic() - idle_since > SHARED_IDLE_SECONDS:
+                return
+            if STREAM_HEARTBEAT_SECONDS and time.monotonic() - last_sent >= STREAM_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                stats["heartbeats"] += 1
+                yield HEARTBEAT
+            await asyncio.sleep(REPLAY_POLL_SECONDS)
+            head = await self._load(turn_id) or {'chunks': chunks, 'done': True}
@@ -0,0 +1,85 @@
+"""
+Concurrent enrollment in one subject, against moto DynamoDB: exactly one
+enroll() lands, every other one fails its condition check with AlreadyEnrolled.
+
+Usage: python -m pytest test_enroll.py
+"""
+
+import os
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "af-south-1")
+os.environ.setdefault("METRICS_SAMPLE_RATE", "0")
+
+THREADS = 16
+CURRICULUM = "CAPS"
+
+
+@pytest.fixture
+def profile_handler(monkeypatch):
+    """profile_handler on empty tables, with each moto item operation applied atomically as DynamoDB does."""
+    from moto.dynamodb.models import DynamoDBBackend
+    from bench_harness import create_tables
+
+    lock = threading.RLock()
+
+    def atomic(fn):
+        def wrapper(*args, **kwargs):
+            with lock:
+                return fn(*args, **kwargs)
+        return wrapper
+
+    for name in ("get_item", "put_item", "update_item", "transact_write_items"):
+        monkeypatch.setattr(DynamoDBBackend, name, atomic(getattr(DynamoDBBackend, name)))
+
+    with moto.mock_aws():
+        import boto3
+        create_tables(boto3.client("dynamodb"))
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            import profile_handler
+        yield profile_handler
+
+
+def enroll_concurrently(profile_handler, email, subject):
+    """Run THREADS enroll() calls released together; returns (enrolled, already enrolled) counts."""
+    barrier = threading.Barrier(THREADS)
+
+    def one(_):
+        barrier.wait()
+        try:
+            profile_handler.enroll(email, subject, CURRICULUM)
+            return True
+        except profile_handler.AlreadyEnrolled:
+            return False
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        results = list(pool.map(one, range(THREADS)))
+    return results.count(True), results.count(False)
+
+
+def test_concurrent_enroll_on_clean_profile(profile_handler):
+    email = "clean@example.com"
+    enrolled, rejected = enroll_concurrently(profile_handler, email, "Physical Sciences")
+
+    assert (enrolled, rejected) == (1, THREADS - 1)
+    user = profile_handler.user_table.get_item(Key={'email': email})['Item']
+    assert user['subjects'] == {"Physical Sciences"}
+    subject = profile_handler.subject_table.get_item(
+        Key={'curriculum': CURRICULUM, 'subjectName': "Physical Sciences"})['Item']
+    assert subject['studentCount'] == 1
+
+
+def test_concurrent_enroll_keeps_other_subjects(profile_handler):
+    email = "enrolled@example.com"
+    profile_handler.enroll(email, "Mathematics", CURRICULUM)
+    enrolled, rejected = enroll_concurrently(profile_handler, email, "Life Sciences")
+
+    assert (enrolled, rejected) == (1, THREADS - 1)
+    user = profile_handler.user_table.get_item(Key={'email': email})['Item']
+    assert user['subjects'] == {"Mathematics", "Life Sciences"}